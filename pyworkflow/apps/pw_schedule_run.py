@@ -27,13 +27,15 @@
 
 import os
 import time
-import json
 import argparse
 
 from pyworkflow.em import *
 from pyworkflow.config import *
-from pyworkflow.protocol import (getProtocolFromDb,
-                                 STATUS_FINISHED, STATUS_ABORTED, STATUS_FAILED)
+import pyworkflow.utils as pwutils
+from pyworkflow.project import Project
+from pyworkflow.protocol import (STATUS_FINISHED, STATUS_ABORTED,
+                                 STATUS_FAILED, STATUS_LAUNCHED,
+                                 STATUS_RUNNING)
 
 
 # Add callback for remote debugging if available.
@@ -45,121 +47,141 @@ except ImportError:
     pass
 
 
-class RunScheduler():
-    """ Check that all dependencies are met before launching a run. """
+class ProjectScheduler():
+    """ Launch the scheduled runs of a project as soon as their inputs
+    are available and their prerequisites are done.
+    Only one scheduler runs for each project, holding a lock file in the
+    project Logs folder, and it exits when there are no scheduled runs left.
+    """
 
     def _parseArgs(self):
         parser = argparse.ArgumentParser()
         _addArg = parser.add_argument  # short notation
 
-        _addArg("projPath", metavar='PROJECT_NAME',
-                help="Project database path.")
+        _addArg("projPath", metavar='PROJECT_PATH',
+                help="Project path.")
 
-        _addArg("dbPath", metavar='DATABASE_PATH',
-                help="Protocol database path.")
-
-        _addArg("protId", type=int, metavar='PROTOCOL_ID',
-                help="Protocol ID.")
-
-        _addArg("--sleep_time", type=int, default=15,
+        _addArg("--sleep_time", type=int, default=3,
                 dest='sleepTime', metavar='SECONDS',
                 help="Sleeping time (in seconds) between updates.")
 
-        _addArg("--wait_for", nargs='*', type=int, default=[],
-                dest='waitProtIds', metavar='PROTOCOL_ID',
-                help="List of protocol ids that should be not running "
-                     "(i.e, finished, aborted or failed) before this "
-                     "run will be executed.")
+        _addArg("--max_runs", type=int,
+                default=int(os.environ.get('SCIPION_MAX_RUNS', 0)),
+                dest='maxRuns', metavar='N',
+                help="Maximum number of runs of the project (launched or "
+                     "running) allowed at the same time. Scheduled runs "
+                     "will wait until there is room for them. "
+                     "Use 0 (default) for no limit.")
 
         self._args = parser.parse_args()
 
-    def _loadProtocol(self):
-        return getProtocolFromDb(self._args.projPath,
-                                 self._args.dbPath,
-                                 self._args.protId, chdir=True)
+    def _log(self, msg):
+        print >> self._logFile, "%s: %s" % (pwutils.prettyTimestamp(), msg)
+        self._logFile.flush()
 
-    def main(self):
-        self._parseArgs()
+    def _isReady(self, protocol, runsDict):
+        """ Return True if all inputs of the protocol are available
+        and all its prerequisites are not running anymore.
+        """
+        for key, attr in protocol.iterInputAttributes():
+            if attr.hasValue() and attr.get() is None:
+                return False
 
         stopStatuses = [STATUS_FINISHED, STATUS_ABORTED, STATUS_FAILED]
 
-        # Enter to the project directory and load protocol from db
-        protocol = self._loadProtocol()
-        mapper = protocol.getMapper()
-
-        log = open(protocol._getLogsPath('schedule.log'), 'w')
-        pid = os.getpid()
-        protocol.setPid(pid)
-
-        prerequisites = map(int, protocol.getPrerequisites())
-
-        def _log(msg):
-            print >> log, "%s: %s" % (pwutils.prettyTimestamp(), msg)
-            log.flush()
-
-        _log("Scheduling protocol %s, pid: %s, prerequisites: %s"
-             % (protocol.getObjId(), pid, prerequisites))
+        for protId in protocol.getPrerequisites():
+            prot = runsDict.get(int(protId), None)
+            if prot is not None and prot.getStatus() not in stopStatuses:
+                return False
+
+        return True
+
+    def _reapChildren(self):
+        """ Collect the launched processes that have finished, otherwise
+        they would remain as zombies (and seem alive) while we run.
+        """
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except OSError:  # No children left
+            pass
+
+    def _schedule(self, project):
+        """ Check the scheduled runs and launch the ones that are ready.
+        Return the number of runs still waiting to be launched.
+        """
+        # The graph and the runs are only reloaded if the project db
+        # has changed, and only runs with a modified run.db are updated
+        graph = project.getRunsGraph()
+        runs = [n.run for n in graph.getNodes() if not n.isRoot()]
+        runsDict = dict((r.getObjId(), r) for r in runs)
+        scheduled = [r for r in runs if r.isScheduled()]
+
+        maxRuns = self._args.maxRuns
+        active = len([r for r in runs
+                      if r.getStatus() in [STATUS_LAUNCHED, STATUS_RUNNING]])
+
+        for prot in scheduled:
+            if maxRuns and active >= maxRuns:
+                break
+            if self._isReady(prot, runsDict):
+                self._log("Launching protocol %s >>>>" % prot.getObjId())
+                try:
+                    project.launchProtocol(prot, scheduled=True)
+                    active += 1
+                except Exception as e:
+                    # Do not stop launching other runs because of this one
+                    self._log("ERROR launching protocol %s: %s"
+                              % (prot.getObjId(), e))
+                    prot.setFailed(str(e))
+                    project._storeProtocol(prot)
+
+        return len([r for r in scheduled if r.isScheduled()])
 
-        mapper.store(protocol)
-        mapper.commit()
-        mapper.close()
+    def main(self):
+        self._parseArgs()
 
-        # Keep track of the last time the protocol was checked and
-        # its modification date to avoid unnecessary db opening
-        lastCheckedDict = {}
+        # Enter to the project directory and load it
+        project = Project(self._args.projPath)
+        lockPath = project.getSchedulerLockPath()
+        lock = pwutils.acquireLock(lockPath)
 
-        def _updateProtocol(protocol, project):
-            protDb = protocol.getDbPath()
+        if lock is None:
+            print "The scheduler of this project is already running."
+            return
 
-            if os.path.exists(protDb):
-                protId = protocol.getObjId()
-                lastChecked = lastCheckedDict.get(protId, None)
-                lastModified = pwutils.getFileLastModificationDate(protDb)
+        project.load(chdir=True, loadAllConfig=False)
+        # Store the pid in the lock file just for information
+        lock.truncate(0)
+        print >> lock, os.getpid()
+        lock.flush()
 
-                if lastChecked is None or (lastModified > lastChecked):
-                    project._updateProtocol(protocol,
-                                            skipUpdatedProtocols=False)
-                    _log("Updated protocol %s" % protId)
+        self._logFile = open(project.getLogPath('schedule.log'), 'a')
+        self._log("Scheduler started, pid: %s, max runs: %s"
+                  % (os.getpid(), self._args.maxRuns))
 
         while True:
-            protocol = self._loadProtocol()
-            project = protocol.getProject()
-
-            # Check if there are missing inputs
-            missing = False
-
-            _log("Checking input data...")
-            for key, attr in protocol.iterInputAttributes():
-                if attr.hasValue() and attr.get() is None:
-                    missing = True
-                    inputProt = attr.getObjValue()
-                    _updateProtocol(inputProt, project)
-
-            _log("Checking prerequisited...")
-            wait = False  # Check if we need to wait for required protocols
-            for protId in prerequisites:
-                prot = project.getProtocol(protId)
-                if prot is not None:
-                    _updateProtocol(prot, project)
-                    if prot.getStatus() not in stopStatuses:
-                        wait = True
-
-            if not missing and not wait:
-                break
-
-            project.mapper.commit()
-            project.mapper.close()
+            waiting = self._schedule(project)
+
+            if not waiting:
+                # Release the lock before checking again, a run
+                # scheduled after that will start a new scheduler
+                lock.close()
+                if not any(r.isScheduled() for r in project.getRuns()):
+                    break
+                lock = pwutils.acquireLock(lockPath)
+                if lock is None:  # Other scheduler took over
+                    break
+                continue
 
-            _log("Still missing input, sleeping %s seconds..."
-                 % self._args.sleepTime)
             time.sleep(self._args.sleepTime)
+            self._reapChildren()
 
-        _log("Launching the protocol >>>>")
-        log.close()
-        project.launchProtocol(protocol, scheduled=True)
+        self._log("No more scheduled runs, exiting.")
+        self._logFile.close()
+        project.closeMapper()
 
 
 if __name__ == '__main__':
-    scheduler = RunScheduler()
+    scheduler = ProjectScheduler()
     scheduler.main()
-
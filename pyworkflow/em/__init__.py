@@ -31,7 +31,8 @@ import sys
 
 import pyworkflow as pw
 import pyworkflow.utils as pwutils
-from pyworkflow.utils.reflection import getSubclassesFromModules, getSubclasses, getModules
+from pyworkflow.utils.reflection import (getSubclassesFromModules, getSubclasses,
+                                        getModules, LazyClassDict)
 from data import *
 from data_tiltpairs import *
 from protocol import *
@@ -45,7 +46,13 @@ import transformations
 #from packages import *
 
 PACKAGES_PATH = os.path.join(pw.HOME, 'em', 'packages')
+# File where the classes found in each package are cached between runs
+REGISTRY_FILE = os.path.join(pw.SCIPION_USER_DATA, 'tmp', 'em_registry.json')
 _emPackagesDict = None
+_emLoadedPackages = {}
+_emRegistry = None
+_emDicts = {}
+
 
 def getPackages():
     global _emPackagesDict
@@ -55,45 +62,235 @@ def getPackages():
         sys.path.pop(0)
     return _emPackagesDict
 
-# Load all Protocol subclasses found in EM-packages
-_emProtocolsDict = None
+
+def getPackage(pkgName):
+    """ Import a single em-package (if not already imported) and return it.
+    None is returned if the package can not be loaded.
+    """
+    if _emPackagesDict is not None:
+        return _emPackagesDict.get(pkgName, None)
+
+    if pkgName not in _emLoadedPackages:
+        # Packages import each other as top level modules
+        if PACKAGES_PATH not in sys.path:
+            sys.path.append(PACKAGES_PATH)
+        try:
+            _emLoadedPackages[pkgName] = __import__(pkgName)
+        except Exception, ex:
+            print ">>> Error loading module: '%s'" % pkgName
+            print ">>> Exception: ", ex
+            import traceback
+            traceback.print_exc()
+            _emLoadedPackages[pkgName] = None
+
+    return _emLoadedPackages[pkgName]
+
+
+def findClassPackage(cls):
+    """ Return the em-package where this class is defined (and
+    set its _package attribute) or None if not from any package.
+    """
+    moduleName = cls.__module__.replace('pyworkflow.em.packages.', '')
+    pkgName = moduleName.split('.')[0]
+
+    if not os.path.exists(os.path.join(PACKAGES_PATH, pkgName, '__init__.py')):
+        return None
+
+    if '_package' not in cls.__dict__:
+        pkg = getPackage(pkgName)
+        if pkg is None:
+            return None
+        cls._package = pkg
+
+    return cls._package
+
+
+# Base classes for which the subclasses are registered
+_registryBases = [('protocols', Protocol),
+                  ('objects', EMObject),
+                  ('viewers', Viewer),
+                  ('wizards', Wizard)]
+
+
+def _getPackageNames():
+    """ Names of the em-packages folders. """
+    return [f for f in sorted(os.listdir(PACKAGES_PATH))
+            if os.path.exists(os.path.join(PACKAGES_PATH, f, '__init__.py'))]
+
+
+def _getPackageSignature(pkgName):
+    """ Signature of the sources of an em-package, if any file is modified,
+    added or removed, the classes of the package should be found again.
+    The Scipion config files are also included, since packages usually
+    fail to import because of a variable missing there.
+    """
+    import hashlib
+    pkgPath = os.path.join(PACKAGES_PATH, pkgName)
+    sign = hashlib.md5(pkgPath)
+    for fn in [os.environ.get('SCIPION_CONFIG'),
+               os.environ.get('SCIPION_LOCAL_CONFIG')]:
+        if fn and os.path.exists(fn):
+            sign.update('%s %s;' % (fn, os.path.getmtime(fn)))
+    for root, dirs, files in os.walk(pkgPath):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith('.py'):
+                fn = os.path.join(root, f)
+                sign.update('%s %s;' % (fn, os.path.getmtime(fn)))
+    return sign.hexdigest()
+
+
+def _getTargetNames(cls):
+    """ Name of the classes targeted by a Viewer or Wizard. """
+    names = []
+    for t in getattr(cls, '_targets', []):
+        if isinstance(t, tuple): # wizards targets are (class, params)
+            t = t[0]
+        names.append(getattr(t, '__name__', str(t)))
+    return names
+
+
+def _findPackageClasses(pkgName):
+    """ Import the em-package and find the subclasses of the registry bases
+    that it provides. For each class store the package where it is defined,
+    its environments and target class names (these two only used for
+    viewers and wizards).
+    Return None if the package can not be imported.
+    """
+    pkg = getPackage(pkgName)
+    if pkg is None:
+        return None
+
+    classes = {}
+    for key, BaseClass in _registryBases:
+        classes[key] = classesInfo = {}
+        subclasses = getSubclassesFromModules(BaseClass, {pkgName: pkg})
+        for name, cls in subclasses.iteritems():
+            if pkg.__dict__.get(name) is cls:
+                definedIn = cls.__module__.replace('pyworkflow.em.packages.',
+                                                   '').split('.')[0]
+                classesInfo[name] = [definedIn,
+                                     list(getattr(cls, '_environments', [])),
+                                     _getTargetNames(cls)]
+    return classes
+
+
+def _mergePackagesClasses(packagesInfo):
+    """ Build the registry from the classes found in each package.
+    A class provided by several packages is registered in the one where
+    it is defined, or in the first one by name otherwise.
+    """
+    registry = dict((key, {}) for key, _ in _registryBases)
+
+    for pkgName in sorted(packagesInfo):
+        classes = packagesInfo[pkgName]['classes']
+        if classes is None:
+            continue  # the package could not be imported
+        for key, classesInfo in classes.iteritems():
+            for name, (definedIn, envs, targets) in classesInfo.iteritems():
+                if name not in registry[key] or definedIn == pkgName:
+                    registry[key][name] = [pkgName, envs, targets]
+    return registry
+
+
+def getRegistry():
+    """ Return the registry of classes provided by the em-packages.
+    The classes found in each package are read from REGISTRY_FILE while
+    the package has not changed, avoiding to import all packages at
+    startup. Packages that could not be imported are also recorded, so
+    they are only tried again when their files change.
+    """
+    global _emRegistry
+
+    if _emRegistry is None:
+        import json
+
+        try:
+            with open(REGISTRY_FILE) as f:
+                cached = json.load(f)['packages']
+        except Exception:
+            cached = {}  # missing, old or corrupted cache, build it again
+
+        packagesInfo = {}
+        for pkgName in _getPackageNames():
+            signature = _getPackageSignature(pkgName)
+            info = cached.get(pkgName)
+            if info is None or info.get('signature') != signature:
+                info = {'signature': signature,
+                        'classes': _findPackageClasses(pkgName)}
+            packagesInfo[pkgName] = info
+
+        _emRegistry = _mergePackagesClasses(packagesInfo)
+
+        if packagesInfo != cached:
+            try:
+                pwutils.makeFilePath(REGISTRY_FILE)
+                # Write and rename to not expose a half-written file
+                # to other processes reading it at the same time
+                tmpFile = '%s.%d' % (REGISTRY_FILE, os.getpid())
+                with open(tmpFile, 'w') as f:
+                    json.dump({'packages': packagesInfo}, f)
+                os.rename(tmpFile, REGISTRY_FILE)
+            except Exception, ex:
+                print ">>> Error writing em classes registry: ", ex
+
+    return _emRegistry
+
+
+def _getClassesLoader(BaseClass):
+    """ Return a function to load the subclasses of BaseClass from a package.
+    """
+    def loader(pkgName):
+        pkg = getPackage(pkgName)
+        if pkg is None:
+            return {}
+        return getSubclassesFromModules(BaseClass, {pkgName: pkg})
+    return loader
+
+
+def _getClassesDict(key, BaseClass, coreDict=None):
+    """ Return a LazyClassDict with the subclasses of BaseClass, the
+    em-packages will only be imported when one of its classes is used.
+    """
+    if key not in _emDicts:
+        classesDict = LazyClassDict()
+        loader = _getClassesLoader(BaseClass)
+        for name, info in getRegistry()[key].iteritems():
+            classesDict.addLazy(str(name), loader, str(info[0]))
+        if coreDict is not None:
+            classesDict.update(getSubclasses(BaseClass, coreDict))
+        _emDicts[key] = classesDict
+    return _emDicts[key]
+
 
 def getProtocols():
     """ Load all protocols subclasses defined in all em-packages. """
-    global _emProtocolsDict
-    if _emProtocolsDict is None:
-        _emProtocolsDict = getSubclassesFromModules(Protocol, getPackages())
-        _emProtocolsDict.update(getSubclasses(Protocol, globals()))
-    return _emProtocolsDict
+    return _getClassesDict('protocols', Protocol, globals())
 
-_emObjectsDict = None 
 
 def getObjects():
     """ Load all EMObject subclasses found in EM-packages. """
-    global _emObjectsDict
-    if _emObjectsDict is None:        
-        _emObjectsDict = getSubclassesFromModules(EMObject, getPackages())
-        _emObjectsDict.update(getSubclasses(EMObject, globals()))
-    return _emObjectsDict
+    return _getClassesDict('objects', EMObject, globals())
 
-_emViewersDict = None
 
 def getViewers():
     """ Load all subclasses of Viewer of different packages. """
-    global _emViewersDict
-    if _emViewersDict is None:
-        _emViewersDict = getSubclassesFromModules(Viewer, getPackages())
-    return _emViewersDict
+    return _getClassesDict('viewers', Viewer)
 
-_emWizardsDict = None
 
 def getWizards():
     """ Load all subclasses of Wizards. """
-    global _emWizardsDict
-    if _emWizardsDict is None:
-        _emWizardsDict = getSubclassesFromModules(Wizard, getPackages())
-    return _emWizardsDict
-        
+    return _getClassesDict('wizards', Wizard)
+
+
+def _findRegistered(key, environment, baseClasses):
+    """ Find the name of registered viewers or wizards for
+    the given environment that target any of baseClasses.
+    """
+    baseNames = set(cls.__name__ for cls in baseClasses)
+    return [name for name, (_, envs, targets) in getRegistry()[key].iteritems()
+            if environment in envs and baseNames.intersection(targets)]
+
         
 def findClass(className):
     
@@ -122,7 +319,12 @@ def findViewers(className, environment):
     viewers = []
     cls = findClass(className)
     baseClasses = cls.mro()
-    for viewer in getViewers().values():
+    viewersDict = getViewers()
+    # Only load the viewers registered for this class
+    for viewerName in _findRegistered('viewers', environment, baseClasses):
+        viewer = viewersDict.get(viewerName)
+        if viewer is None:
+            continue
         if environment in viewer._environments:
             for t in viewer._targets:
                 if t in baseClasses:
@@ -150,7 +352,12 @@ def findWizards(protocol, environment):
     """ Find availables wizards for this class. 
     Returns:
         a dict with the paramName and wizards for this class."""
-    return findWizardsFromDict(protocol, environment, getWizards())
+    wizardsDict = getWizards()
+    # Only load the wizards registered for this protocol class
+    wizNames = _findRegistered('wizards', environment,
+                               protocol.getClass().mro())
+    wizDict = dict((n, wizardsDict[n]) for n in wizNames if n in wizardsDict)
+    return findWizardsFromDict(protocol, environment, wizDict)
 
 # Update global dictionary with variables found
 #globals().update(emProtocolsDict)
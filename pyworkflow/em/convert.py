@@ -27,12 +27,16 @@
 import os
 import sys
 from itertools import izip
+from collections import OrderedDict
+import multiprocessing
 import PIL
+import numpy as np
 
 import xmipp
 import pyworkflow.utils as pwutils
 
 from constants import *
+import image_file
 
 
 
@@ -56,6 +60,13 @@ class ImageHandler(object):
     DT_COMPLEXDOUBLE = xmipp.DT_COMPLEXDOUBLE
     DT_BOOL = xmipp.DT_BOOL
     DT_LASTENTRY = xmipp.DT_LASTENTRY
+
+    # Map numpy types (kind, size) of images read with image_file
+    _numpyTypes = {('i', 1): DT_SCHAR,
+                   ('u', 1): DT_UCHAR,
+                   ('i', 2): DT_SHORT,
+                   ('u', 2): DT_USHORT,
+                   ('f', 4): DT_FLOAT}
     
     def __init__(self):
         # Now it will use Xmipp image library
@@ -216,6 +227,8 @@ class ImageHandler(object):
         #     else:
         #         raise Exception("Conversion from tif to %s is not "
         #                         "implemented yet. " % pwutils.getExt(outputFn))
+        elif self._convertStackNumpy(inputFn, outputFn, firstImg, lastImg):
+            pass  # Done without reading the whole input or calling Xmipp
         else:
             # get input dim
             (x, y, z, n) = xmipp.getImageSize(inputFn)
@@ -236,7 +249,66 @@ class ImageHandler(object):
             xmipp.createEmptyFile(outputFn,x,y,1,n, dataType)
             for i, j in izip(range(firstImg, lastImg + 1), range(1, n+1)):
                 self.convert((i, inputFn), (j, outputFn))
-    
+
+    def _convertStackNumpy(self, inputFn, outputFn, firstImg, lastImg,
+                           chunkSize=100):
+        """ Convert a stack using memory-mapped MRC or SPIDER files, copying
+        chunkSize images at a time. Only MRC output is written this way.
+        Return False if the conversion could not be done.
+        """
+        inFile = self._openImageFile(inputFn)
+        outFn, outFormat = image_file.splitFileName(outputFn)
+        if inFile is None or outFormat not in ['.mrc', '.mrcs']:
+            return False
+
+        x, y, z, n = inFile.getDimensions()
+        dtype = inFile.getDataType().newbyteorder('=')
+        if dtype not in [np.float32, np.int16, np.uint16]:
+            return False  # Let Xmipp handle other types conversion
+
+        if (firstImg and lastImg) is None:
+            firstImg, lastImg = 1, max(z, n)
+        # Volumes (z > 1 and n = 1) are written as stacks of 2D images
+        if n == 1 and z > 1:
+            z, n = 1, z
+
+        outN = lastImg - firstImg + 1
+        outFile = image_file.ImageFile.createMrc(outFn, (x, y, 1, outN),
+                                                 dtype, inFile.getSampling())
+        outData = outFile.getData().reshape((outN, y, x))
+        inData = inFile.getData().reshape((n, y, x))
+        dmin, dmax, dsum, dsum2 = None, None, 0., 0.
+
+        for i in range(firstImg - 1, lastImg, chunkSize):
+            j = i - firstImg + 1
+            chunk = inData[i:min(i + chunkSize, lastImg)]
+            outData[j:j + len(chunk)] = chunk
+            dmin = chunk.min() if dmin is None else min(dmin, chunk.min())
+            dmax = chunk.max() if dmax is None else max(dmax, chunk.max())
+            dsum += chunk.sum(dtype=np.float64)
+            dsum2 += np.square(chunk, dtype=np.float64).sum()
+
+        size = float(x * y * outN)
+        mean = dsum / size
+        std = np.sqrt(max(dsum2 / size - mean**2, 0))
+        outFile.close()
+        outFile.setStats(dmin, dmax, mean, std)
+        inFile.close()
+        return True
+
+    def _openImageFile(self, locationObj):
+        """ Open the file of the given location with image_file if its
+        format is supported. Return None otherwise, or if the file can not
+        be read, so Xmipp should be used instead.
+        """
+        fn = self._convertToLocation(locationObj)[1]
+        if image_file.isSupported(fn):
+            try:
+                return image_file.ImageFile(fn)
+            except Exception:
+                pass
+        return None
+
     def getDimensions(self, locationObj):
         """ It will return a tuple with the images dimensions.
         The tuple will contains:
@@ -258,19 +330,46 @@ class ImageHandler(object):
                 # we are opening an Eman2 process to read the .img files
                 from pyworkflow.em.packages.eman2.convert import getImageDimensions
                 return getImageDimensions(fn) # we are ignoring index here
-            else:
-                self._img.read(location, xmipp.HEADER)
-                return self._img.getDimensions()
+
+            imgFile = self._openImageFile(location)
+            if imgFile is not None:
+                x, y, z, n = imgFile.getDimensions()
+                # As in Xmipp, a single image is read when using an index
+                return x, y, z, 1 if location[0] != NO_INDEX else n
+
+            self._img.read(location, xmipp.HEADER)
+            return self._img.getDimensions()
         else:
             return None, None, None, None
     
     def getDataType(self, locationObj):
         if self.existsLocation(locationObj):
+            imgFile = self._openImageFile(locationObj)
+            if imgFile is not None:
+                dtype = imgFile.getDataType()
+                return self._numpyTypes[(dtype.kind, dtype.itemsize)]
+
             location = self._convertToLocation(locationObj)
             self._img.read(location, xmipp.HEADER)
             return self._img.getDataType()
         else:
             return None
+
+    def getData(self, locationObj):
+        """ Return the data of the image in the given location as a numpy
+        array. For MRC and SPIDER files, this is a memory-mapped view of the
+        file, so only the data of that image is read from disk.
+        Other formats are read with Xmipp.
+        """
+        location = self._convertToLocation(locationObj)
+        imgFile = self._openImageFile(location)
+
+        if imgFile is not None:
+            index = location[0]
+            return imgFile.getData(None if index == NO_INDEX else index)
+
+        self._img.read(location)
+        return self._img.getData()
     
     def read(self, inputObj):
         """ Create a new Image class from inputObj 
@@ -303,32 +402,65 @@ class ImageHandler(object):
         If inputSet is a SetOfImages subclass, we will iterate
         and compute the average from all images.
         """
-        if isinstance(inputSet, basestring):
-            _, _, _, n = self.getDimensions(inputSet)
-            if n:
-                avgImage = self.read((1, inputSet))
-                
-                for i in range(2, n+1):
-                    self._img.read((i, inputSet))
-                    avgImage.inplaceAdd(self._img)
-                
-                avgImage.inplaceDivide(n)
-                return avgImage
-        else:
-            n = inputSet.getSize()
-            if n:
-                imageIter = iter(inputSet)
-                img = imageIter.next()
-                avgImage = self.read(img)
-                
-                for img in imageIter:
-                    self._img.read(self._convertToLocation(img))
-                    avgImage.inplaceAdd(self._img)
-                
-                avgImage.inplaceDivide(n)
-                return avgImage
+        stats = self.computeStats(inputSet)
+
+        if stats.getSize():
+            avgImage = self.createImage()
+            avgImage.setData(stats.getAverage().astype(np.float32))
+            return avgImage
         
         return None
+
+    def computeStats(self, inputSet, bins=None, binsRange=None,
+                     numberOfProcs=1, chunkSize=100):
+        """ Compute the statistics of all images in a stack (filename)
+        or in a SetOfImages subclass, in a single pass over the data.
+        Images are grouped by file and read in chunks of chunkSize images,
+        memory-mapping MRC and SPIDER files (other formats are read
+        with Xmipp). If numberOfProcs > 1, files are processed in parallel.
+        If bins is given, a histogram is also computed in binsRange, if
+        no range is given an extra pass is done to find the min and max.
+        Return an image_file.ImageStats object.
+        """
+        if bins and binsRange is None:
+            stats = self.computeStats(inputSet, numberOfProcs=numberOfProcs,
+                                      chunkSize=chunkSize)
+            if not stats.getSize():
+                return stats
+            binsRange = stats.getStats()[2:]
+
+        groups = self._groupLocations(inputSet)
+        args = [(fn, indexes, chunkSize, bins, binsRange)
+                for fn, indexes in groups.iteritems()]
+        stats = image_file.ImageStats(bins, binsRange)
+
+        if numberOfProcs > 1 and len(args) > 1:
+            pool = multiprocessing.Pool(min(numberOfProcs, len(args)))
+            try:
+                for fileStats in pool.imap(_computeFileStats, args):
+                    stats.merge(fileStats)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for fileArgs in args:
+                stats.merge(_computeFileStats(fileArgs))
+
+        return stats
+
+    def _groupLocations(self, inputSet):
+        """ Return a dict with the filenames of the images and the list
+        of indexes used from each file. If inputSet is a filename, all
+        its images are used (NO_INDEX).
+        """
+        if isinstance(inputSet, basestring):
+            return OrderedDict([(inputSet, [NO_INDEX])])
+
+        groups = OrderedDict()
+        for img in inputSet:
+            index, fn = self._convertToLocation(img)
+            groups.setdefault(fn, []).append(index)
+        return groups
     
     def invertStack(self, inputFn, outputFn):
         #get input dim
@@ -462,6 +594,77 @@ class ImageHandler(object):
 DT_FLOAT = ImageHandler.DT_FLOAT
 
 
+def _computeFileStats(args):
+    """ Compute the statistics of the images with the given indexes of a
+    file (NO_INDEX for all of them). Used from ImageHandler.computeStats,
+    it should be a module function to be used from a pool of processes.
+    """
+    fn, indexes, chunkSize, bins, binsRange = args
+    stats = image_file.ImageStats(bins, binsRange)
+    ih = ImageHandler()
+    imgFile = ih._openImageFile(fn)
+
+    if imgFile is None:
+        # Read the images with Xmipp, one at a time
+        if NO_INDEX in indexes:
+            n = ih.getDimensions(fn)[3] or 0
+            indexes = range(1, n + 1) if n > 1 else [NO_INDEX] * n
+        for index in indexes:
+            stats.add(ih.read((index, fn)).getData()[np.newaxis])
+    elif NO_INDEX in indexes:
+        for chunk in imgFile.iterChunks(chunkSize):
+            stats.add(chunk)
+    else:
+        indexes = sorted(indexes)  # Read the file sequentially
+        for i in range(0, len(indexes), chunkSize):
+            stats.add(imgFile.getImages(indexes[i:i + chunkSize]))
+
+    if imgFile is not None:
+        imgFile.close()
+
+    return stats
+
+
+def formatRows(fmt, columns):
+    """ Format the rows given by several columns (lists or numpy arrays
+    of the same length) with a single string formatting operation,
+    which is much faster than formatting the rows one by one.
+    Params:
+        fmt: format of each row, e.g. '%d %d\n'
+        columns: list with the values of each column.
+    """
+    k = len(columns)
+    n = len(columns[0]) if k else 0
+    values = [None] * (n * k)
+    for i, column in enumerate(columns):
+        values[i::k] = np.asarray(column).tolist()
+
+    return (fmt * n) % tuple(values)
+
+
+def writeCoordinatesByMicrograph(coordSet, labels, writeFunc,
+                                 numberOfThreads=1):
+    """ Call writeFunc(micId, columns) with the values of the given
+    labels for the coordinates of each micrograph (see
+    SetOfCoordinates.iterMicrographColumns). If numberOfThreads > 1,
+    the files are written from a pool of threads while the coordinates
+    of the next micrographs are read.
+    """
+    groups = coordSet.iterMicrographColumns(labels)
+
+    if numberOfThreads > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(numberOfThreads)
+        results = [pool.apply_async(writeFunc, args) for args in groups]
+        pool.close()
+        for r in results:
+            r.get()  # Raise the exception if some writeFunc failed
+        pool.join()
+    else:
+        for micId, columns in groups:
+            writeFunc(micId, columns)
+
+
 def downloadPdb(pdbId, pdbFile, log=None):
     pdbGz = pdbFile + ".gz"
     result = (__downloadPdb(pdbId, pdbGz, log) and 
@@ -548,13 +751,11 @@ def getSubsetByDefocus(inputCTFs, inputMics, nMics):
     Params:
         nMics is the number of micrographs that will be in the subset.
     """
-    sortedMicIds = []
-
     # Sort CTFs by defocus and select only those that match with inputMics
-    for ctf in inputCTFs.iterItems(orderBy='_defocusU'):
-        ctfId = ctf.getObjId()
-        if ctfId in inputMics:
-            sortedMicIds.append(ctfId)
+    inputMicIds = set(inputMics.getColumnArray('id').tolist())
+    sortedMicIds = [ctfId for ctfId, in inputCTFs.iterValues(['id'],
+                                                            orderBy='_defocusU')
+                    if ctfId in inputMicIds]
 
     # Take an equally spaced subset of micrographs
     space = len(sortedMicIds) / (nMics - 1)
@@ -31,6 +31,7 @@ for EM data objects like: Image, SetOfImage and others
 
 import os
 import json
+from collections import OrderedDict
 from pyworkflow.object import *
 from constants import *
 from convert import ImageHandler
@@ -771,6 +772,12 @@ class EMSet(Set, EMObject):
         This is useful to set new attributes or update values
         for each item.
         """
+        self.appendMany(self._iterItemsToCopy(otherSet, updateItemCallback,
+                                              itemDataIterator, copyDisabled))
+
+    def _iterItemsToCopy(self, otherSet, updateItemCallback,
+                         itemDataIterator, copyDisabled):
+        """ Generate the copies of the items to be added by copyItems. """
         for item in otherSet:
             # copy items if enabled or copyDisabled=True
             if copyDisabled or item.isEnabled():
@@ -782,7 +789,7 @@ class EMSet(Set, EMObject):
                 # If updateCallBack function returns attribute
                 # _appendItem to False do not append the item
                 if getattr(newItem, "_appendItem", True):
-                    self.append(newItem)
+                    yield newItem
             else:
                 if itemDataIterator is not None:
                     next(itemDataIterator)  # just skip disabled data row
@@ -794,6 +801,7 @@ class EMSet(Set, EMObject):
 class SetOfImages(EMSet):
     """ Represents a set of Images """
     ITEM_TYPE = Image
+    INDEXES = ['_filename']
 
     def __init__(self, **kwargs):
         EMSet.__init__(self, **kwargs)
@@ -862,8 +870,8 @@ class SetOfImages(EMSet):
     def setIsAmplitudeCorrected(self, value):
         self._isAmplitudeCorrected.set(value)
 
-    def append(self, image):
-        """ Add a image to the set. """
+    def _prepareItem(self, image):
+        """ Update the image before being added to the set. """
         # If the sampling rate was set before, the same value
         # will be set for each image added to the set
         if self.getSamplingRate() or not image.getSamplingRate():
@@ -881,7 +889,23 @@ class SetOfImages(EMSet):
         if self.isEmpty():
             self._setFirstDim(image)
 
-        EMSet.append(self, image)
+    def _prepareItems(self, images):
+        """ Same as _prepareItem for several images, but the sampling
+        rate and acquisition of the set are only read once.
+        """
+        samplingRate = self.getSamplingRate()
+        acquisition = self.getAcquisition() if self.hasAcquisition() else None
+        checkFirstDim = self.isEmpty()
+
+        for image in images:
+            if samplingRate or not image.getSamplingRate():
+                image.setSamplingRate(samplingRate)
+            if acquisition is not None and not image.hasAcquisition():
+                image.setAcquisition(acquisition)
+            if checkFirstDim:
+                self._setFirstDim(image)
+                checkFirstDim = False
+            yield image
 
     def _setFirstDim(self, image):
         """ Store dimensions when the first image is found.
@@ -980,10 +1004,21 @@ class SetOfImages(EMSet):
         """ Return the string representing the dimensions. """
         return str(self._firstDim)
 
-    def iterItems(self, orderBy='id', direction='ASC', where='1'):
+    def iterItems(self, orderBy='id', direction='ASC', where='1',
+                  columns=None, limit=None, offset=None):
         """ Redefine iteration to set the acquisition to images. """
+        if columns is not None:
+            # Only some attributes are requested, so the acquisition
+            # is not needed
+            for img in Set.iterItems(self, orderBy=orderBy,
+                                     direction=direction, where=where,
+                                     columns=columns, limit=limit,
+                                     offset=offset):
+                yield img
+            return
+
         for img in Set.iterItems(self, orderBy=orderBy, direction=direction,
-                                 where=where):
+                                 where=where, limit=limit, offset=offset):
             # Sometimes the images items in the set could
             # have the acquisition info per data row and we
             # don't want to override with the set acquisition for this case
@@ -1061,6 +1096,7 @@ class SetOfParticles(SetOfImages):
     """
     ITEM_TYPE = Particle
     REP_TYPE = Particle
+    INDEXES = ['_filename', '_micId', '_classId']
 
     def __init__(self, **kwargs):
         SetOfImages.__init__(self, **kwargs)
@@ -1249,6 +1285,7 @@ class SetOfCoordinates(EMSet):
     The SetOfCoordinates can also have information about TiltPairs.
     """
     ITEM_TYPE = Coordinate
+    INDEXES = ['_micId']
 
     def __init__(self, **kwargs):
         EMSet.__init__(self, **kwargs)
@@ -1297,6 +1334,42 @@ class SetOfCoordinates(EMSet):
         for coord in self.iterItems(where=coordWhere):
             yield coord
 
+    def iterMicrographColumns(self, labels, chunkSize=100000):
+        """ Iterate over the coordinates grouped by micrograph, without
+        building the Coordinate objects. The values are read with a
+        single query sorted by micrograph and split in groups.
+        Params:
+            labels: list of coordinate attributes (e.g. ['id', '_x', '_y'])
+            chunkSize: number of rows read from the database at once.
+        Returns:
+            (micId, columns) pairs, where columns is a dict with a numpy
+            array of values for each label.
+        """
+        pieces = []  # Records of the current micrograph
+        lastMicId = None
+
+        for chunk in self.iterValues(['_micId'] + labels,
+                                     orderBy=['_micId', 'id'],
+                                     chunkSize=chunkSize):
+            micIds = chunk['_micId']
+            bounds = np.flatnonzero(micIds[1:] != micIds[:-1]) + 1
+            for i, j in zip([0] + bounds.tolist(),
+                            bounds.tolist() + [len(chunk)]):
+                micId = int(micIds[i])
+                if micId != lastMicId and pieces:
+                    yield lastMicId, self.__joinColumns(pieces, labels)
+                    pieces = []
+                pieces.append(chunk[i:j])
+                lastMicId = micId
+
+        if pieces:
+            yield lastMicId, self.__joinColumns(pieces, labels)
+
+    def __joinColumns(self, pieces, labels):
+        # Join by columns, the type of each chunk could be different
+        return OrderedDict((label, np.concatenate([p[label] for p in pieces]))
+                           for label in labels)
+
     def getMicrographs(self):
         """ Returns the SetOfMicrographs associated with
         this SetOfCoordinates"""
@@ -1330,6 +1403,8 @@ class SetOfCoordinates(EMSet):
 
 
 class Matrix(Scalar):
+    __slots__ = ('_matrix',) + OBJECT_SLOTS
+
     def __init__(self, **kwargs):
         Scalar.__init__(self, **kwargs)
         self._matrix = np.eye(4)
@@ -1515,6 +1590,13 @@ class SetOfClasses(EMSet):
         EMSet._insertItem(self, classItem)
         classItem.write(properties=False)  # Set.write(self)
 
+    def appendMany(self, classItems, batchSize=None):
+        """ Classes need to setup their own mapper when inserted,
+        so they are always appended one by one.
+        """
+        for classItem in classItems:
+            self.append(classItem)
+
     def __getitem__(self, itemId):
         """ Setup the mapper classes before returning the item. """
         classItem = EMSet.__getitem__(self, itemId)
@@ -1526,9 +1608,12 @@ class SetOfClasses(EMSet):
         self._setItemMapperPath(classItem)
         return classItem
 
-    def iterItems(self, orderBy='id', direction='ASC'):
+    def iterItems(self, orderBy='id', direction='ASC', where='1',
+                  columns=None, limit=None, offset=None):
         for classItem in EMSet.iterItems(self, orderBy=orderBy,
-                                         direction=direction):
+                                         direction=direction, where=where,
+                                         columns=columns, limit=limit,
+                                         offset=offset):
             self._setItemMapperPath(classItem)
             yield classItem
 
@@ -0,0 +1,434 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module contains a minimal reader (and writer) of MRC and SPIDER files
+implemented with numpy. Only the header is read and the data is accessed
+through numpy memory-mapped arrays, so reading a single image of a big
+stack does not require to read the whole file.
+It is used by ImageHandler, that falls back to Xmipp for other formats.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+
+MRC_EXTS = ['.mrc', '.mrcs', '.map']
+SPIDER_EXTS = ['.spi', '.stk', '.xmp', '.vol']
+
+MRC_HEADER_SIZE = 1024
+# Supported MRC modes (complex and packed modes are not)
+MRC_MODES = {0: np.int8,
+             1: np.int16,
+             2: np.float32,
+             6: np.uint16}
+
+SPIDER_IFORMS = [1, 3]  # 2D image and 3D volume (no Fourier formats)
+
+
+def splitFileName(filename):
+    """ Split a filename with an optional format suffix, such as
+    volume.mrc:mrc or movie.mrc:mrcs, into the filename and the format.
+    If there is no suffix, the format is taken from the extension.
+    """
+    if ':' in filename:
+        fn, fmt = filename.rsplit(':', 1)
+        fmt = '.' + fmt.lower()
+    else:
+        fn = filename
+        fmt = os.path.splitext(fn)[1].lower()
+    return fn, fmt
+
+
+def isSupported(filename):
+    """ Return True if the file format can be read by ImageFile. """
+    fmt = splitFileName(filename)[1]
+    return fmt in MRC_EXTS or fmt in SPIDER_EXTS
+
+
+class ImageFile(object):
+    """ Header information and memory-mapped data of an MRC or SPIDER file.
+    If the file can not be handled (unsupported mode, Fourier SPIDER
+    files, wrong header...), the constructor raises an Exception.
+    Images in stacks are indexed starting at 1, as in Xmipp.
+    """
+    def __init__(self, filename, mode='r'):
+        self._filename, fmt = splitFileName(filename)
+        self._mode = mode
+
+        with open(self._filename, 'rb') as f:
+            header = f.read(MRC_HEADER_SIZE)
+
+        if fmt in MRC_EXTS:
+            self._readMrcHeader(header, fmt, hasSuffix=':' in filename)
+        elif fmt in SPIDER_EXTS:
+            self._readSpiderHeader(header)
+        else:
+            raise Exception("Unsupported image format: %s" % fmt)
+
+        x, y, z, n = self._dims
+        imageBytes = self._imageHeader + x * y * z * self._dtype.itemsize
+        if os.path.getsize(self._filename) < self._offset + n * imageBytes:
+            raise Exception("File %s is smaller than expected from its "
+                            "header." % self._filename)
+
+        self._mmap = None
+        self._data = None
+
+    def _readMrcHeader(self, header, fmt, hasSuffix):
+        # Check the machine stamp to know the endianness,
+        # some old files do not set it, so check that the mode is valid
+        machst = header[212:214]
+        if machst == '\x11\x11':
+            endian = '>'
+        elif machst in ['\x44\x44', '\x44\x41']:
+            endian = '<'
+        else:
+            mode = struct.unpack('<i', header[12:16])[0]
+            endian = '<' if mode in MRC_MODES else '>'
+
+        nx, ny, nz, mode = struct.unpack(endian + '4i', header[:16])
+        if mode not in MRC_MODES or min(nx, ny, nz) < 1:
+            raise Exception("Unsupported MRC file: %s (mode %d)"
+                            % (self._filename, mode))
+
+        mx, my, mz = struct.unpack(endian + '3i', header[28:40])
+        cellx = struct.unpack(endian + 'f', header[40:44])[0]
+        ispg, nsymbt = struct.unpack(endian + '2i', header[88:96])
+
+        # Same behaviour as Xmipp: .mrcs files (or :mrcs suffix) are stacks,
+        # :mrc suffix forces a volume and otherwise use the space group
+        if fmt == '.mrcs':
+            isStack = True
+        elif hasSuffix:
+            isStack = False
+        else:
+            isStack = ispg == 0 and nz > 1
+
+        self._endian = endian
+        self._dtype = np.dtype(MRC_MODES[mode]).newbyteorder(endian)
+        self._offset = MRC_HEADER_SIZE + nsymbt
+        self._imageHeader = 0
+        self._dims = (nx, ny, 1, nz) if isStack else (nx, ny, nz, 1)
+        self._sampling = cellx / mx if mx > 0 and cellx > 0 else 1.0
+        self._isMrc = True
+
+    def _readSpiderHeader(self, header):
+        for endian in '<>':
+            values = struct.unpack(endian + '27f', header[:108])
+            nz, ny, iform, nx = values[0], values[1], values[4], values[11]
+            if int(iform) in SPIDER_IFORMS and min(nx, ny, nz) >= 1:
+                break
+        else:
+            raise Exception("Unsupported SPIDER file: %s" % self._filename)
+
+        nx, ny, nz = int(nx), int(ny), int(nz)
+        labbyt = int(values[21])
+        istack = int(values[23])
+        n = int(values[25]) if istack > 0 else 1
+
+        self._endian = endian
+        self._dtype = np.dtype(np.float32).newbyteorder(endian)
+        self._offset = labbyt
+        # In stacks, each image has its own header before the data
+        self._imageHeader = labbyt if istack > 0 else 0
+        self._dims = (nx, ny, nz, n)
+        self._sampling = 1.0
+        self._isMrc = False
+
+    def getFileName(self):
+        return self._filename
+
+    def getDimensions(self):
+        """ Return a tuple (x, y, z, n) with the images dimensions
+        (z=1 for 2D) and the number of images in the stack.
+        """
+        return self._dims
+
+    def getDataType(self):
+        """ Return the numpy data type of the data stored in the file. """
+        return self._dtype
+
+    def getSampling(self):
+        """ Return the pixel size stored in the header (1.0 if unknown). """
+        return self._sampling
+
+    def _getImageShape(self):
+        x, y, z, _ = self._dims
+        return (y, x) if z == 1 else (z, y, x)
+
+    def _getStackData(self):
+        """ Return the memory-mapped array with all images in the file,
+        with shape (n, z, y, x).
+        """
+        if self._data is None:
+            x, y, z, n = self._dims
+            imageSize = x * y * z
+            headerItems = self._imageHeader / self._dtype.itemsize
+            self._mmap = np.memmap(self._filename, dtype=self._dtype,
+                                   mode=self._mode, offset=self._offset,
+                                   shape=(n, headerItems + imageSize))
+            self._data = self._mmap[:, headerItems:].reshape((n, z, y, x))
+        return self._data
+
+    def getData(self, index=None):
+        """ Return a memory-mapped view of the image with the given index
+        (starting at 1). If index is None, the whole stack is returned.
+        Only the parts of the file that are accessed will be read.
+        """
+        data = self._getStackData()
+        x, y, z, n = self._dims
+
+        if index is None or index == 0:
+            if n == 1:
+                return data[0].reshape(self._getImageShape())
+            return data if z > 1 else data.reshape((n, y, x))
+
+        if index < 1 or index > n:
+            raise Exception("Image index %d out of range [1, %d] in file %s"
+                            % (index, n, self._filename))
+
+        return data[index - 1].reshape(self._getImageShape())
+
+    def iterChunks(self, chunkSize=100, first=1, last=None):
+        """ Iterate over the images of the stack in blocks of at most
+        chunkSize images. Each block is a view with shape (m, [z,] y, x).
+        """
+        data = self._getStackData()
+        x, y, z, n = self._dims
+        last = last or n
+        shape = self._getImageShape()
+
+        for i in range(first - 1, last, chunkSize):
+            chunk = data[i:min(i + chunkSize, last)]
+            yield chunk.reshape((len(chunk),) + shape)
+
+    def getImages(self, indexes):
+        """ Return an array with the images with the given indexes
+        (starting at 1), with shape (m, [z,] y, x). Only the data of
+        these images is read from the file.
+        """
+        data = self._getStackData()
+        images = data[np.asarray(indexes) - 1]
+        return images.reshape((len(images),) + self._getImageShape())
+
+    def close(self):
+        """ Release the memory-mapped data. """
+        if self._mmap is not None:
+            if self._mode != 'r':
+                self._mmap.flush()
+            self._mmap = None
+            self._data = None
+
+    @classmethod
+    def createMrc(cls, filename, dims, dtype=np.float32, sampling=1.0):
+        """ Create an MRC file with the given dimensions (x, y, z, n)
+        and data type, filled with zeros. The file is returned open for
+        writing. If n > 1 the file is written as a stack.
+        """
+        x, y, z, n = dims
+        dtype = np.dtype(dtype)
+        modes = dict((np.dtype(v), k) for k, v in MRC_MODES.iteritems())
+        if dtype not in modes:
+            raise Exception("Data type %s can not be written to MRC"
+                            % dtype)
+
+        isStack = n > 1
+        nz = n if isStack else z
+        mz = 1 if isStack else z
+        header = struct.pack('<10i6f3i3f3i',
+                             x, y, nz, modes[dtype],  # nx, ny, nz, mode
+                             0, 0, 0,  # nxstart, nystart, nzstart
+                             x, y, mz,  # mx, my, mz
+                             x * sampling, y * sampling, mz * sampling,
+                             90., 90., 90.,  # cell angles
+                             1, 2, 3,  # mapc, mapr, maps
+                             0., 0., 0.,  # dmin, dmax, dmean
+                             0 if isStack else 1,  # ispg
+                             0, 0)  # nsymbt, extra
+        header += '\0' * (208 - len(header))
+        header += 'MAP \x44\x44\0\0'
+        header += '\0' * (MRC_HEADER_SIZE - len(header))
+
+        with open(filename, 'wb') as f:
+            f.write(header)
+            f.truncate(MRC_HEADER_SIZE + x * y * z * n * dtype.itemsize)
+
+        suffix = ':mrcs' if isStack else ':mrc'
+        return cls(filename + suffix, mode='r+')
+
+    def setStats(self, dmin, dmax, dmean, rms):
+        """ Store the data statistics in the MRC header. """
+        if not self._isMrc:
+            raise Exception("Statistics can only be written to MRC files.")
+        with open(self._filename, 'r+b') as f:
+            f.seek(76)
+            f.write(struct.pack(self._endian + '3f', dmin, dmax, dmean))
+            f.seek(216)
+            f.write(struct.pack(self._endian + 'f', rms))
+
+
+class ImageStats(object):
+    """ Statistics of a group of images computed in a single pass over
+    the data: average and variance images, and min, max and histogram of
+    all the values. Images are added in blocks and the statistics of
+    different blocks of images (e.g. from several files) can be merged.
+    """
+    def __init__(self, bins=None, binsRange=None):
+        """ If bins is not None, a histogram with this number of bins
+        in binsRange=(min, max) is also computed.
+        """
+        self._n = 0
+        self._sum = None
+        self._sum2 = None
+        self._min = None
+        self._max = None
+        self._bins = bins
+        self._binsRange = binsRange
+        self._hist = None if bins is None else np.zeros(bins, dtype=np.int64)
+
+    def add(self, images):
+        """ Add a block of images, with shape (m, [z,] y, x). """
+        data = np.asarray(images, dtype=np.float64)
+        if not len(data):
+            return
+        self._accumulate(len(data), data.sum(axis=0),
+                         np.square(data).sum(axis=0), data.min(), data.max())
+        if self._hist is not None:
+            self._hist += np.histogram(data, self._bins, self._binsRange)[0]
+
+    def merge(self, other):
+        """ Add the statistics of other group of images. """
+        if other._n:
+            self._accumulate(other._n, other._sum, other._sum2,
+                             other._min, other._max)
+            if self._hist is not None:
+                self._hist += other._hist
+
+    def _accumulate(self, n, imgSum, imgSum2, minValue, maxValue):
+        if self._sum is None:
+            self._sum, self._sum2 = imgSum.copy(), imgSum2.copy()
+            self._min, self._max = minValue, maxValue
+        else:
+            if imgSum.shape != self._sum.shape:
+                raise Exception("Can not compute statistics of images with "
+                                "different dimensions: %s and %s"
+                                % (imgSum.shape, self._sum.shape))
+            self._sum += imgSum
+            self._sum2 += imgSum2
+            self._min = min(self._min, minValue)
+            self._max = max(self._max, maxValue)
+        self._n += n
+
+    def getSize(self):
+        """ Return the number of images added. """
+        return self._n
+
+    def getAverage(self):
+        """ Return the average image (None if no images were added). """
+        return None if self._sum is None else self._sum / self._n
+
+    def getVariance(self):
+        """ Return the variance of each pixel along the images. """
+        if self._sum is None:
+            return None
+        avg = self.getAverage()
+        return np.maximum(self._sum2 / self._n - np.square(avg), 0)
+
+    def getStats(self):
+        """ Return a tuple (mean, std, min, max) of all the values,
+        as returned by Xmipp Image.computeStats.
+        """
+        if self._sum is None:
+            return None, None, None, None
+        size = float(self._n * self._sum.size)
+        mean = self._sum.sum() / size
+        std = np.sqrt(max(self._sum2.sum() / size - mean ** 2, 0))
+        return mean, std, self._min, self._max
+
+    def getHistogram(self):
+        """ Return the histogram counts and the bins edges,
+        or None if no histogram was requested.
+        """
+        if self._hist is None:
+            return None
+        low, high = self._binsRange
+        return self._hist, np.linspace(low, high, self._bins + 1)
+
+
+def transformGain(gain, rotation=0, flip=0):
+    """ Rotate and flip a gain (or dark) image, to match the orientation
+    of the movie frames.
+    Params:
+        rotation: number of 90 degrees rotations (0-3), from the x axis
+            towards the y axis of the array.
+        flip: 0 for no flip, 1 to flip rows (upside down) and 2 to flip
+            columns (left right). It is applied after the rotation.
+    """
+    if rotation % 4:
+        gain = np.rot90(gain, rotation % 4)
+    if flip == 1:
+        gain = gain[::-1, :]
+    elif flip == 2:
+        gain = gain[:, ::-1]
+    return gain
+
+
+def correctGainDark(inputFn, outputFn, gain=None, dark=None, chunkSize=16):
+    """ Write the frames of the input movie corrected as (frame - dark) * gain
+    into a float32 MRC stack. The input is memory-mapped and the frames are
+    corrected in blocks of chunkSize, directly in the output file, so each
+    movie is only read and written once.
+    Params:
+        gain, dark: 2D numpy arrays with the same shape of the frames,
+            or None.
+    """
+    inputFile = ImageFile(inputFn)
+    x, y, z, n = inputFile.getDimensions()
+    # Some movies are written as MRC volumes instead of stacks
+    frames = inputFile.getData().reshape((max(z, n), y, x))
+
+    for name, image in [('Gain', gain), ('Dark', dark)]:
+        if image is not None and image.shape != (y, x):
+            raise Exception("%s image shape %s does not match the movie "
+                            "frames %s" % (name, image.shape, (y, x)))
+
+    outputFile = ImageFile.createMrc(splitFileName(outputFn)[0],
+                                     (x, y, 1, len(frames)),
+                                     sampling=inputFile.getSampling())
+    output = outputFile.getData().reshape(frames.shape)
+
+    for i in range(0, len(frames), chunkSize):
+        chunk = output[i:i + chunkSize]
+        chunk[:] = frames[i:i + chunkSize]
+        if dark is not None:
+            chunk -= dark
+        if gain is not None:
+            chunk *= gain
+
+    outputFile.close()
+    inputFile.close()
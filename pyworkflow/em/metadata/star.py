@@ -0,0 +1,250 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module contains a reader and writer of STAR files implemented in
+Python and numpy, without using the Xmipp MetaData. Each data block is
+read into a Table, that stores the values by columns in numpy arrays,
+so big files (e.g. Relion data.star files with millions of particles)
+can be processed without creating an object per row.
+"""
+
+import shlex
+from collections import OrderedDict
+from itertools import izip
+
+import numpy as np
+
+
+class Table(object):
+    """ A data block of a STAR file, stored by columns.
+    Columns are numpy arrays indexed by the label name (without
+    the leading '_', e.g. rlnImageName). Blocks without loop_ are
+    stored as a table with a single row and isLoop=False.
+    """
+    def __init__(self, name='', columns=None, isLoop=True):
+        self._name = name
+        self._isLoop = isLoop
+        self._columns = OrderedDict()
+        for label, values in (columns or {}).iteritems():
+            self.setColumn(label, values)
+
+    def getName(self):
+        return self._name
+
+    def setName(self, name):
+        self._name = name
+
+    def isLoop(self):
+        return self._isLoop
+
+    def getColumnNames(self):
+        return self._columns.keys()
+
+    def hasColumn(self, label):
+        return label in self._columns
+
+    def getColumn(self, label):
+        return self._columns[label]
+
+    def setColumn(self, label, values):
+        """ Add a new column or replace the values of an existing one.
+        All columns should have the same number of values.
+        """
+        values = np.asarray(values)
+        if self._columns and len(values) != len(self):
+            raise Exception("Column %s has %d values, but the table has %d "
+                            "rows." % (label, len(values), len(self)))
+        self._columns[label] = values
+
+    def removeColumn(self, label):
+        del self._columns[label]
+
+    def filter(self, mask):
+        """ Return a new table with only the rows where mask is True. """
+        return Table(self._name,
+                     OrderedDict((k, v[mask])
+                                 for k, v in self._columns.iteritems()),
+                     self._isLoop)
+
+    def __len__(self):
+        if not self._columns:
+            return 0
+        return len(self._columns.itervalues().next())
+
+    def __str__(self):
+        return "Table '%s' (%d columns, %d rows)" % (self._name,
+                                                     len(self._columns),
+                                                     len(self))
+
+
+def _toArray(values, valueType=None):
+    """ Convert a list of strings to a numpy array. If the type of the
+    values (int, float, bool or str) is not given, it is guessed: int,
+    float or (if the values are not numbers) str objects.
+    """
+    if valueType is str:
+        return np.array(values, dtype=object)
+    if valueType is float:
+        return np.array(values, dtype=np.float64)
+    if valueType is not None:
+        return np.array(values, dtype=np.int64)
+
+    for dtype in [np.int64, np.float64]:
+        try:
+            return np.array(values, dtype=dtype)
+        except ValueError:
+            pass
+    return np.array(values, dtype=object)
+
+
+def _parseLoop(name, labels, lines, getLabelType):
+    """ Create a Table from the data lines of a loop. All values are
+    split at once, only lines with quoted values are parsed one by one.
+    """
+    n = len(labels)
+    tokens = ''.join(lines).split()
+
+    if len(tokens) != n * len(lines) or any('"' in l or "'" in l
+                                            for l in lines):
+        tokens = []
+        for line in lines:
+            values = shlex.split(line)
+            if len(values) != n:
+                raise Exception("Wrong number of values in STAR line: %s"
+                                % line)
+            tokens.extend(values)
+
+    return Table(name, OrderedDict((label, _toArray(tokens[i::n],
+                                                    getLabelType(label)))
+                                   for i, label in enumerate(labels)))
+
+
+def iterTables(filename, getLabelType=None):
+    """ Iterate over all the data blocks of a STAR file,
+    returning a Table for each of them.
+    If getLabelType is passed, it should return the type of the values
+    (int, float, bool or str) of a given label, or None to guess it from
+    the values. Otherwise the type of all the columns is guessed, so
+    strings such as '0012' are read as numbers.
+    """
+    getLabelType = getLabelType or (lambda label: None)
+    name = None
+    labels = []
+    lines = []
+    values = None  # list of values of a block without loop_
+
+    def _createTable():
+        if values is not None:
+            return Table(name, OrderedDict((k, _toArray([v],
+                                                        getLabelType(k)))
+                                           for k, v in izip(labels, values)),
+                         isLoop=False)
+        return _parseLoop(name, labels, lines, getLabelType)
+
+    with open(filename) as f:
+        for line in f:
+            s = line.strip()
+
+            if not s or s.startswith('#'):
+                if lines and not s:  # an empty line ends the loop data
+                    yield _createTable()
+                    name, labels, lines, values = None, [], [], None
+                continue
+
+            if s.startswith('data_'):
+                if name is not None:
+                    yield _createTable()
+                name, labels, lines, values = s[5:], [], [], []
+            elif s.startswith('loop_'):
+                values = None
+            elif s.startswith('_'):
+                parts = s.split(None, 1)
+                labels.append(parts[0][1:])
+                if values is not None:  # label value pairs
+                    value = parts[1] if len(parts) > 1 else ''
+                    values.append(shlex.split(value)[0] if value else '')
+            elif name is not None:
+                lines.append(line)
+
+        if name is not None:
+            yield _createTable()
+
+
+def readTable(filename, tableName=None, getLabelType=None):
+    """ Read a data block from a STAR file. The filename can be also
+    given as tableName@filename. If no tableName is specified, the first
+    block in the file is read. See iterTables for getLabelType.
+    """
+    if '@' in filename and tableName is None:
+        tableName, filename = filename.split('@', 1)
+
+    for table in iterTables(filename, getLabelType):
+        if tableName is None or table.getName() == tableName:
+            return table
+
+    raise Exception("Data block '%s' not found in STAR file %s"
+                    % (tableName, filename))
+
+
+def _formatColumn(values):
+    """ Return a list of strings with the values of a column. Floats are
+    written with fixed notation, except for very small or big values.
+    """
+    if values.dtype.kind == 'f':
+        absValues = np.abs(values)
+        fixed = (absValues == 0) | ((absValues >= 0.001) & (absValues < 1e6))
+        return np.where(fixed, np.char.mod('%0.6f', values),
+                        np.char.mod('%0.6e', values)).tolist()
+    if values.dtype.kind == 'b':
+        values = values.astype(int)
+    return [str(v) if ' ' not in str(v) else '"%s"' % v
+            for v in values.tolist()]
+
+
+def writeTables(filename, tables, mode='w'):
+    """ Write several tables into a STAR file. """
+    with open(filename, mode) as f:
+        for table in tables:
+            labels = table.getColumnNames()
+            f.write("data_%s\n\n" % table.getName())
+            columns = [_formatColumn(table.getColumn(l)) for l in labels]
+
+            if not table.isLoop():
+                for label, column in izip(labels, columns):
+                    f.write("_%s %s\n" % (label, column[0]))
+            else:
+                f.write("loop_\n")
+                for i, label in enumerate(labels):
+                    f.write("_%s #%d\n" % (label, i + 1))
+                for row in izip(*columns):
+                    f.write(' '.join(row))
+                    f.write('\n')
+            f.write('\n')
+
+
+def writeTable(filename, table, mode='w'):
+    """ Write a single table into a STAR file. """
+    writeTables(filename, [table], mode)
@@ -244,9 +244,7 @@ class ProtGctf(em.ProtCTFMicrographs):
     # -------------------------- STEPS functions ------------------------------
     def _estimateCTF(self, micFn, micDir, micName):
         """ Run Gctf with required parameters """
-        doneFile = os.path.join(micDir, 'done.txt')
-
-        if self.isContinued() and os.path.exists(doneFile):
+        if self.isContinued() and self._isMicrographDone(micName):
             return
 
         try:
@@ -293,8 +291,8 @@ class ProtGctf(em.ProtCTFMicrographs):
         pwutils.cleanPath(self.getProject().getPath('micrographs_all_gctf.star'))
 
         # Let's notify that this micrograph has been processed
-        # just creating an empty file at the end (after success or failure)
-        open(doneFile, 'w')
+        # at the end (after success or failure)
+        self._writeMicrographDone(micDir, micName)
         # Let's clean the temporary mrc micrographs
         pwutils.cleanPath(micFnMrc)
 
@@ -128,9 +128,7 @@ class ProtCTFFind(em.ProtCTFMicrographs):
     def _estimateCTF(self, micFn, micDir, micName):
         """ Run ctffind, 3 or 4, with required parameters """
 
-        doneFile = os.path.join(micDir, 'done.txt')
-
-        if self.isContinued() and os.path.exists(doneFile):
+        if self.isContinued() and self._isMicrographDone(micName):
             return
 
         try:
@@ -173,8 +171,8 @@ class ProtCTFFind(em.ProtCTFMicrographs):
             print >> sys.stderr, "ctffind has failed with micrograph %s" % micFnMrc
 
         # Let's notify that this micrograph have been processed
-        # just creating an empty file at the end (after success or failure)
-        open(doneFile, 'w')
+        # at the end (after success or failure)
+        self._writeMicrographDone(micDir, micName)
         # Let's clean the temporary mrc micrographs
         pwutils.cleanPath(micFnMrc)
 
@@ -30,14 +30,16 @@ import os
 from os.path import join, basename
 import numpy
 from collections import OrderedDict
-from itertools import izip
+from itertools import izip, chain
 
-from pyworkflow.object import ObjectWrap, String, Integer
+from pyworkflow.object import ObjectWrap, String, Integer, Scalar
 from pyworkflow.utils import Environ
 from pyworkflow.utils.path import (createLink, cleanPath, copyFile,
                                    replaceBaseExt, getExt, removeExt)
 import pyworkflow.em as em
+from pyworkflow.em.convert import formatRows, writeCoordinatesByMicrograph
 import pyworkflow.em.metadata as md
+import pyworkflow.em.metadata.star as star
 from pyworkflow.em.packages.relion.constants import V1_3, V1_4, V2_0, V2_1
 
 # This dictionary will be used to map
@@ -577,21 +579,231 @@ def readSetOfParticles(filename, partSet, **kwargs):
         filename: The metadata filename where the image are.
         imgSet: the SetOfParticles that will be populated.
         rowToParticle: this function will be used to convert the row to Object
-    """    
+    """
+    # If no hooks need to be applied to each row, read the file by columns
+    if not (kwargs.get('preprocessImageRow') or
+            kwargs.get('postprocessImageRow')):
+        if readSetOfParticlesColumns(filename, partSet, **kwargs):
+            return
+
     imgMd = md.MetaData(filename)
     # By default remove disabled items from metadata
     # be careful if you need to preserve the original number of items
     if kwargs.get('removeDisabled', True):
         imgMd.removeDisabled()
     
-    for imgRow in md.iterRows(imgMd):
-        img = rowToParticle(imgRow, **kwargs)
-        partSet.append(img)
-        
+    imgIter = (rowToParticle(imgRow, **kwargs)
+               for imgRow in md.iterRows(imgMd))
+    img = next(imgIter)
+    partSet.appendMany(chain([img], imgIter))
+
     partSet.setHasCTF(img.hasCTF())
     partSet.setAlignment(kwargs['alignType'])
     
 
+def readStarColumns(filename, removeDisabled=True):
+    """ Read the first data block of a star file into a dict with the
+    metadata labels as keys and numpy arrays with the values of each
+    column, converted to the type of the label. Columns that are not
+    metadata labels are ignored, as when reading with md.MetaData.
+    """
+    def _getLabelType(labelStr):
+        label = md.str2Label(labelStr)
+        return None if label == md.MDL_UNDEFINED else md.label2Python(label)
+
+    # Read string labels as they are (e.g. '0012'), not as numbers
+    table = star.readTable(filename, getLabelType=_getLabelType)
+    enabledStr = md.label2Str(md.MDL_ENABLED)
+
+    # Same as MetaData.removeDisabled
+    if removeDisabled and table.hasColumn(enabledStr):
+        table = table.filter(table.getColumn(enabledStr) != -1)
+
+    columns = OrderedDict()
+
+    for labelStr in table.getColumnNames():
+        label = md.str2Label(labelStr)
+        if label == md.MDL_UNDEFINED:
+            continue
+        values = table.getColumn(labelStr)
+        valueType = md.label2Python(label)
+        if valueType is bool:
+            values = values.astype(bool)
+        columns[label] = values
+
+    return columns, len(table)
+
+
+def _eulerMatrices(rot, tilt, psi):
+    """ Vectorized version of euler_matrix(ai, aj, ak, 'szyz') from
+    em.transformations, used in matrixFromGeometry.
+    Return an array with shape (n, 4, 4).
+    """
+    # 'szyz' has parity, so all angles are negated
+    si, sj, sk = numpy.sin(-rot), numpy.sin(-tilt), numpy.sin(-psi)
+    ci, cj, ck = numpy.cos(-rot), numpy.cos(-tilt), numpy.cos(-psi)
+    cc, cs = ci * ck, ci * sk
+    sc, ss = si * ck, si * sk
+
+    M = numpy.zeros((len(rot), 4, 4))
+    M[:, 3, 3] = 1.
+    M[:, 2, 2] = cj
+    M[:, 2, 1] = sj * si
+    M[:, 2, 0] = sj * ci
+    M[:, 1, 2] = sj * sk
+    M[:, 1, 1] = -cj * ss + cc
+    M[:, 1, 0] = -cj * cs - sc
+    M[:, 0, 2] = -sj * ck
+    M[:, 0, 1] = cj * sc + cs
+    M[:, 0, 0] = cj * cc - ss
+    return M
+
+
+def alignmentColumns(columns, n, alignType):
+    """ Vectorized version of rowToAlignment for all the rows. Return
+    the list of matrices in the same format as stored by em.Matrix.
+    """
+    if alignType == em.ALIGN_3D:
+        raise Exception("3D alignment conversion for Relion not implemented.")
+
+    def _get(label):
+        return columns[label] if label in columns else numpy.zeros(n)
+
+    shifts = numpy.zeros((n, 3))
+    angles = numpy.zeros((n, 3))
+    shifts[:, 0] = _get(md.RLN_ORIENT_ORIGIN_X)
+    shifts[:, 1] = _get(md.RLN_ORIENT_ORIGIN_Y)
+
+    if alignType == em.ALIGN_2D:
+        angles[:, 2] = -_get(md.RLN_ORIENT_PSI)
+    else:
+        angles[:, 0] = _get(md.RLN_ORIENT_ROT)
+        angles[:, 1] = _get(md.RLN_ORIENT_TILT)
+        angles[:, 2] = _get(md.RLN_ORIENT_PSI)
+        shifts[:, 2] = _get(md.RLN_ORIENT_ORIGIN_Z)
+
+    radAngles = -numpy.deg2rad(angles)
+    M = _eulerMatrices(radAngles[:, 0], radAngles[:, 1], radAngles[:, 2])
+
+    if alignType == em.ALIGN_PROJ:
+        M[:, :3, 3] = -shifts
+        M = numpy.linalg.inv(M)
+    else:
+        M[:, :3, 3] = shifts
+
+    # Same format as json.dumps(matrix.tolist()) in em.Matrix
+    matrixStr = '[%s]' % ', '.join(['[%r, %r, %r, %r]'] * 4)
+    return [matrixStr % tuple(m) for m in M.reshape(n, 16).tolist()]
+
+
+def ctfColumns(columns):
+    """ Vectorized version of CTFModel.standardize for all the rows.
+    Return defocusU, defocusV, defocusAngle and defocusRatio arrays.
+    """
+    defocusU = columns[md.RLN_CTF_DEFOCUSU]
+    defocusV = columns[md.RLN_CTF_DEFOCUSV]
+    angle = columns[md.RLN_CTF_DEFOCUS_ANGLE]
+
+    swap = defocusV > defocusU
+    defocusU, defocusV = (numpy.where(swap, defocusV, defocusU),
+                          numpy.where(swap, defocusU, defocusV))
+    angle = numpy.where(swap, angle + 90., angle)
+    angle = numpy.where(angle >= 180., angle - 180.,
+                        numpy.where(angle < 0., angle + 180., angle))
+
+    return defocusU, defocusV, angle, defocusU / defocusV
+
+
+def readSetOfParticlesColumns(filename, partSet, **kwargs):
+    """ Read particles from a Relion star file as in readSetOfParticles,
+    but processing the values by columns and inserting them in the set
+    without creating a Particle for each row. Only the first row is
+    converted with rowToParticle to know the attributes of the particles.
+    Return False if some attribute could not be converted in this way
+    (nothing is added to the set then).
+    """
+    columns, n = readStarColumns(filename,
+                                 kwargs.get('removeDisabled', True))
+    if not n or md.RLN_IMAGE_NAME not in columns:
+        return False
+
+    firstRow = md.Row()
+    for label, values in columns.iteritems():
+        firstRow.setValue(label, values[:1].tolist()[0])
+    template = rowToParticle(firstRow, **kwargs)
+
+    values = {}
+    attrs = template.getMappedDict()
+    # Attributes that do not depend on the row values
+    constantKeys = set(['_samplingRate', '_ctfModel._resolution',
+                        '_ctfModel._fitQuality', '_acquisition._magnification',
+                        '_acquisition._doseInitial',
+                        '_acquisition._dosePerFrame'])
+
+    def _setColumn(key, label):
+        if key in attrs:
+            if label in columns:
+                values[key] = columns[label]
+            else:  # The value is not read from the row
+                constantKeys.add(key)
+
+    if md.RLN_IMAGE_ID in columns:
+        values['id'] = columns[md.RLN_IMAGE_ID]
+    if md.RLN_IMAGE_ENABLED in columns:
+        values['enabled'] = columns[md.RLN_IMAGE_ENABLED] > 0
+
+    locations = [relionToLocation(fn)
+                 for fn in columns[md.RLN_IMAGE_NAME].tolist()]
+    values['_index'] = [loc[0] for loc in locations]
+    values['_filename'] = [loc[1] for loc in locations]
+    _setColumn('_classId', md.RLN_PARTICLE_CLASS)
+    _setColumn('_micId', md.RLN_MICROGRAPH_ID)
+
+    if '_ctfModel._defocusU' in attrs:
+        ctfKeys = ['_defocusU', '_defocusV', '_defocusAngle', '_defocusRatio']
+        for key, ctfValues in izip(ctfKeys, ctfColumns(columns)):
+            values['_ctfModel.' + key] = ctfValues
+        _setColumn('_ctfModel._phaseShift', md.RLN_CTF_PHASESHIFT)
+        for attr, label in CTF_PSD_DICT.iteritems():
+            _setColumn('_ctfModel.' + attr, label)
+
+    for attr, label in ACQUISITION_DICT.iteritems():
+        if not (attr == '_magnification' and kwargs.get('magnification')):
+            _setColumn('_acquisition.' + attr, label)
+
+    if '_transform._matrix' in attrs:
+        values['_transform._matrix'] = alignmentColumns(columns, n,
+                                                        kwargs['alignType'])
+
+    if '_coordinate._x' in attrs:
+        for attr, label in COOR_DICT.iteritems():
+            values['_coordinate.' + attr] = columns[label].astype(numpy.int64)
+        _setColumn('_coordinate._micId', md.RLN_MICROGRAPH_ID)
+        if md.RLN_MICROGRAPH_NAME in columns:
+            _setColumn('_coordinate._micName', md.RLN_MICROGRAPH_NAME)
+        elif md.RLN_MICROGRAPH_ID in columns:
+            values['_coordinate._micName'] = [
+                str(micId) for micId in columns[md.RLN_MICROGRAPH_ID].tolist()]
+
+    # Extra labels are stored as _rlnLabelName attributes
+    for key in attrs:
+        attrName = key.split('.')[-1]
+        if key not in values and attrName.startswith('_rln'):
+            _setColumn(key, md.str2Label(attrName[1:]))
+
+    # Check that the values of all other attributes were computed
+    for key, attr in attrs.iteritems():
+        if (key not in values and key not in constantKeys and
+                isinstance(attr, Scalar)):
+            return False
+
+    partSet.appendColumns(template, values)
+    partSet.setHasCTF(template.hasCTF())
+    partSet.setAlignment(kwargs['alignType'])
+
+    return True
+
+
 def setOfImagesToMd(imgSet, imgMd, imgToFunc, **kwargs):
     """ This function will fill Relion metadata from a SetOfMicrographs
     Params:
@@ -710,8 +922,9 @@ def writeSqliteIterData(imgStar, imgSqlite, **kwargs):
     imgSet = em.SetOfParticles(filename=imgSqlite)
     readSetOfParticles(imgStar, imgSet, **kwargs)
     imgSet.write()
-    
-    
+    imgSet.close()
+
+
 def writeSqliteIterClasses(imgStar):
     pass
     
@@ -969,7 +1182,8 @@ _rlnCoordinateY
     return f
 
 
-def writeSetOfCoordinates(posDir, coordSet, getStarFileFunc, scale=1):
+def writeSetOfCoordinates(posDir, coordSet, getStarFileFunc, scale=1,
+                          numberOfThreads=1):
     """ Convert a SetOfCoordinates to Relion star files.
     Params:
         posDir: the output directory where to generate the files.
@@ -979,6 +1193,7 @@ def writeSetOfCoordinates(posDir, coordSet, getStarFileFunc, scale=1):
         scale: pass a value if the coordinates have a different scale.
             (for example when extracting from micrographs with a different
             pixel size than during picking)
+        numberOfThreads: number of threads used to write the files.
     """
 
     # Create a dictionary with the pos filenames for each micrograph
@@ -989,44 +1204,31 @@ def writeSetOfCoordinates(posDir, coordSet, getStarFileFunc, scale=1):
             posFn = os.path.basename(starFile)
             posDict[mic.getObjId()] = join(posDir, posFn)
 
-    f = None
-    lastMicId = None
-
     extraLabels = coordSet.getFirstItem().hasAttribute('_rlnClassNumber')
     doScale = abs(scale - 1) > 0.001
 
-    for coord in coordSet.iterItems(orderBy='_micId'):
-        micId = coord.getMicId()
-
-        if micId != lastMicId:
-            if not micId in posDict:
-                print "Warning: micId %s not found" % micId
-                continue
-            # we need to close previous opened file
-            if f:
-                f.close()
-            f = openStar(posDict[micId], extraLabels)
-            lastMicId = micId
-
+    labels = ['_x', '_y']
+    fmt = "%d %d \n"
+    if extraLabels:
+        labels += ['_rlnClassNumber', '_rlnAutopickFigureOfMerit',
+                   '_rlnAnglePsi']
+        fmt = "%d %d %d %0.6f %0.6f\n"
+
+    def _writeStar(micId, columns):
+        if not micId in posDict:
+            print "Warning: micId %s not found" % micId
+            return
+        values = columns.values()
         if doScale:
-            x = coord.getX() * scale
-            y = coord.getY() * scale
-        else:
-            x = coord.getX()
-            y = coord.getY()
-
-        if not extraLabels:
-            f.write("%d %d \n" % (x, y))
-        else:
-            f.write("%d %d %d %0.6f %0.6f\n"
-                    % (x, y,
-                       coord._rlnClassNumber,
-                       coord._rlnAutopickFigureOfMerit,
-                       coord._rlnAnglePsi))
-
-    if f:
+            values[0] = values[0] * scale
+            values[1] = values[1] * scale
+        f = openStar(posDict[micId], extraLabels)
+        f.write(formatRows(fmt, values))
         f.close()
 
+    writeCoordinatesByMicrograph(coordSet, labels, _writeStar,
+                                 numberOfThreads)
+
     return posDict.values()
 
 
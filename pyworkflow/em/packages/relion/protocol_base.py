@@ -33,6 +33,7 @@ from pyworkflow.protocol.params import (BooleanParam, PointerParam, FloatParam,
                                         LabelParam, PathParam)
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
 from pyworkflow.utils.path import cleanPath, replaceBaseExt, removeBaseExt
+from pyworkflow.utils.cache import FileCache
 
 import pyworkflow.em as em
 import pyworkflow.em.metadata as md
@@ -86,7 +87,6 @@ class ProtRelionBase(EMProtocol):
         myDict = {
                   'input_star': self._getPath('input_particles.star'),
                   'input_mrcs': self._getPath('input_particles.mrcs'),
-                  'data_scipion': self.extraIter + 'data_scipion.sqlite',
                   'projections': self.extraIter + '%(half)sclass%(ref3d)03d_projections.sqlite',
                   'classes_scipion': self.extraIter + 'classes_scipion.sqlite',
                   'data': self.extraIter + 'data.star',
@@ -1160,18 +1160,34 @@ class ProtRelionBase(EMProtocol):
 
         return data_classes
     
-    def _getIterData(self, it, **kwargs):
-        """ Sort the it??.data.star file by the maximum likelihood. """
-        data_sqlite = self._getFileName('data_scipion', iter=it)
-        
-        if not exists(data_sqlite):
-            iterImgSet = em.SetOfParticles(filename=data_sqlite)
+    def _getIterDataCache(self):
+        """ Cache of the SetOfParticles sqlite files converted
+        from the iterations data.star files.
+        """
+        return FileCache(self._getTmpPath('iter_data'), extension='.sqlite')
+    
+    def _writeIterData(self, it):
+        """ Return a function to convert the data.star file of
+        this iteration into a SetOfParticles sqlite file.
+        """
+        def _write(dataStar, dataSqlite):
+            iterImgSet = em.SetOfParticles(filename=dataSqlite)
             iterImgSet.copyInfo(self._getInputParticles())
             self._fillDataFromIter(iterImgSet, it)
             iterImgSet.write()
             iterImgSet.close()
-        
-        return data_sqlite
+        return _write
+    
+    def _getIterData(self, it, **kwargs):
+        """ Return a SetOfParticles sqlite file for this iteration.
+        The file is converted from the iteration data.star file and
+        stored in a cache, so it is only generated again if the
+        data.star file changes. The kwargs (e.g. alignType) are not
+        used by the conversion, so they are not part of the cache key.
+        """
+        dataStar = self._getFileName('data', iter=it)
+        return self._getIterDataCache().get(dataStar,
+                                            self._writeIterData(it))
     
     def _splitInCTFGroups(self, imgStar):
         """ Add a new column in the image star to separate the particles
@@ -33,13 +33,14 @@ This module contains converter functions that will serve to:
 import os
 from os.path import join, dirname
 from collections import OrderedDict
-from itertools import izip
+from itertools import izip, chain
 import numpy
 
 import xmipp
 from pyworkflow.em.packages.xmipp3.utils import iterMdRows
 from xmipp3 import XmippMdRow, getLabelPythonType, RowMetaData
 from pyworkflow.em import *
+from pyworkflow.em.convert import formatRows, writeCoordinatesByMicrograph
 from pyworkflow.utils.path import replaceBaseExt, removeExt, findRootFrom
 import pyworkflow.em.metadata as md
 
@@ -738,17 +739,21 @@ loop_
     return f
 
 
-def writeSetOfCoordinates(posDir, coordSet, ismanual=True, scale=1):
+def writeSetOfCoordinates(posDir, coordSet, ismanual=True, scale=1,
+                          numberOfThreads=1):
     state = 'Manual' if ismanual else 'Supervised'
-    writeSetOfCoordinatesWithState(posDir, coordSet, state, scale)
+    writeSetOfCoordinatesWithState(posDir, coordSet, state, scale,
+                                   numberOfThreads)
 
 
-def writeSetOfCoordinatesWithState(posDir, coordSet, state, scale=1):
+def writeSetOfCoordinatesWithState(posDir, coordSet, state, scale=1,
+                                   numberOfThreads=1):
     """ Write a pos file on metadata format for each micrograph
     on the coordSet.
     Params:
         posDir: the directory where the .pos files will be written.
         coordSet: the SetOfCoordinates that will be read.
+        numberOfThreads: number of threads used to write the files.
     """
     boxSize = coordSet.getBoxSize() or 100
 
@@ -764,33 +769,20 @@ def writeSetOfCoordinatesWithState(posDir, coordSet, state, scale=1):
         posFn = join(posDir, replaceBaseExt(micName, "pos"))
         posDict[mic.getObjId()] = posFn
 
-    f = None
-    lastMicId = None
-    c = 0
-
-    for coord in coordSet.iterItems(orderBy='_micId'):
-        micId = coord.getMicId()
-
-        if micId != lastMicId:
-            # we need to close previous opened file
-            if f:
-                f.close()
-                c = 0
-            f = openMd(posDict[micId], state)
-            lastMicId = micId
-        c += 1
+    def _writePos(micId, columns):
+        x, y = columns['_x'], columns['_y']
         if scale != 1:
-            x = coord.getX() * scale
-            y = coord.getY() * scale
-        else:
-            x = coord.getX()
-            y = coord.getY()
-        f.write(" %06d   1   %d  %d  %d   %06d\n"
-                % (coord.getObjId(), x, y, 1, micId))
-
-    if f:
+            x = x * scale
+            y = y * scale
+        n = len(x)
+        f = openMd(posDict[micId], state)
+        f.write(formatRows(" %06d   1   %d  %d  %d   %06d\n",
+                           [columns['id'], x, y, [1] * n, [micId] * n]))
         f.close()
 
+    writeCoordinatesByMicrograph(coordSet, ['id', '_x', '_y'], _writePos,
+                                 numberOfThreads)
+
     # Write config.xmd metadata
     configFn = join(posDir, 'config.xmd')
     writeCoordsConfig(configFn, int(boxSize), state)
@@ -932,10 +924,10 @@ def readSetOfImages(filename, imgSet, rowToFunc, **kwargs):
             kwargs['alignType'] = ALIGN_NONE
 
     if imgMd.size() > 0:
-        for objId in imgMd:
-            imgRow = rowFromMd(imgMd, objId)
-            img = rowToFunc(imgRow, **kwargs)
-            imgSet.append(img)
+        imgIter = (rowToFunc(rowFromMd(imgMd, objId), **kwargs)
+                   for objId in imgMd)
+        img = next(imgIter)
+        imgSet.appendMany(chain([img], imgIter))
 
         imgSet.setHasCTF(img.hasCTF())
         imgSet.setAlignment(kwargs['alignType'])
@@ -103,8 +103,6 @@ class XmippProtCTFMicrographs(em.ProtCTFMicrographs):
     # --------------------------- STEPS functions ------------------------------
     def _estimateCTF(self, micFn, micDir, micName):
         """ Run the estimate CTF program """
-        doneFile = join(micDir, 'done.txt')
-
         localParams = self.__params.copy()
         if self.doInitialCTF:
             if self.ctfDict[micName] > 0:
@@ -167,8 +165,8 @@ class XmippProtCTFMicrographs(em.ProtCTFMicrographs):
                 break
 
         # Let's notify that this micrograph have been processed
-        # just creating an empty file at the end (after success or failure)
-        open(doneFile, 'w')
+        # at the end (after success or failure)
+        self._writeMicrographDone(micDir, micName)
         
         if deleteTmp != "":
             pwutils.path.cleanPath(deleteTmp)
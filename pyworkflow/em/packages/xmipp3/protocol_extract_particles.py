@@ -142,7 +142,7 @@ class XmippProtExtractParticles(ProtExtractParticles, XmippProtocol):
                            'background circle definition (in pix.). If this '
                            'value is 0, then half the box size is used.')
 
-        form.addParallelSection(threads=4, mpi=1)
+        form.addParallelSection(threads=4, mpi=1, processes=True)
     
     #--------------------------- INSERT steps functions ------------------------
     def _insertInitialSteps(self):
@@ -24,8 +24,11 @@
 # *
 # **************************************************************************
 
+import os
 import time
+import threading
 from itertools import izip
+from collections import OrderedDict
 
 from pyworkflow.protocol import Protocol
 import pyworkflow.protocol.params as params
@@ -40,10 +43,84 @@ from pyworkflow.em.constants import (RELATION_SOURCE, RELATION_TRANSFORM,
                                      RELATION_CTF)
 from pyworkflow.em.data_tiltpairs import (SetOfAngles, CoordinatesTiltPair,
                                           TiltPair)
-from pyworkflow.utils.path import cleanPath
+from pyworkflow.utils.path import cleanPath, makeFilePath
 from pyworkflow.mapper.sqlite_db import SqliteDb
 
 
+class ProgressStore(object):
+    """ Keep track of the progress of the items processed by a protocol
+    (e.g. the micrographs processed in streaming).
+    Each status change is appended as a line '<status> <itemId>' to a text
+    file, and the ids with each status are also kept in memory, so checking
+    the status of an item is O(1). When loading, only the lines appended
+    since the previous load are read.
+    """
+    # Item was processed by its step
+    PROCESSED = 'processed'
+    # Item was added to the output
+    DONE = 'done'
+    # Item could not be added to the output
+    FAILED = 'failed'
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._offset = 0  # position in the file of the lines not loaded
+        self._idsDict = {}  # {status: set of item ids}
+        self._lock = threading.Lock()  # steps could run in threads
+        self.load()
+
+    def _getIds(self, status):
+        return self._idsDict.setdefault(status, set())
+
+    def load(self):
+        """ Load the lines appended to the file since the last load,
+        for example, by other processes.
+        """
+        with self._lock:
+            if not os.path.exists(self._filename):
+                return
+
+            with open(self._filename) as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith('\n'):
+                        break  # not completely written yet
+                    self._offset += len(line)
+                    status, itemId = line.split()
+                    self._getIds(status).add(int(itemId))
+
+    def setStatus(self, itemIds, status):
+        """ Set the status of the items with the given ids. """
+        lines = ''.join('%s %d\n' % (status, itemId) for itemId in itemIds)
+        if not lines:
+            return
+
+        with self._lock:
+            if not os.path.exists(self._filename):
+                makeFilePath(self._filename)
+            with open(self._filename, 'a') as f:
+                f.write(lines)
+            self._getIds(status).update(int(itemId) for itemId in itemIds)
+
+    def hasStatus(self, itemId, status):
+        return itemId in self._idsDict.get(status, ())
+
+    def getIds(self, status):
+        """ Return a copy of the set of ids with the given status. """
+        return set(self._idsDict.get(status, ()))
+
+    def count(self, status):
+        return len(self._idsDict.get(status, ()))
+
+    def filterItems(self, items, status, excludeStatus=None):
+        """ Return the items having the given status, and not having
+        the excluded one (e.g. processed but not done yet).
+        """
+        ids = self._idsDict.get(status, ())
+        excludeIds = self._idsDict.get(excludeStatus, ())
+        return [item for item in items
+                if item.getObjId() in ids and item.getObjId() not in excludeIds]
+
 
 class EMProtocol(Protocol):
     """ Base class to all EM protocols.
@@ -251,6 +328,138 @@ class EMProtocol(Protocol):
             time.sleep(sleepOnWait)
 
 
+    def _loadNewItems(self, inputSet, SetClass, getKeyFunc, itemsDict):
+        """ Load the items of a (streaming) input set whose keys are not
+        already present in itemsDict (e.g. self.micDict).
+        Only the rows appended since the previous call are read from the
+        set db, using the last id read as watermark (see Set.iterItemsSince).
+        Items read before, but still not present in itemsDict (e.g. waiting
+        for a batch to be completed), are returned again.
+        Params:
+            inputSet: the set to read, it will be re-opened from its file.
+            SetClass: class used to open the set (e.g. SetOfMicrographs).
+            getKeyFunc: function to get the key of an item.
+            itemsDict: items already processed by the protocol.
+        Returns:
+            A dictionary with the new items (key: item) and whether
+            the input stream is closed.
+        """
+        setFn = inputSet.getFileName()
+        self.debug("Loading input db: %s" % setFn)
+        updatedSet = SetClass(filename=setFn)
+        updatedSet.loadAllProperties()
+
+        # For each set file keep: [last id, ids read, items pending, itemsDict]
+        # If itemsDict is a different one (e.g. micDict was reset),
+        # we need to start reading from the beginning again
+        if not hasattr(self, '_streamReadDict'):
+            self._streamReadDict = {}
+        readInfo = self._streamReadDict.get(setFn, None)
+        if readInfo is None or readInfo[3] is not itemsDict:
+            readInfo = [0, set(), OrderedDict(), itemsDict]
+            self._streamReadDict[setFn] = readInfo
+        lastId, readIds, pendingDict, _ = readInfo
+
+        newItems = [item.clone() for item in updatedSet.iterItemsSince(lastId)]
+        if len(readIds) + len(newItems) < updatedSet.getSize():
+            # Some items were appended with an id lower than the watermark,
+            # (e.g. when keeping the input ids) so we need to read them all
+            newItems = [item.clone() for item in updatedSet
+                        if item.getObjId() not in readIds]
+
+        for item in newItems:
+            itemId = item.getObjId()
+            readIds.add(itemId)
+            readInfo[0] = max(readInfo[0], itemId)
+            pendingDict[getKeyFunc(item)] = item
+
+        for key in [k for k in pendingDict if k in itemsDict]:
+            del pendingDict[key]
+
+        streamClosed = updatedSet.isStreamClosed()
+        updatedSet.close()
+        self.debug("Closed db.")
+
+        return OrderedDict(pendingDict), streamClosed
+
+    def _getProgress(self):
+        """ Return the ProgressStore used to keep track of the items
+        processed and done by this protocol (mainly used in streaming).
+        If the progress file does not exist yet, the ids from the text
+        files used before (see _getAllDone), are imported.
+        """
+        if getattr(self, '_progressStore', None) is None:
+            progressFn = self._getExtraPath('DONE', 'progress.txt')
+            newFile = not os.path.exists(progressFn)
+            self._progressStore = ProgressStore(progressFn)
+
+            if newFile:
+                for fnFunc, status in [('_getAllDone', ProgressStore.DONE),
+                                       ('_getAllFailed', ProgressStore.FAILED)]:
+                    if hasattr(self, fnFunc):
+                        fn = getattr(self, fnFunc)()
+                        if os.path.exists(fn):
+                            with open(fn) as f:
+                                ids = [int(l) for l in f if l.strip()]
+                            self._progressStore.setStatus(ids, status)
+
+        return self._progressStore
+
+    def _readDoneList(self):
+        """ Return the set of ids of the items that have been done.
+        This is usually called once per streaming check, so the lines
+        written by other processes are also loaded here.
+        """
+        progress = self._getProgress()
+        progress.load()
+        return progress.getIds(ProgressStore.DONE)
+
+    def _writeDoneList(self, itemList):
+        """ Store the items that have been done. """
+        self._getProgress().setStatus([i.getObjId() for i in itemList],
+                                      ProgressStore.DONE)
+
+    def _readFailedList(self):
+        """ Return the set of ids of the items that have failed.
+        As in _readDoneList, the lines written by other processes
+        are also loaded.
+        """
+        progress = self._getProgress()
+        progress.load()
+        return progress.getIds(ProgressStore.FAILED)
+
+    def _writeFailedList(self, itemList):
+        """ Store the items that have failed. """
+        self._getProgress().setStatus([i.getObjId() for i in itemList],
+                                      ProgressStore.FAILED)
+
+    def _setItemsProcessed(self, itemList):
+        """ Mark the items as processed, this should be called
+        from the steps when the processing of the items finishes.
+        """
+        self._getProgress().setStatus([i.getObjId() for i in itemList],
+                                      ProgressStore.PROCESSED)
+
+    def _isItemProcessed(self, item):
+        progress = self._getProgress()
+        return (progress.hasStatus(item.getObjId(), ProgressStore.PROCESSED) or
+                progress.hasStatus(item.getObjId(), ProgressStore.DONE))
+
+    def _importLegacyDoneMarkers(self, items, getMarkerFunc):
+        """ Mark as processed the items with a done marker file, as
+        written for each item by previous versions, so a continued run
+        does not need to check the marker files again. Only the items
+        not processed yet are checked, so this is cheap after the first
+        time the run is continued.
+        Params:
+            items: items to check (e.g. the input micrographs).
+            getMarkerFunc: function returning the marker file of an item.
+        """
+        ids = [item.getObjId() for item in items
+               if not self._isItemProcessed(item)
+               and os.path.exists(getMarkerFunc(item))]
+        self._getProgress().setStatus(ids, ProgressStore.PROCESSED)
+
     def _insertNewMics(self, inputMics, getMicKeyFunc,
                        insertStepFunc, insertStepListFunc, *args):
         """ Insert steps of new micrographs taking into account the batch size.
@@ -30,12 +30,16 @@ import os
 from itertools import izip
 from math import ceil
 
+import numpy as np
+
 from pyworkflow.object import Set
 import pyworkflow.utils.path as pwutils
 from pyworkflow.utils import yellowStr, redStr
 import pyworkflow.protocol.params as params
 import pyworkflow.protocol.constants as cons
 from pyworkflow.em.convert import ImageHandler
+from pyworkflow.em.image_file import (MRC_EXTS, isSupported, splitFileName,
+                                      transformGain, correctGainDark)
 from pyworkflow.em.data import (MovieAlignment, SetOfMovies, SetOfMicrographs,
                                 Image)
 from pyworkflow.em.protocol import ProtProcessMovies
@@ -590,30 +594,37 @@ class ProtAlignMovies(ProtProcessMovies):
     def correctGain(self, movieFn, outputFn, gainFn=None, darkFn=None):
         """correct a movie with both gain and dark images"""
         ih = ImageHandler()
-        _, _, z, n = ih.getDimensions(movieFn)
-        numberOfFrames = max(z, n) # in case of wrong mrc stacks as volumes
+        rotation, flip = self._getGainTransform()
 
         def _readImgFloat(fn):
-            img = None
+            data = None
             if fn:
-                img = ih.read(fn)
-                img.convert2DataType(ih.DT_FLOAT)
-            return img
+                data = ih.getData(fn).astype(np.float32)
+                data = transformGain(data, rotation, flip)
+            return data
 
-        gainImg = _readImgFloat(gainFn)
-        darkImg = _readImgFloat(darkFn)
+        gain = _readImgFloat(gainFn)
+        dark = _readImgFloat(darkFn)
 
+        # MRC and SPIDER movies are corrected with numpy, reading
+        # several frames at a time, if the output is also MRC
+        if isSupported(movieFn) and splitFileName(outputFn)[1] in MRC_EXTS:
+            correctGainDark(movieFn, outputFn, gain, dark)
+            return
+
+        _, _, z, n = ih.getDimensions(movieFn)
+        numberOfFrames = max(z, n) # in case of wrong mrc stacks as volumes
         img = ih.createImage()
 
         for i in range(1, numberOfFrames + 1):
-            img.read((i, movieFn))
-            img.convert2DataType(ih.DT_FLOAT)
+            data = ih.getData((i, movieFn)).astype(np.float32)
 
-            if darkImg:
-                img.inplaceSubtract(darkImg)
-            if gainImg:
-                img.inplaceMultiply(gainImg)
+            if dark is not None:
+                data -= dark
+            if gain is not None:
+                data *= gain
 
+            img.setData(data)
             img.write((i, outputFn))
 
     def getThumbnailFn(self, inputFn):
@@ -26,13 +26,13 @@
 
 import os
 from os.path import join
-from glob import glob
 import re
 from datetime import timedelta, datetime
 
 import pyworkflow.utils as pwutils
 import pyworkflow.protocol.params as params
 from pyworkflow.utils.path import expandPattern, copyFile, createAbsLink
+from pyworkflow.utils.file_scanner import FileScanner
 from pyworkflow.em.protocol import EMProtocol
 
 
@@ -221,12 +221,27 @@ class ProtImportFiles(ProtImport):
         if pattern is None:
             pattern = self.getPattern()
 
-        filePaths = glob(pattern)
-        filePaths.sort()
+        filePaths = self._getFileScanner(pattern).getFiles()
         self.numberOfFiles = len(filePaths)
         
         return filePaths
 
+    def _getFileScanner(self, pattern, useInotify=False):
+        """ Return the FileScanner used to find the files matching the
+        pattern. It keeps the state of the directories, so when called
+        several times (e.g. importing in streaming) only the directories
+        that changed are listed again. If useInotify is True, it is
+        enabled in the scanner even if it was created without it
+        (e.g. when listing the files to validate the protocol).
+        """
+        scanner = getattr(self, '_fileScanner', None)
+        if scanner is None or scanner.getPattern() != pattern:
+            scanner = FileScanner(pattern, useInotify=useInotify)
+            self._fileScanner = scanner
+        elif useInotify:
+            scanner.enableInotify()
+        return scanner
+
     def getCopyOrLink(self):    
         # Set a function to copyFile or createLink
         # depending in the user selected option 
@@ -256,19 +271,22 @@ class ProtImportFiles(ProtImport):
         filePaths = self.getMatchFiles()
         
         for fileName in filePaths:
-            if self._idRegex:
-                # Try to match the file id from filename
-                # this is set by the user by using #### format in the pattern
-                match = self._idRegex.match(fileName)
-                if match is None:
-                    raise Exception("File '%s' doesn't match the pattern '%s'"
-                                    % (fileName, self.getPattern()))
+            yield fileName, self._getFileId(fileName)
 
-                fileId = int(match.group(1))
+    def _getFileId(self, fileName):
+        """ Return the id of a file matched with the pattern, or None if
+        the id is not set by the user with the #### format in the pattern.
+        It should be called after getPattern, that sets the id regex.
+        """
+        if self._idRegex:
+            # Try to match the file id from filename
+            match = self._idRegex.match(fileName)
+            if match is None:
+                raise Exception("File '%s' doesn't match the pattern '%s'"
+                                % (fileName, self.getPattern()))
 
-            else:
-                fileId = None
-                
-            yield fileName, fileId            
+            return int(match.group(1))
+
+        return None            
 
 
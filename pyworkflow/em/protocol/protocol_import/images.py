@@ -28,10 +28,14 @@
 import sys
 import os
 import re
+import time
+import heapq
 
 from os.path import basename, exists, isdir
-import time
 from datetime import timedelta, datetime
+from collections import OrderedDict
+from itertools import count
+from multiprocessing.pool import ThreadPool
 
 import pyworkflow.utils as pwutils
 from pyworkflow.utils.properties import Message
@@ -53,8 +57,33 @@ class ProtImportImages(ProtImportFiles):
     # If set to True, each binary file will be inspected to
     # see if it is a binary stack containing more items
     _checkStacks = True
+    # Range of seconds to wait before checking for new files in streaming
+    MIN_POLL_TIME = 1
+    MAX_POLL_TIME = 15
         
     #--------------------------- DEFINE param functions ------------------------
+    def _defineParams(self, form):
+        ProtImportFiles._defineParams(self, form)
+
+        streamingSection = form.getSection('Streaming')
+        streamingSection.addParam('copyThreads', params.IntParam, default=4,
+                                  condition='dataStreaming',
+                                  expertLevel=params.LEVEL_ADVANCED,
+                                  label="Copy threads",
+                                  help="Number of files that are copied (or "
+                                       "linked) and inspected at the same "
+                                       "time. A slow copy of a big file "
+                                       "will not delay the import of the "
+                                       "other ones.")
+        streamingSection.addParam('verifyChecksum', params.BooleanParam,
+                                  default=False,
+                                  condition='dataStreaming and copyFiles',
+                                  expertLevel=params.LEVEL_ADVANCED,
+                                  label="Verify copies checksum?",
+                                  help="Compare the md5 checksum of each "
+                                       "copied file with the original one. "
+                                       "A file is copied again once if "
+                                       "they do not match.")
 
     def _defineAcquisitionParams(self, form):
         """ Define acquisition parameters, it can be overriden
@@ -210,19 +239,21 @@ class ProtImportImages(ProtImportFiles):
         # Call a function that should be implemented by each subclass
         self.setSamplingRate(imgSet)
         outFiles = [imgSet.getFileName()]
-        imgh = ImageHandler()
         img = imgSet.ITEM_TYPE()
         img.setAcquisition(acquisition)
-        n = 1
         copyOrLink = self.getCopyOrLink()
+        verifyChecksum = self.copyFiles.get() and self.verifyChecksum.get()
         outputName = self._getOutputName()
         alreadyWarned = False  # Use this flag to warn only once
 
         finished = False
         # this is only used when creating stacks from frame files
         self.createdStacks = set()
+        # Files that were still being modified, they are checked again
+        # in the next pass (see iterNewInputFiles)
+        self._modifiedFiles = OrderedDict()
+        self._allFilesScanned = False
 
-        i = 0
         lastDetectedChange = datetime.now()
 
         # Ignore the timeout variables if we are not really in streaming mode
@@ -233,14 +264,66 @@ class ProtImportImages(ProtImportFiles):
             timeout = timedelta(seconds=5)
             fileTimeout = timedelta(seconds=5)
 
+        # Wait for new files with an adaptive interval, it is reset when
+        # some file is imported and increased while nothing changes.
+        # If inotify is available, the wait ends when a file is created.
+        scanner = self._getFileScanner(self.getPattern(),
+                                       useInotify=self.dataStreaming.get())
+        pollTime = self.MIN_POLL_TIME
+        firstPass = True
+
+        # Files are copied (or linked) and inspected by a pool of threads.
+        # Completed copies are kept in a heap until all the previous files
+        # are done, so they are added to the output set in file id order
+        # (or in the order they were found if there are no ids), not in
+        # the order the copies finish. The number of pending files is
+        # bounded, so the discovery loop waits for the first one when the
+        # copies are too slow.
+        copyThreads = max(1, self.copyThreads.get())
+        maxPending = 2 * copyThreads
+        pool = ThreadPool(copyThreads)
+        pending = []
+        foundOrder = count()
+        stats = {'files': 0, 'bytes': 0, 'seconds': 0.}
+
+        def appendImported(maxLeft):
+            """ Append the first files whose copy is done, waiting for
+            them while there are more than maxLeft pending.
+            Return the number of appended files.
+            """
+            appended = 0
+            while pending and (len(pending) > maxLeft or
+                               pending[0][-1].ready()):
+                _, _, uniqueFn, fileId, dst, result = heapq.heappop(pending)
+                n, size = result.get()
+                self.debug('Appending file to DB...')
+                imgSet.enableAppend()
+                self._appendImportedFile(img, imgSet, dst, uniqueFn,
+                                         fileId, n)
+                outFiles.append(dst)
+                self.debug('After append. Files: %d' % len(outFiles))
+                stats['files'] += 1
+                stats['bytes'] += size
+                appended += 1
+            return appended
+
         while not finished:
-            time.sleep(3) # wait 3 seconds before check for new files
+            t0 = time.time()
+            if pending:  # wake up when the oldest copy is done
+                pending[0][-1].wait(pollTime)
+            elif not firstPass:
+                scanner.wait(pollTime)
+            if not pending:  # do not count the time waiting for new files
+                t0 = time.time()
+            firstPass = False
             someNew = False
             someAdded = False
 
             for fileName, uniqueFn, fileId in self.iterNewInputFiles():
                 someNew = True
                 if self.fileModified(fileName, fileTimeout):
+                    # Check it again in the next pass
+                    self._modifiedFiles[fileName] = (uniqueFn, fileId)
                     continue
                 
                 dst = self._getExtraPath(uniqueFn)
@@ -251,38 +334,19 @@ class ProtImportImages(ProtImportFiles):
                         self.warning('Removing white spaces from copies/symlinks.')
                         alreadyWarned = True
                     dst = dst.replace(' ', '')
-                copyOrLink(fileName, dst)
 
                 self.debug('Importing file: %s' % fileName)
                 self.debug("uniqueFn: %s" % uniqueFn)
                 self.debug("dst Fn: %s" % dst)
 
-                if self._checkStacks:
-                    _, _, _, n = imgh.getDimensions(dst)
-
-                someAdded = True
-                self.debug('Appending file to DB...')
-                if self.importedFiles: # enable append after first append
-                    imgSet.enableAppend()
-
-                if n > 1:
-                    for index in range(1, n+1):
-                        img.cleanObjId()
-                        img.setMicId(fileId)
-                        img.setFileName(dst)
-                        img.setIndex(index)
-                        self._addImageToSet(img, imgSet)
-                else:
-                    img.setObjId(fileId)
-                    img.setFileName(dst)
-                    # Fill the micName if img is either a Micrograph or a Movie
-                    uniqueFn = uniqueFn.replace(' ', '')
-                    self.debug("FILENAME TO fillMicName: %s" % uniqueFn)
-                    self._fillMicName(img, uniqueFn)
-                    self._addImageToSet(img, imgSet)
+                result = pool.apply_async(self._importFile,
+                                          (fileName, dst, copyOrLink,
+                                           verifyChecksum))
+                heapq.heappush(pending, (fileId, next(foundOrder),
+                                         uniqueFn, fileId, dst, result))
+                someAdded |= appendImported(maxPending) > 0
 
-                outFiles.append(dst)
-                self.debug('After append. Files: %d' % len(outFiles))
+            someAdded |= appendImported(maxPending) > 0
 
             if someAdded:
                 self.debug('Updating output...')
@@ -290,6 +354,13 @@ class ProtImportImages(ProtImportFiles):
                                       state=imgSet.STREAM_OPEN)
                 self.debug('Update Done.')
 
+            if pending or someAdded:
+                stats['seconds'] += time.time() - t0
+                self._logImportThroughput(stats, len(pending))
+                pollTime = self.MIN_POLL_TIME
+            else:
+                pollTime = min(2 * pollTime, self.MAX_POLL_TIME)
+
             self.debug('Checking if finished...someNew: %s' % someNew)
 
             now = datetime.now()
@@ -313,9 +384,18 @@ class ProtImportImages(ProtImportFiles):
                 # the timestamp of the last event
                 lastDetectedChange = now
 
+        # Wait for the copies that are still running
+        t0 = time.time()
+        if appendImported(0):
+            stats['seconds'] += time.time() - t0
+            self._logImportThroughput(stats, 0)
+        pool.close()
+        pool.join()
+
         self._updateOutputSet(outputName, imgSet,
                               state=imgSet.STREAM_CLOSED)
 
+        scanner.close()
         self._cleanUp()
 
         return outFiles
@@ -475,15 +555,101 @@ class ProtImportImages(ProtImportFiles):
     def _setupFirstImage(self, img, imgSet):
         pass
 
+    def _importFile(self, fileName, dst, copyOrLink, verifyChecksum=False):
+        """ Copy or link a file into the project and read the number of
+        images in it. This function is run by the threads of the streaming
+        import, so it should not modify the output set.
+        Return a tuple (n, size) with the number of images (1 if stacks
+        are not checked) and the number of bytes copied (0 for links).
+        """
+        copyOrLink(fileName, dst)
+        copied = os.path.exists(dst) and not os.path.islink(dst)
+
+        if verifyChecksum and copied:
+            srcChecksum = pwutils.getFileChecksum(fileName)
+            if pwutils.getFileChecksum(dst) != srcChecksum:
+                self.warning("Checksum mismatch for %s, copying it again."
+                             % dst)
+                copyOrLink(fileName, dst)
+                if pwutils.getFileChecksum(dst) != srcChecksum:
+                    raise Exception("Checksum of %s does not match with the "
+                                    "one of %s" % (dst, fileName))
+        n = 1
+        if self._checkStacks:
+            # Use a new handler, the Xmipp image of each handler should
+            # not be shared between threads. Only the header is read.
+            _, _, _, n = ImageHandler().getDimensions(dst)
+
+        return n, pwutils.getFileSize(dst) if copied else 0
+
+    def _appendImportedFile(self, img, imgSet, dst, uniqueFn, fileId, n):
+        """ Add the images of an imported file to the output set, one
+        for each image if the file is a stack.
+        """
+        if n > 1:
+            for index in range(1, n+1):
+                img.cleanObjId()
+                img.setMicId(fileId)
+                img.setFileName(dst)
+                img.setIndex(index)
+                self._addImageToSet(img, imgSet)
+        else:
+            img.setObjId(fileId)
+            img.setFileName(dst)
+            # Fill the micName if img is either a Micrograph or a Movie
+            uniqueFn = uniqueFn.replace(' ', '')
+            self.debug("FILENAME TO fillMicName: %s" % uniqueFn)
+            self._fillMicName(img, uniqueFn)
+            self._addImageToSet(img, imgSet)
+
+    def _logImportThroughput(self, stats, pending):
+        """ Report how fast files are being imported in streaming. """
+        seconds = max(stats['seconds'], 1e-3)
+        msg = ("Imported %d files in %s (%0.2f files/s)"
+               % (stats['files'], pwutils.prettyDelta(timedelta(seconds=seconds)),
+                  stats['files'] / seconds))
+        if stats['bytes']:
+            msg += ", copied %s (%s/s)" % (pwutils.prettySize(stats['bytes']),
+                                           pwutils.prettySize(stats['bytes'] /
+                                                              seconds))
+        if pending:
+            msg += ", %d files pending" % pending
+        self.info(msg)
+
     def iterNewInputFiles(self):
         """ Iterate over input files that have not been imported.
+        Only the files found by the scanner since the last call are
+        checked, together with the ones that were still being modified
+        (stored in self._modifiedFiles by the streaming import step).
         This function uses the self.importedFiles dict.
         """
-        for fileName, fileId in self.iterFiles():
+        pattern = self.getPattern()
+        scanner = self._getFileScanner(pattern)
+        if self._allFilesScanned:
+            newFiles = scanner.scan()
+        else:  # the scanner could have been used before (e.g. validation)
+            newFiles = scanner.getFiles()
+            self._allFilesScanned = True
+
+        for fileName, uniqueFn, fileId in self._popModifiedFiles():
+            yield fileName, uniqueFn, fileId
+
+        filePaths = [re.split(r'[$*#?]', pattern)[0]]
+        for fileName in newFiles:
             # If file already imported, skip it
-            uniqueFn = self._getUniqueFileName(fileName)
+            uniqueFn = self._getUniqueFileName(fileName, filePaths)
             if uniqueFn not in self.importedFiles:
-                yield fileName, uniqueFn, fileId
+                yield fileName, uniqueFn, self._getFileId(fileName)
+
+    def _popModifiedFiles(self):
+        """ Return the (fileName, uniqueFn, fileId) of the files that were
+        still being modified in the previous pass, and forget them. The
+        ones that are not imported in this pass will be stored again.
+        """
+        modifiedFiles = self._modifiedFiles
+        self._modifiedFiles = OrderedDict()
+        return [(fileName, uniqueFn, fileId) for fileName, (uniqueFn, fileId)
+                in modifiedFiles.iteritems()]
 
     def _fillImportedFiles(self, imgSet):
         from pyworkflow.em import SetOfMicrographsBase
@@ -33,6 +33,7 @@ from datetime import timedelta
 import socket
 import select
 import shlex
+from itertools import chain
 
 import pyworkflow.utils as pwutils
 import pyworkflow.protocol.params as params
@@ -533,7 +534,10 @@ class ProtImportMovies(ProtImportMicBase):
         if not (self.inputIndividualFrames and self.stackFrames):
             # In this case behave just as
             if self.streamingSocket:
-                iterInputFiles = self.iterFilenamesFromSocket()
+                # Files received in the socket are only announced once,
+                # so check again the ones that were still being modified
+                iterInputFiles = chain(self._popModifiedFiles(),
+                                       self.iterFilenamesFromSocket())
             else:
                 iterInputFiles = ProtImportMicBase.iterNewInputFiles(self)
             
@@ -579,6 +583,10 @@ class ProtImportMovies(ProtImportMicBase):
         suffix = self.movieSuffix.get()
         ih = ImageHandler()
         
+        # Stacks that were still being modified are not imported yet,
+        # they will be returned again from the created stacks
+        self._popModifiedFiles()
+
         for movieFn in self.createdStacks:
             uniqueFn = basename(movieFn)
             if uniqueFn not in self.importedFiles:
@@ -38,7 +38,7 @@ from pyworkflow.protocol.constants import (STEPS_PARALLEL, LEVEL_ADVANCED,
                                            STATUS_NEW)
 from pyworkflow.protocol.params import (PointerParam, FloatParam, IntParam,
                                         BooleanParam, FileParam, LabelParam)
-from pyworkflow.utils.path import copyTree, removeBaseExt, makePath, makeFilePath
+from pyworkflow.utils.path import copyTree, removeBaseExt, makePath
 from pyworkflow.utils.properties import Message
 from pyworkflow.utils.utils import prettyTime
 from pyworkflow.em.protocol import EMProtocol
@@ -51,6 +51,8 @@ class ProtMicrographs(EMProtocol):
 
 class ProtCTFMicrographs(ProtMicrographs):
     """ Base class for all protocols that estimates the CTF"""
+    # The estimation of each micrograph can run in other process
+    _processSteps = ['_estimateCTF']
 
     def __init__(self, **kwargs):
         EMProtocol.__init__(self, **kwargs)
@@ -124,7 +126,7 @@ class ProtCTFMicrographs(ProtMicrographs):
                            'details. However, since there are fewer windows, '
                            'estimations are noisier.')
 
-        form.addParallelSection(threads=2, mpi=1)
+        form.addParallelSection(threads=2, mpi=1, processes=True)
 
     def _defineProcessParams(self, form):
         """ This method should be implemented by subclasses
@@ -137,11 +139,21 @@ class ProtCTFMicrographs(ProtMicrographs):
         on a set of micrographs.
         """
         if not self.recalculate:
+            # Prepare the command also when there are no micrographs yet,
+            # the workers of a pool of processes get a copy of the
+            # protocol when the steps start to run
+            self._defineValues()
+            self._prepareCommand()
             self.initialIds = self._insertInitialSteps()
             self.micDict = OrderedDict()
             micDict, _ = self._loadInputList()
             ctfIds = self._insertNewMicsSteps(micDict.values())
             self._insertFinalSteps(ctfIds)
+            if self.isContinued():
+                self._importLegacyDoneMarkers(
+                    self.micDict.values(),
+                    lambda mic: self._getMicrographDone(
+                        self._getMicrographDir(mic)))
             # For the streaming mode, the steps function have a 'wait' flag
             # that can be turned on/off. For example, here we insert the
             # createOutputStep but it wait=True, which means that can not be
@@ -383,16 +395,33 @@ class ProtCTFMicrographs(ProtMicrographs):
         else:
             return self.inputCtf.get()
 
+    def _getProcessStepState(self, funcName, funcArgs):
+        """ Send the micrograph of the step to the worker processes, to
+        mark it as done (see _writeMicrographDone).
+        """
+        micName = funcArgs[2]
+        return {'micDict': {micName: self.micDict[micName]}}
+
     def _getMicrographDir(self, mic):
         """ Return an unique dir name for results of the micrograph. """
         return self._getExtraPath(removeBaseExt(mic.getFileName()))
 
     def _getMicrographDone(self, micDir):
-        """ Return the file that is used as a flag of termination. """
+        """ Return the file that was used as a flag of termination.
+        It is only checked to import the progress of old runs.
+        """
         return join(micDir, 'done.txt')
 
-    def _writeMicrographDone(self, micDir):
-        open(self._getMicrographDone(micDir), 'w').close()
+    def _writeMicrographDone(self, micDir, micName):
+        """ Mark the micrograph with this name as processed. """
+        mic = getattr(self, 'micDict', {}).get(micName, None)
+        if mic is not None:
+            self._setItemsProcessed([mic])
+
+    def _isMicrographDone(self, micName):
+        """ Return True if the micrograph with this name was processed. """
+        mic = getattr(self, 'micDict', {}).get(micName, None)
+        return mic is not None and self._isItemProcessed(mic)
 
     def _iterMicrographs(self, inputMics=None):
         """ Iterate over micrographs and yield
@@ -547,20 +576,8 @@ class ProtCTFMicrographs(ProtMicrographs):
         This can be used to load new micrographs for picking as well as
         new CTF (if used) in streaming.
         """
-        setFn = inputSet.getFileName()
-        self.debug("Loading input db: %s" % setFn)
-        updatedSet = SetClass(filename=setFn)
-        updatedSet.loadAllProperties()
-        newItemDict = OrderedDict()
-        for item in updatedSet:
-            micKey = getKeyFunc(item)
-            if micKey not in self.micDict:
-                newItemDict[micKey] = item.clone()
-        streamClosed = updatedSet.isStreamClosed()
-        updatedSet.close()
-        self.debug("Closed db.")
-
-        return newItemDict, streamClosed
+        return self._loadNewItems(inputSet, SetClass, getKeyFunc,
+                                  self.micDict)
 
     def _updateOutputCTFSet(self, micList, streamMode):
         micDoneList = [mic for mic in micList]
@@ -618,31 +635,9 @@ class ProtCTFMicrographs(ProtMicrographs):
         self.debug(" _updateStreamState Stream Mode: %s " % streamMode)
         self._updateOutputSet(outputName, outputCtf, streamMode)
 
-    def _readDoneList(self):
-        """ Read from a text file the id's of the items that have been done. """
-        doneFile = self._getAllDone()
-        doneList = []
-        # Check what items have been previously done
-        if exists(doneFile):
-            with open(doneFile) as f:
-                doneList += [int(line.strip()) for line in f]
-        return doneList
-
-    def _writeDoneList(self, micList):
-        """ Write to a text file the items that have been done. """
-        doneFile = self._getAllDone()
-
-        if not exists(doneFile):
-            makeFilePath(doneFile)
-
-        with open(doneFile, 'a') as f:
-            for mic in micList:
-                f.write('%d\n' % mic.getObjId())
-
     def _isMicDone(self, mic):
-        """ A mic is done if the marker file exists. """
-        micDir = self._getMicrographDir(mic)
-        return exists(self._getMicrographDone(micDir))
+        """ A mic is done if it has been marked as processed. """
+        return self._isItemProcessed(mic)
 
     def _getAllDone(self):
         return self._getExtraPath('DONE', 'all.TXT')
@@ -28,12 +28,17 @@
 # **************************************************************************
 
 import os
+import time
+import threading
 from os.path import join, basename, exists
 from datetime import datetime
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import pyworkflow.object as pwobj
 from pyworkflow import VERSION_1_1
-from pyworkflow.protocol.params import PointerParam
+from pyworkflow.protocol.params import (PointerParam, IntParam, FloatParam,
+                                        EnumParam, LEVEL_ADVANCED)
 
 from pyworkflow.protocol.constants import STEPS_PARALLEL, MODE_RESUME
 import pyworkflow.utils as pwutils
@@ -56,6 +61,8 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
     # the value should be either 'mrc' or 'mrcs'
     CONVERT_TO_MRC = None
     CORRECT_GAIN = False
+    # Used to create the prefetch threads only once
+    _prefetchInitLock = threading.Lock()
 
     def __init__(self, **kwargs):
         ProtPreprocessMicrographs.__init__(self, **kwargs)
@@ -87,6 +94,15 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
         gain, dark = self.getGainAndDark()
         return (getattr(self, 'CORRECT_GAIN', False) and (gain or dark))
 
+    def _getGainTransform(self):
+        """ Return the rotation (in steps of 90 degrees) and the flip to
+        apply to the gain and dark images.
+        """
+        rotation = getattr(self, 'gainRot', None)
+        flip = getattr(self, 'gainFlip', None)
+        return (rotation.get() if rotation is not None else 0,
+                flip.get() if flip is not None else 0)
+
     #--------------------------- DEFINE param functions ----------------------
     def _defineParams(self, form):
         form.addSection(label=Message.LABEL_INPUT)
@@ -95,6 +111,36 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
                       important=True,
                       label=Message.LABEL_INPUT_MOVS,
                       help='Select a set of previously imported movies.')
+        form.addParam('prefetchMovies', IntParam, default=0,
+                      expertLevel=LEVEL_ADVANCED,
+                      label='Movies to prefetch',
+                      help='Number of movies that are prepared (decompressed, '
+                           'converted or gain corrected) in advance, in '
+                           'other threads, while the current ones are '
+                           'processed. Use 0 to prepare each movie in its '
+                           'own step.')
+        form.addParam('prefetchScratchSize', FloatParam, default=50,
+                      condition='prefetchMovies > 0',
+                      expertLevel=LEVEL_ADVANCED,
+                      label='Prefetch scratch space (GB)',
+                      help='Maximum disk space used by the movies prepared '
+                           'in advance, in the protocol tmp folder.')
+
+        if self.CORRECT_GAIN:
+            form.addParam('gainRot', EnumParam, default=0,
+                          choices=['no rotation', '90 degrees',
+                                   '180 degrees', '270 degrees'],
+                          expertLevel=LEVEL_ADVANCED,
+                          label='Rotate gain reference',
+                          help='Rotate the gain and dark images (counter '
+                               'clockwise) before applying them to the '
+                               'movie frames.')
+            form.addParam('gainFlip', EnumParam, default=0,
+                          choices=['no flip', 'upside down', 'left right'],
+                          expertLevel=LEVEL_ADVANCED,
+                          label='Flip gain reference',
+                          help='Flip the gain and dark images after the '
+                               'rotation.')
 
     #--------------------------- INSERT steps functions ---------------------
     def _insertAllSteps(self):
@@ -112,6 +158,11 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
         # Conversion step is part of processMovieStep because of streaming.
         movieSteps = self._insertNewMoviesSteps(self.insertedDict,
                                                 self.inputMovies.get())
+        if self.isContinued():
+            self._importLegacyDoneMarkers(
+                self.inputMovies.get(),
+                lambda movie: self._getExtraPath('DONE_movie_%06d.TXT'
+                                                 % movie.getObjId()))
         finalSteps = self._insertFinalSteps(movieSteps)
         self._insertFunctionStep('createOutputStep',
                                  prerequisites=finalSteps, wait=True)
@@ -197,15 +248,19 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
         return None
 
     def _loadInputList(self):
-        """ Load the input set of movies and create a list. """
-        moviesFile = self.inputMovies.get().getFileName()
-        self.debug("Loading input db: %s" % moviesFile)
-        movieSet = SetOfMovies(filename=moviesFile)
-        movieSet.loadAllProperties()
-        self.listOfMovies = [m.clone() for m in movieSet]
-        self.streamClosed = movieSet.isStreamClosed()
-        movieSet.close()
-        self.debug("Closed db.")
+        """ Load the input set of movies and create a list.
+        Only the movies appended since the last call are read and
+        added to the list.
+        """
+        if not hasattr(self, 'listOfMovies'):
+            self.listOfMovies = []
+            self._loadedMovies = {}
+        newMovies, self.streamClosed = self._loadNewItems(
+            self.inputMovies.get(), SetOfMovies, lambda m: m.getObjId(),
+            self._loadedMovies)
+        for movieId, movie in newMovies.iteritems():
+            self._loadedMovies[movieId] = movie
+            self.listOfMovies.append(movie)
 
     def _checkNewInput(self):
         # Check if there are new movies to process from the input set
@@ -271,6 +326,13 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
                                                movieDict,
                                                movie.hasAlignment(),
                                                prerequisites=self.convertCIStep)
+        # Keep the order of insertion to know which movies to prefetch
+        if not hasattr(self, '_movieQueue'):
+            self._movieQueue = []
+            self._movieQueueIndex = {}
+        self._movieQueueIndex[movie.getObjId()] = len(self._movieQueue)
+        self._movieQueue.append((movie.getObjId(), movieDict,
+                                 movie.hasAlignment()))
         return movieStepId
 
     #--------------------------- STEPS functions -----------------------------
@@ -279,91 +341,34 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
         pass
 
     def processMovieStep(self, movieDict, hasAlignment):
-        movie = Movie()
-        movie.setAcquisition(Acquisition())
-
-        if hasAlignment:
-            movie.setAlignment(MovieAlignment())
-
-        movie.setAttributesFromDict(movieDict, setBasic=True,
-                                    ignoreMissing=True)
-
+        movie = self._createMovie(movieDict, hasAlignment)
         movieFolder = self._getOutputMovieFolder(movie)
         movieFn = movie.getFileName()
-        movieName = basename(movieFn)
-        movieDoneFn = self._getMovieDone(movie)
 
-        if (self.isContinued() and os.path.exists(movieDoneFn)):
+        if self.isContinued() and self._isMovieDone(movie):
             self.info("Skipping movie: %s, seems to be done" % movieFn)
             return
 
-        # Clean old finished files
-        pwutils.cleanPath(movieDoneFn)
-
         if self._filterMovie(movie):
-            pwutils.makePath(movieFolder)
-            pwutils.createLink(movieFn, join(movieFolder, movieName))
-
-            if movieName.endswith('bz2'):
-                newMovieName = movieName.replace('.bz2', '')
-                # We assume that if compressed the name ends with .mrc.bz2
-                if not exists(newMovieName):
-                    self.runJob('bzip2', '-d -f %s' % movieName, cwd=movieFolder)
-
-            elif movieName.endswith('tbz'):
-                newMovieName = movieName.replace('.tbz', '.mrc')
-                # We assume that if compressed the name ends with .tbz
-                if not exists(newMovieName):
-                    self.runJob('tar', 'jxf %s' % movieName, cwd=movieFolder)
-
-            elif movieName.endswith('.txt'):
-                # Support a list of frame as a simple .txt file containing
-                # all the frames in a raw list, we could use a xmd as well,
-                # but a plain text was choose to simply its generation
-                movieTxt = os.path.join(movieFolder, movieName)
-                with open(movieTxt) as f:
-                    movieOrigin = os.path.basename(os.readlink(movieFn))
-                    newMovieName = movieName.replace('.txt', '.mrcs')
-                    ih = ImageHandler()
-                    for i, line in enumerate(f):
-                        if line.strip():
-                            inputFrame = os.path.join(movieOrigin, line.strip())
-                            ih.convert(inputFrame,
-                                       (i+1, os.path.join(movieFolder, newMovieName)))
-            else:
-                newMovieName = movieName
-
-            convertExt = self._getConvertExtension(newMovieName)
-            correctGain = self._doCorrectGain()
-
-            if convertExt or correctGain:
-                inputMovieFn = os.path.join(movieFolder, newMovieName)
-                if inputMovieFn.endswith('.em'):
-                    inputMovieFn += ":ems"
-
-                if convertExt:
-                    newMovieName = pwutils.replaceExt(newMovieName, convertExt)
-                else:
-                    newMovieName = '%s_corrected.%s' % os.path.splitext(newMovieName)
-
-                outputMovieFn = os.path.join(movieFolder, newMovieName)
-
-                # If the protocols wants Scipion to apply the gain, then
-                # there is no reason to convert, since we can produce the
-                # output in the format expected by the program. In some cases,
-                # the alignment programs can directly deal with gain and dark
-                # correction images, so we don't need to apply it
-                if self._doCorrectGain():
-                    self.info("Correcting gain and dark '%s' -> '%s'"
-                              % (inputMovieFn, outputMovieFn))
-                    gain, dark = self.getGainAndDark()
-                    self.correctGain(inputMovieFn, outputMovieFn,
-                                     gainFn=gain, darkFn=dark)
-                else:
-                    self.info("Converting movie '%s' -> '%s'"
-                              % (inputMovieFn, outputMovieFn))
-
-                    ImageHandler().convertStack(inputMovieFn, outputMovieFn)
+            # Start preparing the next movies while this one is processed
+            self._prefetchNextMovies(movie)
+            timings = OrderedDict()
+            t0 = time.time()
+            prefetched = self._popPrefetchedMovie(movie)
+            newMovieName = None
+
+            if prefetched is not None:
+                try:
+                    newMovieName, prefetchTimings, _ = prefetched.get()
+                    timings['wait'] = time.time() - t0
+                    timings.update(prefetchTimings)
+                except Exception as e:
+                    self.warning("Prefetch of movie %s failed: %s. "
+                                 "Preparing it again." % (movieFn, e))
+                    pwutils.cleanPath(movieFolder)
+
+            if newMovieName is None:
+                newMovieName = self._prepareMovie(movie, movieFolder, timings)
 
             # Just store the original name in case it is needed in _processMovie
             movie._originalFileName = pwobj.String(objDoStore=False)
@@ -372,15 +377,232 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
             movie.setFileName(os.path.join(movieFolder, newMovieName))
             self.info("Processing movie: %s" % movie.getFileName())
 
+            t0 = time.time()
             self._processMovie(movie)
+            timings['process'] = time.time() - t0
 
             if self._doMovieFolderCleanUp():
+                t0 = time.time()
                 self._cleanMovieFolder(movieFolder)
+                timings['cleanup'] = time.time() - t0
+
+            self.info("Movie %d timings: %s"
+                      % (movie.getObjId(),
+                         ', '.join('%s %0.2fs' % (k, v)
+                                   for k, v in timings.iteritems())))
 
         # Mark this movie as finished
-        open(movieDoneFn, 'w').close()
+        self._setItemsProcessed([movie])
 
     #--------------------------- UTILS functions ----------------------------
+    def _createMovie(self, movieDict, hasAlignment):
+        """ Create a Movie from the dict passed to processMovieStep. """
+        movie = Movie()
+        movie.setAcquisition(Acquisition())
+
+        if hasAlignment:
+            movie.setAlignment(MovieAlignment())
+
+        movie.setAttributesFromDict(movieDict, setBasic=True,
+                                    ignoreMissing=True)
+        return movie
+
+    def _prepareMovie(self, movie, movieFolder, timings, runJob=None):
+        """ Link the movie into movieFolder and decompress, convert or
+        gain correct it if needed.
+        Params:
+            timings: dict where the time (in seconds) of each stage is stored.
+            runJob: function used to run external programs, self.runJob
+                by default.
+        Returns:
+            the name of the movie file (inside movieFolder) to be processed.
+        """
+        runJob = runJob or self.runJob
+        movieFn = movie.getFileName()
+        movieName = basename(movieFn)
+
+        t0 = time.time()
+        pwutils.makePath(movieFolder)
+        pwutils.createLink(movieFn, join(movieFolder, movieName))
+        timings['link'] = time.time() - t0
+        t0 = time.time()
+
+        if movieName.endswith('bz2'):
+            newMovieName = movieName.replace('.bz2', '')
+            # We assume that if compressed the name ends with .mrc.bz2
+            if not exists(newMovieName):
+                runJob('bzip2', '-d -f %s' % movieName, cwd=movieFolder)
+            timings['decompress'] = time.time() - t0
+
+        elif movieName.endswith('tbz'):
+            newMovieName = movieName.replace('.tbz', '.mrc')
+            # We assume that if compressed the name ends with .tbz
+            if not exists(newMovieName):
+                runJob('tar', 'jxf %s' % movieName, cwd=movieFolder)
+            timings['decompress'] = time.time() - t0
+
+        elif movieName.endswith('.txt'):
+            # Support a list of frame as a simple .txt file containing
+            # all the frames in a raw list, we could use a xmd as well,
+            # but a plain text was choose to simply its generation
+            movieTxt = os.path.join(movieFolder, movieName)
+            with open(movieTxt) as f:
+                movieOrigin = os.path.basename(os.readlink(movieFn))
+                newMovieName = movieName.replace('.txt', '.mrcs')
+                ih = ImageHandler()
+                for i, line in enumerate(f):
+                    if line.strip():
+                        inputFrame = os.path.join(movieOrigin, line.strip())
+                        ih.convert(inputFrame,
+                                   (i+1, os.path.join(movieFolder, newMovieName)))
+            timings['stack'] = time.time() - t0
+        else:
+            newMovieName = movieName
+
+        convertExt = self._getConvertExtension(newMovieName)
+        correctGain = self._doCorrectGain()
+
+        if convertExt or correctGain:
+            t0 = time.time()
+            inputMovieFn = os.path.join(movieFolder, newMovieName)
+            if inputMovieFn.endswith('.em'):
+                inputMovieFn += ":ems"
+
+            if convertExt:
+                newMovieName = pwutils.replaceExt(newMovieName, convertExt)
+            else:
+                newMovieName = '%s_corrected.%s' % os.path.splitext(newMovieName)
+
+            outputMovieFn = os.path.join(movieFolder, newMovieName)
+
+            # If the protocols wants Scipion to apply the gain, then
+            # there is no reason to convert, since we can produce the
+            # output in the format expected by the program. In some cases,
+            # the alignment programs can directly deal with gain and dark
+            # correction images, so we don't need to apply it
+            if self._doCorrectGain():
+                self.info("Correcting gain and dark '%s' -> '%s'"
+                          % (inputMovieFn, outputMovieFn))
+                gain, dark = self.getGainAndDark()
+                self.correctGain(inputMovieFn, outputMovieFn,
+                                 gainFn=gain, darkFn=dark)
+                timings['gain'] = time.time() - t0
+            else:
+                self.info("Converting movie '%s' -> '%s'"
+                          % (inputMovieFn, outputMovieFn))
+
+                ImageHandler().convertStack(inputMovieFn, outputMovieFn)
+                timings['convert'] = time.time() - t0
+
+        return newMovieName
+
+    def _getPrefetchDepth(self):
+        """ Number of movies to prepare in advance, 0 if disabled. """
+        if not hasattr(self, 'prefetchMovies'):
+            return 0
+        return max(0, self.prefetchMovies.get() or 0)
+
+    def _getPrefetchState(self):
+        """ Return the lock, the pool and the dict of prefetched movies,
+        creating them the first time.
+        """
+        with self._prefetchInitLock:
+            if not hasattr(self, '_prefetchPool'):
+                self._prefetchLock = threading.Lock()
+                self._prefetchPool = ThreadPool(self._getPrefetchDepth())
+                self._prefetched = {}  # movieId -> (asyncResult, size)
+                self._prefetchStarted = set()  # movies whose step has started
+        return self._prefetchLock, self._prefetchPool, self._prefetched
+
+    def _getPrefetchSize(self, prefetched):
+        """ Scratch space (in bytes) used by the prefetched movies. The
+        size of the source files is used for the ones still running.
+        """
+        total = 0
+        for result, size in prefetched.itervalues():
+            if not result.ready():
+                total += size
+            elif result.successful():
+                total += result.get()[2]
+        return total
+
+    def _prefetchMovie(self, movie, movieFolder):
+        """ Function run by the prefetch threads. Returns the prepared
+        movie name, the stage timings and the size of movieFolder.
+        """
+        timings = OrderedDict()
+        newMovieName = self._prepareMovie(movie, movieFolder, timings,
+                                          runJob=self._runPrefetchJob)
+        # Do not follow links (e.g. to the input movie), they do
+        # not use scratch space
+        size = sum(os.lstat(join(movieFolder, fn)).st_size
+                   for fn in os.listdir(movieFolder))
+        return newMovieName, timings, size
+
+    def _runPrefetchJob(self, program, arguments, cwd=None):
+        """ Run a job from the prefetch threads, that are not handled by
+        the steps executor, so its runJob can not be used.
+        """
+        pwutils.runJob(self._log, program, arguments,
+                       env=self._getEnviron(), cwd=cwd)
+
+    def _prefetchNextMovies(self, movie):
+        """ Start preparing the movies inserted after the given one, up to
+        the prefetch depth and while the scratch space budget allows it.
+        """
+        depth = self._getPrefetchDepth()
+        movieQueue = getattr(self, '_movieQueue', [])
+        movieIndex = getattr(self, '_movieQueueIndex', {})
+        if not depth or movie.getObjId() not in movieIndex:
+            return
+
+        lock, pool, prefetched = self._getPrefetchState()
+        maxSize = self.prefetchScratchSize.get() * 1024 ** 3
+        i = movieIndex[movie.getObjId()] + 1
+
+        with lock:
+            for movieId, movieDict, hasAlignment in movieQueue[i:i+depth]:
+                if movieId in prefetched or movieId in self._prefetchStarted:
+                    continue
+                nextMovie = self._createMovie(movieDict, hasAlignment)
+                if self._isMovieDone(nextMovie) or not self._filterMovie(nextMovie):
+                    continue
+                size = os.path.getsize(nextMovie.getFileName())
+                if self._getPrefetchSize(prefetched) + size > maxSize:
+                    break
+                self.debug("Prefetching movie: %s" % nextMovie.getFileName())
+                folder = self._getOutputMovieFolder(nextMovie)
+                prefetched[movieId] = (pool.apply_async(self._prefetchMovie,
+                                                        (nextMovie, folder)),
+                                       size)
+
+    def _popPrefetchedMovie(self, movie):
+        """ Return the prefetch result of a movie (or None if it was not
+        prefetched) and mark it as started, so it is not prefetched later.
+        """
+        if not self._getPrefetchDepth():
+            return None
+        lock, _, prefetched = self._getPrefetchState()
+        with lock:
+            self._prefetchStarted.add(movie.getObjId())
+            return prefetched.pop(movie.getObjId(), (None, 0))[0]
+
+    def _closePrefetchPool(self):
+        """ Wait for the prefetch threads to finish and close their pool. """
+        with self._prefetchInitLock:
+            pool = getattr(self, '_prefetchPool', None)
+            if pool is not None:
+                del self._prefetchPool
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _endRun(self):
+        # The prefetch threads write into the tmp folder,
+        # so they should finish before it is cleaned
+        self._closePrefetchPool()
+        ProtPreprocessMicrographs._endRun(self)
+
     def _getOutputMovieFolder(self, movie):
         """ Create a Movie folder where to work with it. """
         return self._getTmpPath('movie_%06d' % movie.getObjId())
@@ -388,12 +610,9 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
     def _getMovieName(self, movie, ext='.mrc'):
         return self._getExtraPath('movie_%06d%s' % (movie.getObjId(), ext))
 
-    def _getMovieDone(self, movie):
-        return self._getExtraPath('DONE_movie_%06d.TXT' % movie.getObjId())
-
     def _isMovieDone(self, movie):
-        """ A movie is done if the marker file exists. """
-        return os.path.exists(self._getMovieDone(movie))
+        """ A movie is done if it has been marked as processed. """
+        return self._isItemProcessed(movie)
 
     def _getAllDone(self):
         return self._getExtraPath('DONE_all.TXT')
@@ -401,40 +620,6 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
     def _getAllFailed(self):
         return self._getExtraPath('FAILED_all.TXT')
 
-    def _readDoneList(self):
-        """ Read from a text file the id's of the items that have been done. """
-        doneFile = self._getAllDone()
-        doneList = []
-        # Check what items have been previously done
-        if os.path.exists(doneFile):
-            with open(doneFile) as f:
-                doneList += [int(line.strip()) for line in f]
-
-        return doneList
-
-    def _readFailedList(self):
-        """ Read from a text file the id's of the items that have failed. """
-        failedFile = self._getAllFailed()
-        failedList = []
-        # Check what items have been previously done
-        if os.path.exists(failedFile):
-            with open(failedFile) as f:
-                failedList += [int(line.strip()) for line in f]
-
-        return failedList
-
-    def _writeDoneList(self, movieList):
-        """ Write to a text file the items that have been done. """
-        with open(self._getAllDone(), 'a') as f:
-            for movie in movieList:
-                f.write('%d\n' % movie.getObjId())
-
-    def _writeFailedList(self, movieList):
-        """ Write to a text file the items that have failed. """
-        with open(self._getAllFailed(), 'a') as f:
-            for movie in movieList:
-                f.write('%d\n' % movie.getObjId())
-
     #--------------------------- OVERRIDE functions --------------------------
     def _filterMovie(self, movie):
         """ Check if process or not this movie.
@@ -107,6 +107,9 @@ class ProtExtractParticles(ProtParticles):
      This class will take care of the streaming functionality and
      derived classes should mainly overwrite the '_extractMicrograph' function.
      """
+    # The conversion of coordinates and extraction of each micrograph
+    # can run in other process
+    _processSteps = ['extractMicrographStep', 'extractMicrographListStep']
     # --------------------------- DEFINE param functions ------------------------
     def _defineParams(self, form):
         form.addSection(label='Input')
@@ -172,6 +175,11 @@ class ProtExtractParticles(ProtParticles):
         self.initialIds = self._insertInitialSteps()
 
         pickMicIds = self._insertNewMicsSteps(micDict.values())
+        if self.isContinued():
+            self._importLegacyDoneMarkers(
+                self.micDict.values(),
+                lambda mic: self._getExtraPath('DONE', 'mic_%06d.TXT'
+                                               % mic.getObjId()))
 
         self._insertFinalSteps(pickMicIds)
 
@@ -218,25 +226,20 @@ class ProtExtractParticles(ProtParticles):
         # Retrieve the corresponding micrograph with this key and the
         # associated list of coordinates
         mic = self.micDict[micKey]
-
-        micDoneFn = self._getMicDone(mic)
         micFn = mic.getFileName()
 
-        if self.isContinued() and os.path.exists(micDoneFn):
+        if self.isContinued() and self._isMicDone(mic):
             self.info("Skipping micrograph: %s, seems to be done" % micFn)
             return
 
         coordList = self.coordDict[mic.getObjId()]
         self._convertCoordinates(mic, coordList)
 
-        # Clean old finished files
-        pwutils.cleanPath(micDoneFn)
-
         self.info("Extracting micrograph: %s " % micFn)
         self._extractMicrograph(mic, *args)
 
         # Mark this mic as finished
-        open(micDoneFn, 'w').close()
+        self._setItemsProcessed([mic])
 
     def _extractMicrograph(self, mic, *args):
         """ This function should be implemented by subclasses in order
@@ -256,22 +259,18 @@ class ProtExtractParticles(ProtParticles):
 
         for micName in micKeyList:
             mic = self.micDict[micName]
-            micDoneFn = self._getMicDone(mic)
             micFn = mic.getFileName()
-            if self.isContinued() and os.path.exists(micDoneFn):
+            if self.isContinued() and self._isMicDone(mic):
                 self.info("Skipping micrograph: %s, seems to be done" % micFn)
 
             else:
-                # Clean old finished files
-                pwutils.cleanPath(micDoneFn)
                 self.info("Extracting micrograph: %s " % micFn)
                 micList.append(mic)
 
         self._extractMicrographList(micList, *args)
 
-        for mic in micList:
-            # Mark this mic as finished
-            open(self._getMicDone(mic), 'w').close()
+        # Mark these mics as finished
+        self._setItemsProcessed(micList)
 
     def _extractMicrographList(self, micList, *args):
         """ Extract more than one micrograph at once.
@@ -283,6 +282,19 @@ class ProtExtractParticles(ProtParticles):
             self._extractMicrograph(mic, *args)
 
     # --------------------------- UTILS functions -----------------------------
+    def _getProcessStepState(self, funcName, funcArgs):
+        """ The micrographs and coordinates of the step are sent to the
+        worker processes, they could be received after its creation.
+        """
+        micKeys = funcArgs[0]
+        if funcName == 'extractMicrographStep':
+            micKeys = [micKeys]
+        micDict = OrderedDict((k, self.micDict[k]) for k in micKeys)
+        coordDict = dict((mic.getObjId(), self.coordDict[mic.getObjId()])
+                         for mic in micDict.values()
+                         if mic.getObjId() in self.coordDict)
+        return {'micDict': micDict, 'coordDict': coordDict}
+
     def _convertCoordinates(self, mic, coordList):
         """ This function should be implemented by subclasses. """
         pass
@@ -330,19 +342,8 @@ class ProtExtractParticles(ProtParticles):
         3) New computed CTF (in case it is associated with the particles)
         """
         def _loadSet(inputSet, SetClass, getKeyFunc):
-            setFn = inputSet.getFileName()
-            self.debug("Loading input db: %s" % setFn)
-            updatedSet = SetClass(filename=setFn)
-            updatedSet.loadAllProperties()
-            newItemDict = OrderedDict()
-            for item in updatedSet:
-                micKey = getKeyFunc(item)
-                if micKey not in self.micDict:
-                    newItemDict[micKey] = item.clone()
-            streamClosed = updatedSet.isStreamClosed()
-            updatedSet.close()
-            self.debug("Closed db.")
-            return newItemDict, streamClosed
+            return self._loadNewItems(inputSet, SetClass, getKeyFunc,
+                                      self.micDict)
 
         def _loadMics(micSet):
             return _loadSet(micSet, SetOfMicrographs,
@@ -566,38 +567,13 @@ class ProtExtractParticles(ProtParticles):
             if self._micsOther():
                 self._defineSourceRelation(self.inputMicrographs, outputParts)
 
-    def _getMicDone(self, mic):
-        return self._getExtraPath('DONE', 'mic_%06d.TXT' % mic.getObjId())
-
     def _isMicDone(self, mic):
-        """ A mic is done if the marker file exists. """
-        return os.path.exists(self._getMicDone(mic))
+        """ A mic is done if it has been marked as processed. """
+        return self._isItemProcessed(mic)
 
     def _getAllDone(self):
         return self._getExtraPath('DONE', 'all.TXT')
 
-    def _readDoneList(self):
-        """ Read from a text file the id's of the items that have been done. """
-        doneFile = self._getAllDone()
-        doneList = []
-        # Check what items have been previously done
-        if os.path.exists(doneFile):
-            with open(doneFile) as f:
-                doneList += [int(line.strip()) for line in f]
-
-        return doneList
-
-    def _writeDoneList(self, micList):
-        """ Write to a text file the items that have been done. """
-        doneFile = self._getAllDone()
-
-        if not os.path.exists(doneFile):
-            pwutils.makeFilePath(doneFile)
-
-        with open(doneFile, 'a') as f:
-            for mic in micList:
-                f.write('%d\n' % mic.getObjId())
-
     def _getFirstJoinStepName(self):
         # This function will be used for streaming, to check which is
         # the first function that need to wait for all micrographs
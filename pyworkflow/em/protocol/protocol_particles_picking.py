@@ -190,6 +190,11 @@ class ProtParticlePickingAuto(ProtParticlePicking):
 
         micDict, self.streamClosed = self._loadInputList()
         pickMicIds = self._insertNewMicsSteps(micDict.values())
+        if self.isContinued():
+            self._importLegacyDoneMarkers(
+                self.micDict.values(),
+                lambda mic: self._getExtraPath('DONE', 'mic_%06d.TXT'
+                                               % mic.getObjId()))
 
         self._insertFinalSteps(pickMicIds)
 
@@ -227,21 +232,17 @@ class ProtParticlePickingAuto(ProtParticlePicking):
         picking protocol.
         """
         mic = self.micDict[micName]
-        micDoneFn = self._getMicDone(mic)
         micFn = mic.getFileName()
 
-        if self.isContinued() and os.path.exists(micDoneFn):
+        if self.isContinued() and self._isMicDone(mic):
             self.info("Skipping micrograph: %s, seems to be done" % micFn)
             return
 
-        # Clean old finished files
-        pwutils.cleanPath(micDoneFn)
-
         self.info("Picking micrograph: %s " % micFn)
         self._pickMicrograph(mic, *args)
 
         # Mark this mic as finished
-        open(micDoneFn, 'w').close()
+        self._setItemsProcessed([mic])
 
     def _pickMicrograph(self, mic, *args):
         """ This function should be implemented by subclasses in order
@@ -265,22 +266,18 @@ class ProtParticlePickingAuto(ProtParticlePicking):
 
         for micName in micNameList:
             mic = self.micDict[micName]
-            micDoneFn = self._getMicDone(mic)
             micFn = mic.getFileName()
-            if self.isContinued() and os.path.exists(micDoneFn):
+            if self.isContinued() and self._isMicDone(mic):
                 self.info("Skipping micrograph: %s, seems to be done" % micFn)
 
             else:
-                # Clean old finished files
-                pwutils.cleanPath(micDoneFn)
                 self.info("Picking micrograph: %s " % micFn)
                 micList.append(mic)
 
         self._pickMicrographList(micList, *args)
 
-        for mic in micList:
-            # Mark this mic as finished
-            open(self._getMicDone(mic), 'w').close()
+        # Mark these mics as finished
+        self._setItemsProcessed(micList)
 
     def _pickMicrographList(self, micList, *args):
         """ This function can be implemented by subclasses if it is a more
@@ -318,20 +315,8 @@ class ProtParticlePickingAuto(ProtParticlePicking):
         This can be used to load new micrographs for picking as well as
         new CTF (if used) in streaming.
         """
-        setFn = inputSet.getFileName()
-        self.debug("Loading input db: %s" % setFn)
-        updatedSet = SetClass(filename=setFn)
-        updatedSet.loadAllProperties()
-        newItemDict = OrderedDict()
-        for item in updatedSet:
-            micKey = getKeyFunc(item)
-            if micKey not in self.micDict:
-                newItemDict[micKey] = item.clone()
-        streamClosed = updatedSet.isStreamClosed()
-        updatedSet.close()
-        self.debug("Closed db.")
-
-        return newItemDict, streamClosed
+        return self._loadNewItems(inputSet, SetClass, getKeyFunc,
+                                  self.micDict)
 
     def _loadMics(self, micSet):
         return self._loadSet(micSet, SetOfMicrographs,
@@ -488,38 +473,13 @@ class ProtParticlePickingAuto(ProtParticlePicking):
         self.debug(" _updateStreamState Stream Mode: %s " % streamMode)
         self._updateOutputSet(outputName, outputCoords, streamMode)
 
-    def _getMicDone(self, mic):
-        return self._getExtraPath('DONE', 'mic_%06d.TXT' % mic.getObjId())
-
     def _isMicDone(self, mic):
-        """ A mic is done if the marker file exists. """
-        return os.path.exists(self._getMicDone(mic))
+        """ A mic is done if it has been marked as processed. """
+        return self._isItemProcessed(mic)
 
     def _getAllDone(self):
         return self._getExtraPath('DONE', 'all.TXT')
 
-    def _readDoneList(self):
-        """ Read from a text file the id's of the items that have been done. """
-        doneFile = self._getAllDone()
-        doneList = []
-        # Check what items have been previously done
-        if os.path.exists(doneFile):
-            with open(doneFile) as f:
-                doneList += [int(line.strip()) for line in f]
-
-        return doneList
-
-    def _writeDoneList(self, micList):
-        """ Write to a text file the items that have been done. """
-        doneFile = self._getAllDone()
-
-        if not os.path.exists(doneFile):
-            pwutils.makeFilePath(doneFile)
-
-        with open(doneFile, 'a') as f:
-            for mic in micList:
-                f.write('%d\n' % mic.getObjId())
-
     def _getFirstJoinStepName(self):
         # This function will be used for streaming, to check which is
         # the first function that need to wait for all micrographs
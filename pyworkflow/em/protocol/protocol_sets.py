@@ -35,6 +35,18 @@ import random
 from protocol import EMProtocol
 import pyworkflow.protocol as pwprot
 from pyworkflow.object import Boolean, Object
+from pyworkflow.mapper.query import Column
+
+
+def _iterItemsByIds(inputSet, ids, batchSize=500):
+    """ Iterate over the items of inputSet with the given ids (sorted),
+    selecting them from the database in batches. The batch size should
+    not exceed the sqlite limit of variables in a query.
+    """
+    for i in range(0, len(ids), batchSize):
+        where = Column('id').isIn(ids[i:i + batchSize])
+        for item in inputSet.iterItems(where=where):
+            yield item
 
 
 class ProtSets(EMProtocol):
@@ -425,32 +437,24 @@ class ProtSubSet(ProtSets):
         outputSet = outputSetFunction()
         outputSet.copyInfo(inputFullSet)
 
+        # Select the ids of the output elements (without building
+        # the items) and then retrieve only those from the full set
+        fullIds = inputFullSet.getColumnArray('id').tolist()
+
         if self.chooseAtRandom:
-            chosen = random.sample(xrange(len(inputFullSet)),
-                                   self.nElements.get())
-            for i, elem in enumerate(inputFullSet):
-                if i in chosen:
-                    outputSet.append(elem)
+            chosen = sorted(random.sample(fullIds, self.nElements.get()))
         else:
-            # Iterate over the elements in the smaller set
-            # and take the info from the full set
-            inputSubSet = self.inputSubSet.get()
-            # The function to include an element or not
-            # depends on the set operation
-            # if it is 'intersection' we want that item is not None (found)
-            # if it is 'difference' we want that item is None
-            # (not found, different)
+            subIds = set(self.inputSubSet.get().getColumnArray('id').tolist())
+            # The elements to include depends on the set operation
+            # if it is 'intersection' we want the ones in the subset
+            # if it is 'difference' we want the ones not in the subset
             if self.setOperation == self.SET_INTERSECTION:
-                checkElem = lambda e: e is not None
+                chosen = [i for i in fullIds if i in subIds]
             else:
-                checkElem = lambda e: e is None 
-            
-            for origElem in inputFullSet:
-                # TODO: this can be improved if we perform
-                # intersection directly in sqlite
-                otherElem = inputSubSet[origElem.getObjId()]
-                if checkElem(otherElem):
-                    outputSet.append(origElem)
+                chosen = [i for i in fullIds if i not in subIds]
+
+        for elem in _iterItemsByIds(inputFullSet, chosen):
+            outputSet.append(elem)
             
         if outputSet.getSize():
             key = 'output' + inputClassName.replace('SetOf', '') 
@@ -66,6 +66,8 @@ class Canvas(tk.Canvas, Scrollable):
         self.onRightClickCallback = None
         self.onControlClickCallback = None
         self.onAreaSelected = None
+        # Called when the visible region changes (scroll or resize)
+        self.onScrollCallback = None
         
         # Add bindings
         self.bind("<Button-1>", self.onClick)
@@ -77,6 +79,7 @@ class Canvas(tk.Canvas, Scrollable):
         self.bind('<FocusOut>', self._unpostMenu)
         self.bind("<Key>", self._unpostMenu)
         self.bind("<Control-1>", self.onControlClick)
+        self.bind("<Configure>", self._onScroll)
         #self.bind("<MouseWheel>", self.onScroll)
         # Scroll bindings in Linux
         self.bind("<Shift-Button-4>", self.zoomerP)
@@ -245,6 +248,7 @@ class Canvas(tk.Canvas, Scrollable):
                     # print "onDrag position captured."
                 (x, y) = self.getCoordinates(event)
                 self.scan_dragto(event.x, event.y, gain=1)
+                self._onScroll()
 
         except Exception as ex:
             # JMRT: We are having a weird exception here.
@@ -306,6 +310,39 @@ class Canvas(tk.Canvas, Scrollable):
     def createCable(self,src,srcSocket,dst,dstSocket):
         return Cable(self,src,srcSocket,dst,dstSocket)
 
+    def xview(self, *args):
+        result = tk.Canvas.xview(self, *args)
+        if args:
+            self._onScroll()
+        return result
+
+    def yview(self, *args):
+        result = tk.Canvas.yview(self, *args)
+        if args:
+            self._onScroll()
+        return result
+
+    def _onScroll(self, e=None):
+        if self.onScrollCallback:
+            self.onScrollCallback()
+
+    def getVisibleRegion(self):
+        """ Return the (x1, y1, x2, y2) canvas coordinates of the
+        region that is currently displayed.
+        """
+        return (self.canvasx(0), self.canvasy(0),
+                self.canvasx(self.winfo_width()),
+                self.canvasy(self.winfo_height()))
+
+    def isItemVisible(self, item, region=None):
+        """ Return True if the item bounds overlap the visible region. """
+        bbox = self.bbox(item.id)
+        if bbox is None:  # the item is not in the canvas
+            return False
+        x1, y1, x2, y2 = region or self.getVisibleRegion()
+        bx1, by1, bx2, by2 = bbox
+        return bx1 <= x2 and bx2 >= x1 and by1 <= y2 and by2 >= y1
+
     def clear(self):
         """ Clear all items from the canvas """
         self.delete(tk.ALL)
@@ -328,6 +365,7 @@ class Canvas(tk.Canvas, Scrollable):
         self.scale("all", 0, 0, scale, scale)
         self.__scaleFonts()
         self.configure(scrollregion=self.bbox("all"))
+        self._onScroll()
         
     def __scaleFonts(self):
 
@@ -693,6 +731,26 @@ class TextItem(Item):
         super(TextItem, self).move(dx,dy)
         self.canvas.move(self.id_text, dx, dy)
 
+    def setText(self, text, bgColor=None):
+        """ Paint again the item with a new text (and optionally a new
+        background color) keeping its position and connections.
+        """
+        self.text = text
+        self.bgColor = bgColor or self.bgColor
+        oldId = self.id
+        # Paint at the current text center, which may differ from (x, y)
+        # if the canvas has been zoomed
+        x, y = self.x, self.y
+        self.x, self.y = self.canvas.coords(self.id_text)
+        self.canvas.delete(self.id_text, self.id)
+        self.paint()
+        self.x, self.y = x, y
+        if self.canvas.items.pop(oldId, None) is not None:
+            self.canvas.items[self.id] = self
+        # Let the edges adjust to the new size
+        for listenerFunc in self.listeners:
+            listenerFunc(0, 0)
+
     def lift(self):
         super(TextItem, self).lift()
         self.canvas.lift(self.id_text)
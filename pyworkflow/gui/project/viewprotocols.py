@@ -1042,6 +1042,12 @@ class ProtocolsView(tk.Frame):
         self.runsGraphCanvas.onControlClickCallback = self._runItemControlClick
         self.runsGraphCanvas.onAreaSelected = self._selectItemsWithinArea
         self.runsGraphCanvas.onMiddleMouseClickCallback = self._runItemMiddleClick
+        self.runsGraphCanvas.onScrollCallback = self._paintVisibleRunItems
+
+        # Structure of the last drawn graph and the items that changed
+        # while they were out of the visible region
+        self._drawnGraphKey = None
+        self._dirtyRunItems = {}
 
         parent.grid_columnconfigure(0, weight=1)
         parent.grid_rowconfigure(0, weight=1)
@@ -1053,13 +1059,99 @@ class ProtocolsView(tk.Frame):
 
     def updateRunsGraph(self, refresh=False, reorganize=False, checkPids=False):
 
+        oldGraph = getattr(self, 'runsGraph', None)
         self.runsGraph = self.project.getRunsGraph(refresh=refresh,
                                                    checkPids=checkPids)
-        self.drawRunsGraph(reorganize)
+        # Only redraw (and layout) the whole graph if the structure changed,
+        # otherwise just paint again the boxes of the modified runs
+        if reorganize or not self._updateRunItems(oldGraph):
+            self.drawRunsGraph(reorganize)
+
+    def _getRunsGraphKey(self, graph):
+        """ Return a value that identifies the drawn structure of the graph:
+        the nodes, their children and if they are expanded or not.
+        """
+        nodes = []
+        for node in graph.getNodes():
+            nodeId = node.run.getObjId() if node.run else 0
+            nodeInfo = self.settings.getNodeById(nodeId)
+            if nodeInfo is None:
+                return None
+            nodes.append((node.getName(), nodeInfo.isExpanded(),
+                          tuple(c.getName() for c in node.getChilds())))
+        return self.runsView, tuple(nodes)
+
+    def _getRunItemSignature(self, node, nodeInfo):
+        """ Return the values used to paint the box of a node, to
+        detect when it needs to be painted again.
+        """
+        statusColor = getStatusColorFromNode(node)
+        return (self._getNodeText(node), statusColor,
+                self._getBoxColor(nodeInfo, statusColor, node),
+                tuple(nodeInfo.getLabels() or []))
+
+    def _updateRunItems(self, oldGraph):
+        """ Reuse the items of the drawn graph for the nodes of
+        the current one and paint again only the ones that changed.
+        Return False if the graph needs to be drawn from scratch.
+        """
+        if oldGraph is None or self._drawnGraphKey is None:
+            return False
+
+        if self.runsGraph is not oldGraph:
+            if self._getRunsGraphKey(self.runsGraph) != self._drawnGraphKey:
+                return False
+            # Move the drawing attributes to the nodes of the new graph
+            for node in self.runsGraph.getNodes():
+                oldNode = oldGraph.getNode(node.getName())
+                for attr in ['x', 'y', 'width', 'height', 'expanded', 'item']:
+                    if hasattr(oldNode, attr):
+                        setattr(node, attr, getattr(oldNode, attr))
+                if hasattr(node, 'item'):
+                    node.item.node = node
+
+        for node in self.runsGraph.getNodes():
+            item = getattr(node, 'item', None)
+            if item is not None and item.node is node:
+                signature = self._getRunItemSignature(node, item.nodeInfo)
+                if signature != item.signature:
+                    self._dirtyRunItems[node.getName()] = item
+
+        self._paintVisibleRunItems()
+        return True
+
+    def _paintVisibleRunItems(self):
+        """ Paint again the changed items that are inside the
+        visible region of the canvas, the rest will be painted
+        when scrolled into view.
+        """
+        if not self._dirtyRunItems:
+            return
+
+        canvas = self.runsGraphCanvas
+        region = canvas.getVisibleRegion()
+        for name, item in self._dirtyRunItems.items():
+            if canvas.isItemVisible(item, region):
+                del self._dirtyRunItems[name]
+                self._repaintRunItem(item)
+
+    def _repaintRunItem(self, item):
+        """ Paint again an existing box with the current
+        values of its node.
+        """
+        node = item.node
+        item.clearDecorations()
+        item.signature = self._getRunItemSignature(node, item.nodeInfo)
+        nodeText, statusColor, boxColor = item.signature[:3]
+        item.setText(nodeText, bgColor=boxColor)
+        self._paintOval(item, statusColor)
+        self._paintBottomLine(item)
+        item.setSelected(item.getSelected())
 
     def drawRunsGraph(self, reorganize=False):
 
         self.runsGraphCanvas.clear()
+        self._dirtyRunItems.clear()
 
         # Check if there are positions stored
         if reorganize or len(self.settings.getNodes()) == 0:
@@ -1077,6 +1169,8 @@ class ProtocolsView(tk.Frame):
 
         self.runsGraphCanvas.drawGraph(self.runsGraph, layout,
                                        drawNode=self.createRunItem)
+        self._drawnGraphKey = self._getRunsGraphKey(self.runsGraph)
+        self._paintVisibleRunItems()
 
     def createRunItem(self, canvas, node):
 
@@ -1100,12 +1194,10 @@ class ProtocolsView(tk.Frame):
                       bgColor=boxColor, textColor='black')
         # No border
         item.margin = 0
-
-        # Paint the oval..if apply.
-        self._paintOval(item, statusColor)
-
-        # Paint the bottom line (for now only labels are painted there).
-        self._paintBottomLine(item)
+        # The oval and the bottom line are painted once the layout is
+        # done, and only if the box is inside the visible region
+        item.signature = None
+        self._dirtyRunItems[node.getName()] = item
 
         if nodeId in self._selection:
             item.setSelected(True)
@@ -1202,8 +1294,9 @@ class ProtocolsView(tk.Frame):
             statusX = bottomRightX - (statusSize + 3)
             statusY = topLeftY + 3
 
-            pwgui.Oval(self.runsGraphCanvas, statusX, statusY, statusSize,
-                       color=statusColor, anchor=item)
+            item.addDecoration(pwgui.Oval(self.runsGraphCanvas, statusX,
+                                          statusY, statusSize,
+                                          color=statusColor, anchor=item))
 
         # in statusColorMode
         else:
@@ -1215,8 +1308,9 @@ class ProtocolsView(tk.Frame):
                 statusX = bottomRightX - (statusSize + 3)
                 statusY = topLeftY + 3
 
-                pwgui.Oval(self.runsGraphCanvas, statusX, statusY, statusSize,
-                           color='black', anchor=item)
+                item.addDecoration(pwgui.Oval(self.runsGraphCanvas, statusX,
+                                              statusY, statusSize,
+                                              color='black', anchor=item))
 
 
     def _getNodeText(self, node):
@@ -1273,9 +1367,10 @@ class ProtocolsView(tk.Frame):
                 else:
                     labelX -= labelWidth
 
-                pwgui.Rectangle(self.runsGraphCanvas, labelX, labelY,
-                                labelWidth, labelHeight, color=label.getColor(),
-                                anchor=item)
+                item.addDecoration(
+                    pwgui.Rectangle(self.runsGraphCanvas, labelX, labelY,
+                                    labelWidth, labelHeight,
+                                    color=label.getColor(), anchor=item))
             else:
 
                 item.nodeInfo.getLabels().remove(labelId)
@@ -1987,8 +2082,23 @@ class RunBox(pwgui.TextBox):
     def __init__(self, nodeInfo, canvas, text, x, y, bgColor, textColor):
         pwgui.TextBox.__init__(self, canvas, text, x, y, bgColor, textColor)
         self.nodeInfo = nodeInfo
+        # Ovals and rectangles painted over the box
+        self._decorations = []
         canvas.addItem(self)
 
+    def addDecoration(self, decoration):
+        self._decorations.append(decoration)
+
+    def clearDecorations(self):
+        """ Remove the decorations from the canvas and stop
+        notifying them the changes of the box.
+        """
+        for d in self._decorations:
+            self.canvas.delete(d.id)
+            self.listeners.remove(d.updateSrc)
+            self.selectionListeners.remove(d.selectionListener)
+        self._decorations = []
+
     def move(self, dx, dy):
         pwgui.TextBox.move(self, dx, dy)
         self.nodeInfo.setPosition(self.x, self.y)
@@ -0,0 +1,194 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module contains a small API to build conditions and orderings
+over the attributes of the items of a Set. They are compiled to
+parameterized SQL by the flat mapper, so the filtering is done in
+the database and only the matching items are built. For example:
+
+    from pyworkflow.mapper.query import Column
+
+    defocus = Column('_ctfModel._defocusU')
+    where = (Column('_micId').isIn([1, 3, 5]) &
+             defocus.between(10000, 30000))
+    for particle in partSet.iterItems(where=where,
+                                      orderBy=[defocus.desc(), 'id'],
+                                      limit=100):
+        ...
+"""
+
+
+class Condition(object):
+    """ Base class for conditions. Conditions can be combined with
+    & (and), | (or) and ~ (not).
+    """
+    def __and__(self, other):
+        return _Combination('AND', self, other)
+
+    def __or__(self, other):
+        return _Combination('OR', self, other)
+
+    def __invert__(self):
+        return _Not(self)
+
+    def compile(self, getColumn):
+        """ Return the SQL string and the list of parameters of this
+        condition. getColumn is a function that maps attribute labels
+        (e.g. '_micId') to table column names.
+        """
+        raise Exception("Condition.compile should be implemented "
+                        "in subclasses.")
+
+    def getLabels(self):
+        """ Return the attribute labels used in this condition. """
+        raise Exception("Condition.getLabels should be implemented "
+                        "in subclasses.")
+
+
+def _toPython(value):
+    """ Convert numpy scalars to python values that sqlite can bind. """
+    return value.item() if hasattr(value, 'item') else value
+
+
+class _Comparison(Condition):
+    def __init__(self, label, operator, values=()):
+        self._label = label
+        self._operator = operator
+        self._values = [_toPython(v) for v in values]
+
+    def compile(self, getColumn):
+        col = getColumn(self._label)
+        op = self._operator
+
+        if op == 'IN' or op == 'NOT IN':
+            if not self._values:  # Empty list, nothing (or all) match
+                return ('0' if op == 'IN' else '1'), []
+            marks = ','.join('?' * len(self._values))
+            return '%s %s (%s)' % (col, op, marks), self._values
+        if op == 'BETWEEN':
+            return '%s BETWEEN ? AND ?' % col, self._values
+        if op in ['IS NULL', 'IS NOT NULL']:
+            return '%s %s' % (col, op), []
+
+        return '%s%s?' % (col, op), self._values
+
+    def getLabels(self):
+        return [self._label]
+
+
+class _Combination(Condition):
+    def __init__(self, operator, *conditions):
+        self._operator = operator
+        self._conditions = conditions
+
+    def compile(self, getColumn):
+        sqls, params = [], []
+        for cond in self._conditions:
+            sql, condParams = cond.compile(getColumn)
+            sqls.append('(%s)' % sql)
+            params.extend(condParams)
+        return (' %s ' % self._operator).join(sqls), params
+
+    def getLabels(self):
+        return [l for cond in self._conditions for l in cond.getLabels()]
+
+
+class _Not(Condition):
+    def __init__(self, condition):
+        self._condition = condition
+
+    def compile(self, getColumn):
+        sql, params = self._condition.compile(getColumn)
+        return 'NOT (%s)' % sql, params
+
+    def getLabels(self):
+        return self._condition.getLabels()
+
+
+class Ordering(object):
+    """ Ordering by a column, in ascending or descending direction. """
+    def __init__(self, label, direction='ASC'):
+        self.label = label
+        self.direction = direction
+
+
+class Column(object):
+    """ Reference to an attribute of the items in a Set (e.g. '_micId',
+    '_ctfModel._defocusU') or to one of the basic columns (id, enabled,
+    label, comment). It is used to build conditions and orderings.
+    """
+    def __init__(self, label):
+        self._label = label
+
+    def getLabel(self):
+        return self._label
+
+    def __eq__(self, value):
+        if value is None:
+            return self.isNull()
+        return _Comparison(self._label, '=', [value])
+
+    def __ne__(self, value):
+        if value is None:
+            return ~self.isNull()
+        return _Comparison(self._label, '!=', [value])
+
+    def __lt__(self, value):
+        return _Comparison(self._label, '<', [value])
+
+    def __le__(self, value):
+        return _Comparison(self._label, '<=', [value])
+
+    def __gt__(self, value):
+        return _Comparison(self._label, '>', [value])
+
+    def __ge__(self, value):
+        return _Comparison(self._label, '>=', [value])
+
+    def __hash__(self):
+        return hash(self._label)
+
+    def isIn(self, values):
+        """ Values should not be more than the sqlite limit of variables
+        in a query (999 by default).
+        """
+        return _Comparison(self._label, 'IN', values)
+
+    def notIn(self, values):
+        return _Comparison(self._label, 'NOT IN', values)
+
+    def between(self, minValue, maxValue):
+        """ Values in the closed range [minValue, maxValue]. """
+        return _Comparison(self._label, 'BETWEEN', [minValue, maxValue])
+
+    def isNull(self):
+        return _Comparison(self._label, 'IS NULL')
+
+    def asc(self):
+        return Ordering(self._label, 'ASC')
+
+    def desc(self):
+        return Ordering(self._label, 'DESC')
@@ -26,9 +26,16 @@
 
 
 from __future__ import print_function
+from operator import attrgetter
+from itertools import izip, islice, repeat
+
+import numpy as np
+
 from pyworkflow.utils.path import replaceExt, joinExt
+from pyworkflow.object import Object
 from mapper import Mapper
-from sqlite_db import SqliteDb
+from sqlite_db import SqliteDb, sqlite
+from query import Condition, Column, Ordering
 
 ID = 'id'
 PARENT_ID = 'parent_id'
@@ -41,6 +48,7 @@ class SqliteMapper(Mapper):
         Mapper.__init__(self, dictClasses)
         self.__initObjDict()
         self.__initUpdateDict()
+        self.__initStoredRows()
         try:
             self.db = SqliteObjectsDb(dbName)
         except Exception as ex:
@@ -51,6 +59,10 @@ class SqliteMapper(Mapper):
         
     def commit(self):
         self.db.commit()
+
+    def getDataVersion(self):
+        """ Return a value that changes whenever the db is modified. """
+        return self.db.getDataVersion()
         
     def __getObjectValue(self, obj):
         """ Get the value of the object to be stored.
@@ -73,9 +85,13 @@ class SqliteMapper(Mapper):
             print("MAPPER: object '%s' doesn't seem to be an Object subclass," % obj)
             print("       it does not have attribute '_objDoStore'. Insert skipped.")
             return 
+        row = (obj._objParentId, obj._objName, obj.getClassName(),
+               self.__getObjectValue(obj), obj._objLabel, obj._objComment)
         obj._objId = self.db.insertObject(obj._objName, obj.getClassName(),
-                                          self.__getObjectValue(obj), obj._objParentId,
+                                          row[3], obj._objParentId,
                                           obj._objLabel, obj._objComment)
+        self.__setStoredRow(obj._objId, row)
+        self._rowsWritten += 1
         self.updateDict[obj._objId] = obj
         sid = obj.strId()
         if namePrefix is None:
@@ -86,6 +102,8 @@ class SqliteMapper(Mapper):
         
     def insert(self, obj):
         """Insert a new object into the system, the id will be set"""
+        self._rowsWritten = 0
+        self.__checkStoredRows()
         self.__insert(obj)
         
     def insertChild(self, obj, key, attr, namePrefix=None):
@@ -113,15 +131,19 @@ class SqliteMapper(Mapper):
     def deleteChilds(self, obj):
         namePrefix = self.__getNamePrefix(obj)
         self.db.deleteChildObjects(namePrefix)
+        for objId in self.__getStoredDescendants(obj.getObjId()):
+            self.__removeStoredRow(objId)
         
     def deleteAll(self):
         """ Delete all objects stored """
         self.db.deleteAll()
+        self.__initStoredRows()
                 
     def delete(self, obj):
         """Delete an object and all its childs"""
         self.deleteChilds(obj)
         self.db.deleteObject(obj.getObjId())
+        self.__removeStoredRow(obj.getObjId())
     
     def __getNamePrefix(self, obj):
         if len(obj._objName) > 0 and '.' in obj._objName:
@@ -135,24 +157,69 @@ class SqliteMapper(Mapper):
         print("obj.getObjValue()", obj.getObjValue())
 
     def updateTo(self, obj, level=1):
+        """ Write the object and its children to the database.
+        Only the rows that have changed since the last time they were
+        written by this mapper are updated, all in a single batch.
+        """
+        self._rowsWritten = 0
+        self.__checkStoredRows()
         self.__initUpdateDict()
+        self._dirtyRows = []
+        self._allRowsStored = True
         self.__updateTo(obj, level)
+
+        if self._dirtyRows:
+            self.db.updateObjects([row + (objId,)
+                                   for objId, row in self._dirtyRows])
+            for objId, row in self._dirtyRows:
+                self.__setStoredRow(objId, row)
+            self._rowsWritten += len(self._dirtyRows)
+
         # Update pending pointers to objects
         for ptr in self.updatePendingPointers:
             self.db.updateObject(ptr._objId, ptr._objName, Mapper.getObjectPersistingClassName(ptr),
                              self.__getObjectValue(obj), ptr._objParentId, 
                              ptr._objLabel, ptr._objComment)
+            # Force writing it again the next time
+            self.__removeStoredRow(ptr._objId)
+            self._rowsWritten += 1
 
         # Delete any child objects that have not been found.
         # This could be the case if some elements (such as inside List)
         # were stored in the database and were removed from the object
-        self.db.deleteMissingObjectsByAncestor(self.__getNamePrefix(obj),
-                                               self.updateDict.keys())
+        if self._allRowsStored:
+            # All rows were written by this mapper, so we know which ones
+            # are missing without searching for them in the database
+            missingIds = []
+            for objId in self.updateDict:
+                for childId in self._storedChildren.get(objId, ()):
+                    if childId not in self.updateDict:
+                        missingIds.append(childId)
+                        missingIds += self.__getStoredDescendants(childId)
+            if missingIds:
+                # Delete children before their parents
+                self.db.deleteObjects(reversed(missingIds))
+                self._rowsWritten += len(missingIds)
+        else:
+            self._rowsWritten += self.db.deleteMissingObjectsByAncestor(
+                self.__getNamePrefix(obj), self.updateDict.keys())
+            missingIds = [childId for objId in self.updateDict
+                          for childId in self._storedChildren.get(objId, ())
+                          if childId not in self.updateDict]
+
+        for objId in missingIds:
+            self.__removeStoredRow(objId)
 
     def __updateTo(self, obj, level):
-        self.db.updateObject(obj._objId, obj._objName, Mapper.getObjectPersistingClassName(obj),
-                             self.__getObjectValue(obj), obj._objParentId, 
-                             obj._objLabel, obj._objComment)
+        row = (obj._objParentId, obj._objName,
+               Mapper.getObjectPersistingClassName(obj),
+               self.__getObjectValue(obj), obj._objLabel, obj._objComment)
+        storedRow = self._storedRows.get(obj._objId, None)
+
+        if storedRow is None:
+            self._allRowsStored = False
+        if row != storedRow:
+            self._dirtyRows.append((obj._objId, row))
 
         if obj.getObjId() in self.updateDict:
             raise Exception('Circular reference, object: %s found twice'
@@ -169,6 +236,12 @@ class SqliteMapper(Mapper):
             else:  
                 self.__updateTo(attr, level + 2)
 
+    def getRowsWritten(self):
+        """ Return the number of rows inserted, updated or deleted
+        by the last call to store, insert or updateTo.
+        """
+        return self._rowsWritten
+
     def updateFrom(self, obj):
         objRow = self.db.selectObjectById(obj._objId)
         self.fillObject(obj, objRow)
@@ -324,6 +397,48 @@ class SqliteMapper(Mapper):
         self.updateDict = {}
         # This is used to store pointers that pointed object are not stored yet
         self.updatePendingPointers = []
+
+    def __initStoredRows(self):
+        """ Clear the cache of rows written by this mapper. It is used
+        to only update the objects that have changed since they were
+        written, and to know their children without querying the db.
+        """
+        self._storedRows = {}  # {objId: row values}
+        self._storedChildren = {}  # {objId: set of children ids}
+        self._rowsWritten = 0
+        self._storedVersion = None
+
+    def __checkStoredRows(self):
+        """ Clear the cache of stored rows if the database has been
+        modified by another connection (another mapper or process), since
+        then the rows written by this mapper may not be the current ones.
+        """
+        dataVersion = self.getDataVersion()[0]
+        if dataVersion != self._storedVersion:
+            self.__initStoredRows()
+            self._storedVersion = dataVersion
+
+    def __setStoredRow(self, objId, row):
+        oldRow = self._storedRows.get(objId, None)
+        if oldRow is not None and oldRow[0] != row[0]:
+            self._storedChildren.get(oldRow[0], set()).discard(objId)
+        self._storedRows[objId] = row
+        if row[0] is not None:
+            self._storedChildren.setdefault(row[0], set()).add(objId)
+
+    def __removeStoredRow(self, objId):
+        row = self._storedRows.pop(objId, None)
+        if row is not None and row[0] in self._storedChildren:
+            self._storedChildren[row[0]].discard(objId)
+        self._storedChildren.pop(objId, None)
+
+    def __getStoredDescendants(self, objId):
+        """ Return the ids of all known descendants of an object. """
+        descendants = []
+        for childId in self._storedChildren.get(objId, ()):
+            descendants.append(childId)
+            descendants += self.__getStoredDescendants(childId)
+        return descendants
          
     def selectBy(self, iterate=False, objectFilter=None, **args):
         """Select object meetings some criteria"""
@@ -591,10 +706,19 @@ class SqliteObjectsDb(SqliteDb):
                              object_parent_extended, object_child_extended))
         return self.cursor.lastrowid
     
+    UPDATE_OBJECT = ("UPDATE Objects SET parent_id=?, name=?, classname=?, "
+                     "value=?, label=?, comment=? WHERE id=?")
+
     def updateObject(self, objId, name, classname, value, parent_id, label, comment):
         """Update object data """
-        self.executeCommand("UPDATE Objects SET parent_id=?, name=?, classname=?, value=?, label=?, comment=? WHERE id=?",
+        self.executeCommand(self.UPDATE_OBJECT,
                             (parent_id, name, classname, value, label, comment, objId))
+
+    def updateObjects(self, rows):
+        """ Update several objects with a single command. Each row should
+        contain: parent_id, name, classname, value, label, comment and id.
+        """
+        self.executeMany(self.UPDATE_OBJECT, rows)
         
     def selectObjectById(self, objId):
         """Select an object give its id"""
@@ -650,6 +774,10 @@ class SqliteObjectsDb(SqliteDb):
     def deleteObject(self, objId):
         """Delete an existing object"""
         self.executeCommand(self.DELETE + ID + "=?", (objId,))
+
+    def deleteObjects(self, objIds):
+        """ Delete several objects given their ids. """
+        self.executeMany(self.DELETE + ID + "=?", ((i,) for i in objIds))
         
     def deleteChildObjects(self, ancestor_namePrefix):
         """ Delete from db all objects that are childs 
@@ -667,10 +795,12 @@ class SqliteObjectsDb(SqliteDb):
         return self._results(iterate=False)
 
     def deleteMissingObjectsByAncestor(self, ancestor_namePrefix, idList):
-        """Select all objects in the hierarchy of ancestor_id"""
+        """Delete all objects in the hierarchy of ancestor_id that are
+        not in idList. Return the number of deleted rows. """
         idStr = ','.join(str(i) for i in idList)
         cmd = "%s name LIKE '%s.%%' AND id NOT IN (%s) " % (self.DELETE, ancestor_namePrefix, idStr)
         self.executeCommand(cmd)
+        return self.cursor.rowcount
 
     def deleteAll(self):
         """ Delete all objects from the db. """
@@ -701,11 +831,15 @@ class SqliteObjectsDb(SqliteDb):
 
 class SqliteFlatMapper(Mapper):
     """Specific Flat Mapper implementation using Sqlite database"""
-    def __init__(self, dbName, dictClasses=None, tablePrefix=''):
+    def __init__(self, dbName, dictClasses=None, tablePrefix='', indexes=None):
         Mapper.__init__(self, dictClasses)
         self._objTemplate = None
+        # Indexes are only created by writers, in the next commit, never
+        # when reading. Also, they are not updated during bulk inserts
+        # in new tables, but created all at once after them
+        self._pendingIndexes = False
         try:
-            self.db = SqliteFlatDb(dbName, tablePrefix)
+            self.db = SqliteFlatDb(dbName, tablePrefix, indexes=indexes)
             self.doCreateTables = self.db.missingTables()
             
             if not self.doCreateTables:
@@ -716,11 +850,23 @@ class SqliteFlatMapper(Mapper):
                             (dbName, tablePrefix, ex))
     
     def commit(self):
+        if self._pendingIndexes:
+            self.db.createIndexes()
+            self._pendingIndexes = False
         self.db.commit()
         
     def close(self):
         self.db.close()
         
+    def createIndex(self, label):
+        """ Create an index on the column of the given attribute label.
+        If the tables are not created yet, the index will be created
+        together with them, otherwise in the next commit.
+        """
+        self.db.addIndex(label)
+        if not self.doCreateTables:
+            self._pendingIndexes = True
+
     def insert(self, obj):
         if self.doCreateTables:
             self.db.createTables(obj.getObjDict(includeClass=True))
@@ -728,16 +874,141 @@ class SqliteFlatMapper(Mapper):
         """Insert a new object into the system, the id will be set"""
         self.db.insertObject(obj.getObjId(), obj.isEnabled(), obj.getObjLabel(), obj.getObjComment(), 
                              *obj.getObjDict().values())
-        
+
+    def insertMany(self, objs, batchSize=10000):
+        """ Insert several objects into the system, the ids should be set.
+        The objects are inserted in batches of batchSize rows, using a single
+        executemany command per batch. The columns layout is computed only
+        once from the first object, so all objects should have the same
+        attributes (as the items of a Set).
+        If the tables are created here, the indexes are created in the
+        next commit, after all rows are inserted.
+        """
+        valuesGetter = None
+        rows = []
+
+        for obj in objs:
+            if valuesGetter is None:
+                if self.doCreateTables:
+                    self.db.createTables(obj.getObjDict(includeClass=True),
+                                         createIndexes=False)
+                    self.doCreateTables = False
+                    self._pendingIndexes = True
+                valuesGetter = self.__getValuesGetter(obj)
+            # Row values are taken right away, since the same object
+            # instance could be modified and passed again
+            rows.append((obj._objId, obj._objEnabled,
+                         obj._objLabel, obj._objComment) + valuesGetter(obj))
+
+            if len(rows) == batchSize:
+                self.db.insertObjects(rows)
+                rows = []
+
+        if rows:
+            self.db.insertObjects(rows)
+
+    def insertColumns(self, template, ids, columns, batchSize=10000):
+        """ Insert len(ids) objects with the same attributes than template,
+        without creating any object. The values are taken from columns,
+        a dict with the attributes keys (e.g. '_ctfModel._defocusU') or
+        the basic columns ('enabled', 'label' and 'comment') and sequences
+        with the values for each object. Missing keys take the value
+        from the template.
+        """
+        if self.doCreateTables:
+            self.db.createTables(template.getObjDict(includeClass=True),
+                                 createIndexes=False)
+            self.doCreateTables = False
+            self._pendingIndexes = True
+
+        n = len(ids)
+        defaults = [('enabled', template.isEnabled()),
+                    ('label', template.getObjLabel()),
+                    ('comment', template.getObjComment())]
+        values = [ids]
+
+        for key, default in defaults + template.getObjDict().items():
+            if key in columns:
+                column = columns[key]
+                # Numpy arrays should be converted to bind the values
+                values.append(column.tolist() if hasattr(column, 'tolist')
+                              else column)
+            else:
+                values.append(repeat(default, n))
+
+        rows = izip(*values)
+        while True:
+            batch = list(islice(rows, batchSize))
+            if not batch:
+                break
+            self.db.insertObjects(batch)
+
+    def __getValuesGetter(self, obj):
+        """ Return a function that retrieves the values to be stored of
+        objects with the same attributes than obj, in the same order
+        than the columns of the Objects table.
+        The values are retrieved directly from _objValue with a single
+        attrgetter call, except for the attributes that redefine
+        getObjValue (e.g. CsvList).
+        """
+        keys = []
+        names = []
+        customIndexes = []
+
+        for i, (key, attr) in enumerate(obj.getMappedDict().iteritems()):
+            keys.append(key)
+            if type(attr).getObjValue.__func__ is Object.getObjValue.__func__:
+                names.append(key + '._objValue')
+            else:
+                names.append(key)
+                customIndexes.append(i)
+
+        if not names:
+            return lambda o: ()
+
+        getter = attrgetter(*names)
+        single = len(names) == 1
+
+        def getValues(o):
+            try:
+                values = getter(o)
+            except AttributeError:
+                # Some attribute is missing in this object
+                return tuple(self.__getNestedObjValue(o, k) for k in keys)
+            # attrgetter does not return a tuple for a single attribute
+            if single:
+                values = (values,)
+            if customIndexes:
+                values = list(values)
+                for i in customIndexes:
+                    values[i] = values[i].getObjValue()
+                values = tuple(values)
+            return values
+
+        return getValues
+
+    def __getNestedObjValue(self, obj, key):
+        """ Return the value to store of a nested attribute,
+        or None if it is missing.
+        """
+        for a in key.split('.'):
+            obj = getattr(obj, a, None)
+            if obj is None:
+                return None
+        return obj.getObjValue()
+
     def enableAppend(self):
         """ This will allow to append items to existing db. 
         This is by default not allow, since most sets are not 
         modified after creation.
+        Declared indexes missing in the db (e.g. in sets created before
+        they were declared) will be created in the next commit.
         """
         if not self.doCreateTables:
             obj = self.selectFirst()
             if obj is not None:
                 self.db.setupCommands(obj.getObjDict(includeClass=True))
+            self._pendingIndexes = True
         
     def clear(self):
         self.db.clear()
@@ -817,11 +1088,17 @@ class SqliteFlatMapper(Mapper):
                 o = attr
         return obj
         
-    def __objFromRow(self, objRow):
+    def __objFromRow(self, objRow, obj=None, objColumns=None):
+        """ Fill an object with the values of the row.
+        If obj is None, the shared template object will be used.
+        objColumns should contain the row index and attribute name
+        of each column, by default all columns of the table.
+        """
         if self._objTemplate is None:
             self.__loadObjDict()
-            
-        obj = self._objTemplate #self.__buildAndFillObj()
+
+        if obj is None:
+            obj = self._objTemplate #self.__buildAndFillObj()
         obj.setObjId(objRow[ID])
         obj.setObjLabel(self._getStrValue(objRow['label']))
         obj.setObjComment(self._getStrValue(objRow['comment']))
@@ -835,28 +1112,37 @@ class SqliteFlatMapper(Mapper):
             print("         db: %s" % self.db.getDbName())
             print("         objRow: ", dict(objRow))
         
-        for c, attrName in self._objColumns:
+        if objColumns is None:
+            objColumns = self._objColumns
+
+        for c, attrName in objColumns:
             obj.setAttributeValue(attrName, objRow[c])
 
         return obj
         
-    def __iterObjectsFromRows(self, objRows, objectFilter=None):
+    def __iterObjectsFromRows(self, objRows, objectFilter=None,
+                              obj=None, objColumns=None):
         for objRow in objRows:
-            obj = self.__objFromRow(objRow)
+            obj = self.__objFromRow(objRow, obj, objColumns)
             if objectFilter is None or objectFilter(obj): 
                 yield obj
         
-    def __objectsFromRows(self, objRows, iterate=False, objectFilter=None):
+    def __objectsFromRows(self, objRows, iterate=False, objectFilter=None,
+                          obj=None, objColumns=None):
         """Create a set of object from a set of rows
         Params:
             objRows: rows result from a db select.
             iterate: if True, iterates over all elements, if False the whole list is returned
             objectFilter: function to filter some of the objects of the results. 
+            obj: object to be filled with each row, by default the template.
+            objColumns: columns to fill, by default all.
         """
+        objIter = self.__iterObjectsFromRows(objRows, objectFilter,
+                                             obj, objColumns)
         if not iterate:
-            return [obj.clone() for obj in self.__iterObjectsFromRows(objRows, objectFilter)]
+            return [obj.clone() for obj in objIter]
         else:
-            return self.__iterObjectsFromRows(objRows, objectFilter)
+            return objIter
          
     def selectBy(self, iterate=False, objectFilter=None, **args):
         """Select object meetings some criteria"""
@@ -867,7 +1153,17 @@ class SqliteFlatMapper(Mapper):
                       , objectFilter=None
                       , orderBy=ID
                       , direction='ASC'
-                      , where='1'):
+                      , where='1'
+                      , columns=None
+                      , limit=None
+                      , offset=None):
+        """ Select all objects matching the where condition.
+        The where can be a string or a Condition (see pyworkflow.mapper.query)
+        and limit and offset can be used to select only a range of rows.
+        If columns is a list of attribute labels (e.g. ['_filename', '_index'])
+        only those columns will be retrieved from the db and filled in the
+        objects, the rest of attributes will be left empty.
+        """
         # Just a sanity check for emtpy sets, that doesn't contains 'Properties' table
         if not self.db.hasTable('Properties'):
             return iter([]) if iterate else []
@@ -876,9 +1172,91 @@ class SqliteFlatMapper(Mapper):
             self.__loadObjDict()
         objRows = self.db.selectAll(orderBy=orderBy,
                                     direction=direction,
-                                    where=where)
-        
-        return self.__objectsFromRows(objRows, iterate, objectFilter) 
+                                    where=where,
+                                    columns=columns,
+                                    limit=limit,
+                                    offset=offset)
+
+        if columns is None:
+            return self.__objectsFromRows(objRows, iterate, objectFilter)
+
+        # Use a new object, so the not selected attributes of the
+        # template object are not mixed with values of the selected ones
+        basicRows = len(self.db.BASIC_COLUMNS)
+        objColumns = [(basicRows + i, c) for i, c in enumerate(columns)]
+        return self.__objectsFromRows(objRows, iterate, objectFilter,
+                                      self.__buildAndFillObj(), objColumns)
+
+    def selectValues(self, columns, orderBy=ID, direction='ASC', where='1',
+                     chunkSize=None, limit=None, offset=None):
+        """ Iterate over the values of the given columns, without
+        building any object.
+        Params:
+            columns: list of attribute labels (e.g. ['_filename', '_index'])
+                or basic columns such as 'id' or 'enabled'.
+            chunkSize: if None, tuples with the values of each row are
+                yielded, otherwise numpy record arrays (with the columns
+                as field names) of at most chunkSize rows.
+        """
+        if not self.db.hasTable('Properties'):
+            return iter([])
+
+        if self._objTemplate is None:
+            self.__loadObjDict()
+        rows = self.db.selectValues(columns, orderBy=orderBy,
+                                    direction=direction, where=where,
+                                    chunkSize=chunkSize, limit=limit,
+                                    offset=offset)
+        if chunkSize is None:
+            return rows
+
+        return (np.rec.fromrecords(chunk, names=columns) for chunk in rows)
+
+    def getColumnArray(self, label, dtype=None, orderBy=ID, direction='ASC',
+                       where='1', chunkSize=100000):
+        """ Return a numpy array with the values of a given column.
+        Rows are read in chunks of chunkSize, without building any object.
+        If dtype is None, it will be inferred from the values.
+        """
+        values = []
+        if self.db.hasTable('Properties'):
+            if self._objTemplate is None:
+                self.__loadObjDict()
+            for chunk in self.db.selectValues([label], orderBy=orderBy,
+                                              direction=direction, where=where,
+                                              chunkSize=chunkSize):
+                values.extend(row[0] for row in chunk)
+
+        return np.array(values, dtype=dtype)
+
+    def toRecordArray(self, labels, orderBy=ID, direction='ASC', where='1',
+                      chunkSize=100000):
+        """ Return a numpy record array with the values of the given
+        columns, using the labels as field names.
+        """
+        records = []
+        if self.db.hasTable('Properties'):
+            if self._objTemplate is None:
+                self.__loadObjDict()
+            for chunk in self.db.selectValues(labels, orderBy=orderBy,
+                                              direction=direction, where=where,
+                                              chunkSize=chunkSize):
+                records.extend(chunk)
+
+        if not records:
+            return np.recarray((0,), dtype=[(l, object) for l in labels])
+
+        return np.rec.fromrecords(records, names=labels)
+
+    def updateColumnFromArray(self, label, ids, values):
+        """ Update the value of a column for the rows with the given ids,
+        using a single executemany command.
+        """
+        if self._objTemplate is None:
+            self.__loadObjDict()
+        # Convert numpy arrays (if any) to python types that sqlite can bind
+        self.db.updateColumn(label, np.asarray(ids).tolist(),
+                             np.asarray(values).tolist())
 
     def aggregate(self, operations, operationLabel, groupByLabels=None):
         rows = self.db.aggregate(operations, operationLabel, groupByLabels)
@@ -936,12 +1314,15 @@ class SqliteFlatDb(SqliteDb):
     # version should be an integer number
     VERSION = 1
     
+    # Columns present in the Objects table for all type of items
+    BASIC_COLUMNS = [ID, 'enabled', 'label', 'comment', 'creation']
+
     CLASS_MAP = {'Integer': 'INTEGER',
                  'Float': 'REAL',
                  'Boolean': 'INTEGER'
                  }
 
-    def __init__(self, dbName, tablePrefix='', timeout=1000):
+    def __init__(self, dbName, tablePrefix='', timeout=1000, indexes=None):
         SqliteDb.__init__(self)
         tablePrefix = tablePrefix.strip()
         if tablePrefix and not tablePrefix.endswith('_'): # Avoid having _ for empty prefix
@@ -975,6 +1356,8 @@ class SqliteFlatDb(SqliteDb):
         self.UPDATE_PROPERTY = "UPDATE Properties SET value=? WHERE key=?"
         self.SELECT_PROPERTY = "SELECT value FROM Properties WHERE key=?"
         self.SELECT_PROPERTY_KEYS = "SELECT key FROM Properties"
+        # Attribute labels that should be indexed
+        self._indexes = set(indexes or [])
 
     def hasProperty(self, key):
         """ Return true if a property with this value is registered. """
@@ -1041,10 +1424,13 @@ class SqliteFlatDb(SqliteDb):
         self.executeCommand("DROP TABLE IF EXISTS %sClasses;" % self.tablePrefix)
         self.executeCommand("DROP TABLE IF EXISTS %sObjects;" % self.tablePrefix)
 
-    def createTables(self, objDict):
+    def createTables(self, objDict, createIndexes=True):
         """Create the Classes and Object table to store items of a Set.
         Each object will be stored in a single row.
         Each nested property of the object will be stored as a column value.
+        If createIndexes is False, the declared indexes should be created
+        later with createIndexes (e.g. after a bulk insert, which is
+        faster than updating the indexes with each row).
         """
         self.setVersion(self.VERSION)
         # Create a general Properties table to store some needed values
@@ -1083,6 +1469,42 @@ class SqliteFlatDb(SqliteDb):
         # Prepare the INSERT and UPDATE commands
         self.setupCommands(objDict)
 
+        if createIndexes:
+            self.createIndexes()
+
+    def createIndexes(self):
+        """ Create the indexes of all declared labels present in
+        the Objects table.
+        """
+        for label in list(self._indexes):
+            if label in self._columnsMapping:
+                self.createIndex(label)
+
+    def addIndex(self, label):
+        """ Declare an index for the given attribute label. It will be
+        created with the tables or in the next call to createIndexes.
+        """
+        self._indexes.add(label)
+
+    def createIndex(self, label):
+        """ Create (if not exists) an index on the column of the given
+        attribute label, to speed up queries filtering by that column.
+        The changes are not committed here.
+        """
+        col = self._getRealCol(label)
+        self.executeCommand("CREATE INDEX IF NOT EXISTS %sIndex_%s "
+                            "ON %sObjects (%s)"
+                            % (self.tablePrefix, col, self.tablePrefix, col))
+        self._indexes.add(label)
+
+    def getIndexes(self):
+        """ Return the attribute labels of the existing indexes. """
+        self.executeCommand("SELECT name FROM sqlite_master WHERE type='index' "
+                            "AND tbl_name='%sObjects'" % self.tablePrefix)
+        names = set(r[0] for r in self.cursor.fetchall())
+        return [label for label, col in self._columnsMapping.iteritems()
+                if '%sIndex_%s' % (self.tablePrefix, col) in names]
+
     def setupCommands(self, objDict):
         """ Setup the INSERT and UPDATE commands base on the object dictionary. """
         self.INSERT_OBJECT = "INSERT INTO %sObjects (id, enabled, label, comment, creation" % self.tablePrefix
@@ -1123,53 +1545,146 @@ class SqliteFlatDb(SqliteDb):
         """
         self.executeCommand(self.INSERT_OBJECT, args)
 
+    def insertObjects(self, rows):
+        """ Insert several objects with a single command.
+        Each row should contain the same values as the *args
+        passed to insertObject.
+        """
+        self.executeMany(self.INSERT_OBJECT, rows)
+
     def updateObject(self, *args):
         """Update object data """
         self.executeCommand(self.UPDATE_OBJECT, args)
 
+    def updateColumn(self, label, ids, values):
+        """ Update a single column of the rows with the given ids. """
+        col = label if label in self.BASIC_COLUMNS else self._columnsMapping[label]
+        cmd = "UPDATE %sObjects SET %s=? WHERE id=?" % (self.tablePrefix, col)
+        self.executeMany(cmd, zip(values, ids))
+
     def selectObjectById(self, objId):
         """Select an object give its id"""
         self.executeCommand(self.selectCmd(ID + "=?"), (objId,))
         return self.cursor.fetchone()
 
-    def selectAll(self, iterate=True, orderBy=ID, direction='ASC', where='1'):
-        # Handle the specials orderBy values of 'id' and 'RANDOM()'
-        # other columns names should be mapped to table column
-        # such as: _micId -> c04
+    def _getRealCol(self, colName):
+        """ Transform the column name taking into account
+         special columns such as: id or RANDOM(), and
+         getting the mapping translation otherwise.
+        """
+        if colName in self.BASIC_COLUMNS or colName == 'RANDOM()':
+            return colName
+        else:
+            return self._columnsMapping[colName]
 
-        def _getRealCol(colName):
-            """ Transform the column name taking into account
-             special columns such as: id or RANDOM(), and
-             getting the mapping translation otherwise.
-            """
-            if colName in ['id', 'RANDOM()']:
-                return colName
+    def _getOrderByStr(self, orderBy, direction):
+        """ Return the ORDER BY clause, mapping the column names.
+        orderBy can be a label, a Column, an Ordering (e.g.
+        Column('_micId').desc()) or a list of them. The direction is
+        applied to the last column, unless it is an Ordering.
+        """
+        if not isinstance(orderBy, list):
+            orderBy = [orderBy]
+
+        cols = []
+        for c in orderBy:
+            if isinstance(c, Ordering):
+                cols.append('%s %s' % (self._getRealCol(c.label),
+                                       c.direction))
+            elif isinstance(c, Column):
+                cols.append(self._getRealCol(c.getLabel()))
+            elif isinstance(c, basestring):
+                cols.append(self._getRealCol(c))
             else:
-                return self._columnsMapping[colName]
+                raise Exception('Invalid type for orderBy: %s' % type(c))
 
-        if isinstance(orderBy, basestring):
-            orderByCol = _getRealCol(orderBy)
-        elif isinstance(orderBy, list):
-            orderByCol = ','.join([_getRealCol(c) for c in orderBy])
-        else:
-            raise Exception('Invalid type for orderBy: %s' % type(orderBy))
+        if not isinstance(orderBy[-1], Ordering):
+            cols[-1] += ' %s' % direction
 
-        # Parse the where string to replace the colunm name with
-        # the real table column name ( for example: _micId -> c01 )
-        # Right now we are asuming a simple where string in the form
-        # colName=VALUE
+        return ' ORDER BY %s' % ', '.join(cols)
+
+    def _getWhere(self, where):
+        """ Return the WHERE clause and its parameters. The where can be
+        a string (see _getWhereStr) or a Condition.
+        """
+        if isinstance(where, Condition):
+            return where.compile(self._getRealCol)
+
+        return self._getWhereStr(where), []
+
+    def _getLimitStr(self, limit, offset):
+        """ Return the LIMIT and OFFSET clauses. """
+        if limit is None and offset is None:
+            return ''
+        limitStr = ' LIMIT %d' % (-1 if limit is None else limit)
+        if offset:
+            limitStr += ' OFFSET %d' % offset
+        return limitStr
+
+    def _getWhereStr(self, where):
+        """ Parse the where string to replace the colunm name with
+        the real table column name ( for example: _micId -> c01 )
+        Right now we are asuming a simple where string in the form
+        colName=VALUE
+        """
         if '=' in where:
             whereCol = where.split('=')[0]
-            whereRealCol = _getRealCol(whereCol)
-            whereStr = where.replace(whereCol, whereRealCol)
-        else:
-            whereStr = where
+            whereRealCol = self._getRealCol(whereCol)
+            return where.replace(whereCol, whereRealCol)
 
-        cmd = self.selectCmd(whereStr,
-                             orderByStr=' ORDER BY %s %s' % (orderByCol, direction))
-        self.executeCommand(cmd)
+        return where
+
+    def selectAll(self, iterate=True, orderBy=ID, direction='ASC', where='1',
+                  columns=None, limit=None, offset=None):
+        """ Select all rows matching the where condition.
+        If columns is not None, only the basic columns (id, enabled, label,
+        comment and creation) and the ones mapped from the given attribute
+        labels will be retrieved.
+        """
+        # Handle the specials orderBy values of 'id' and 'RANDOM()'
+        # other columns names should be mapped to table column
+        # such as: _micId -> c04
+        orderByStr = (self._getOrderByStr(orderBy, direction) +
+                      self._getLimitStr(limit, offset))
+        whereStr, params = self._getWhere(where)
+
+        if columns is None:
+            cmd = self.selectCmd(whereStr, orderByStr=orderByStr)
+        else:
+            colsStr = ', '.join(self.BASIC_COLUMNS +
+                                [self._columnsMapping[c] for c in columns])
+            cmd = 'SELECT %s %s WHERE %s%s' % (colsStr, self.FROM,
+                                               whereStr, orderByStr)
+        self.executeCommand(cmd, params)
         return self._results(iterate)
 
+    def selectValues(self, columns, orderBy=ID, direction='ASC', where='1',
+                     chunkSize=None, limit=None, offset=None):
+        """ Select only the values of the given columns.
+        Columns can be attribute labels (e.g _filename) or any of the
+        basic columns (id, enabled, label, comment or creation).
+        A new cursor is used, so other queries can be done while
+        iterating the results.
+        Returns:
+            an iterator over the rows as tuples, or over lists of
+            at most chunkSize rows if chunkSize is not None.
+        """
+        colsStr = ', '.join(c if c in self.BASIC_COLUMNS else
+                            self._columnsMapping[c] for c in columns)
+        whereStr, params = self._getWhere(where)
+        cmd = 'SELECT %s %s WHERE %s%s%s' % (colsStr, self.FROM, whereStr,
+                                             self._getOrderByStr(orderBy,
+                                                                 direction),
+                                             self._getLimitStr(limit, offset))
+        cursor = self.connection.cursor()
+        cursor.row_factory = None  # plain tuples are faster than sqlite.Row
+        cursor.execute(cmd, params)
+
+        if chunkSize is None:
+            return cursor
+
+        return iter(lambda: cursor.fetchmany(chunkSize), [])
+
     def aggregate(self, operations, operationLabel, groupByLabels=None):
         #let us count for testing
         selectStr = 'SELECT '
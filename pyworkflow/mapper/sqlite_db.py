@@ -29,6 +29,7 @@ from __future__ import print_function
 This module contains some sqlite basic tools to handle Databases.
 """
 
+import struct
 from sqlite3 import dbapi2 as sqlite
 
 from pyworkflow.utils import envVarOn
@@ -57,9 +58,19 @@ class SqliteDb():
         # Define some shortcuts functions
         if envVarOn('SCIPION_DEBUG_SQLITE'):
             self.executeCommand = self._debugExecute
+            self.executeMany = self._debugExecuteMany
         else:
             self.executeCommand = self.cursor.execute
-        self.commit = self.connection.commit
+            self.executeMany = self.cursor.executemany
+        # PRAGMA data_version is only available since SQLite 3.8.8
+        row = self.connection.execute('PRAGMA data_version').fetchone()
+        self._hasDataVersion = row is not None
+        if self._hasDataVersion:
+            self.commit = self.connection.commit
+        else:
+            self._fileCounter = self._getFileChangeCounter()
+            self._otherChanges = 0
+            self.commit = self._commitFileCounter
         
     @classmethod
     def closeConnection(cls, dbName):
@@ -85,6 +96,14 @@ class SqliteDb():
             print(">>>> FAILED cursor.execute on db: '%s'" % self._dbName)
             raise ex
 
+    def _debugExecuteMany(self, cmd, rows):
+        try:
+            print("COMMAND (many): ", cmd, self._dbName)
+            return self.cursor.executemany(cmd, rows)
+        except Exception as ex:
+            print(">>>> FAILED cursor.executemany on db: '%s'" % self._dbName)
+            raise ex
+
     def _iterResults(self):
         row = self.cursor.fetchone()
         while row is not None:
@@ -125,3 +144,56 @@ class SqliteDb():
         self.executeCommand('PRAGMA user_version=%d' % version)
         self.commit()
 
+    def getDataVersion(self):
+        """ Return a value that changes whenever the database is modified,
+        either by this connection (total_changes) or by any other one
+        (SQLite PRAGMA data_version).
+        PRAGMA data_version is only available since SQLite 3.8.8, with older
+        versions the changes of other connections are detected with the
+        file change counter of the db header (see _commitFileCounter).
+        """
+        if self._hasDataVersion:
+            # Use a new cursor to not reset any ongoing iteration
+            row = self.connection.execute('PRAGMA data_version').fetchone()
+            dataVersion = row[0]
+        else:
+            dataVersion = self._getOtherChanges()
+        return dataVersion, self.connection.total_changes
+
+    def _getFileChangeCounter(self):
+        """ Read the file change counter from the db header (4 bytes,
+        big-endian, at offset 24). It is incremented on every commit, except
+        in WAL mode, which is not available in the versions without
+        PRAGMA data_version. Return None if it can not be read.
+        """
+        try:
+            with open(self._dbName, 'rb') as f:
+                f.seek(24)
+                return struct.unpack('>I', f.read(4))[0]
+        except (IOError, struct.error):
+            return None
+
+    def _getOtherChanges(self):
+        """ Return the number of times that the file change counter was
+        modified by other connections, as seen by this one. If the counter
+        can not be read, the db is always considered modified.
+        """
+        counter = self._getFileChangeCounter()
+        if counter is None or counter != self._fileCounter:
+            self._fileCounter = counter
+            self._otherChanges += 1
+        return self._otherChanges
+
+    def _commitFileCounter(self):
+        """ Commit and keep the file change counter after it, so our own
+        commits are not seen as changes done by other connections.
+        """
+        self._getOtherChanges()  # changes done before this commit
+        before = self._fileCounter
+        self.connection.commit()
+        after = self._getFileChangeCounter()
+        # If other connection also committed, the counter is increased
+        # more than once and the change will be seen in _getOtherChanges
+        if before is not None and after is not None and after - before <= 1:
+            self._fileCounter = after
+
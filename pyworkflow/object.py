@@ -40,25 +40,70 @@ import datetime as dt
 RELATION_CHILDS = 0
 RELATION_PARENTS = 1
 
+# Properties set for every Object. Classes with many instances (scalars
+# and OrderedObject) keep them in __slots__ instead of the instance __dict__
+# (never created for scalars). The other basic properties have a default
+# value in the class and are only stored in the instance when changed.
+OBJECT_SLOTS = ('_objId', '_objName', '_objValue')
+
+# Map between the keyword arguments and the basic properties
+_objectKwargs = [('objIsPointer', '_objIsPointer'),
+                 ('objParentId', '_objParentId'),
+                 ('objLabel', '_objLabel'),
+                 ('objComment', '_objComment'),
+                 ('objTag', '_objTag'),
+                 ('objDoStore', '_objDoStore')]
+
+_classSlots = {}
+
+
+def _getClassSlots(cls):
+    """ Return the names of all __slots__ defined in the class hierarchy. """
+    if cls not in _classSlots:
+        slots = []
+        for c in cls.__mro__:
+            for name in c.__dict__.get('__slots__', ()):
+                if name not in slots:
+                    slots.append(name)
+        _classSlots[cls] = tuple(slots)
+    return _classSlots[cls]
+
 
 class Object(object):
     """ All objects in our Domain should inherit from this class
     that will contains all base properties"""
+    _objIsPointer = False # True if will be treated as a reference for storage
+    _objParentId = None # identifier of the parent object
+    _objLabel = '' # This will serve to label the objects
+    _objComment = ''
+    _objTag = None # This attribute serve to make some annotation on the object.
+    _objDoStore = True # True if this object will be stored from his parent
+    _objCreation = None
+    _objParent = None # Reference to parent object
+    _objEnabled = True
+
     def __init__(self, value=None, **kwargs):
         object.__init__(self)
-        self._objIsPointer = kwargs.get('objIsPointer', False) # True if will be treated as a reference for storage
         self._objId = kwargs.get('objId', None) # Unique identifier of this object in some context
-        self._objParentId = kwargs.get('objParentId', None) # identifier of the parent object
         self._objName = kwargs.get('objName', '') # The name of the object will contains the whole path of ancestors
-        self._objLabel = kwargs.get('objLabel', '') # This will serve to label the objects
-        self._objComment = kwargs.get('objComment', '')
-        self._objTag = kwargs.get('objTag', None) # This attribute serve to make some annotation on the object.
-        self._objDoStore = kwargs.get('objDoStore', True) # True if this object will be stored from his parent
-        self._objCreation = None
-        self._objParent = None # Reference to parent object
-        self._objEnabled = True
+        if kwargs:
+            for key, attrName in _objectKwargs:
+                if key in kwargs:
+                    setattr(self, attrName, kwargs[key])
         self.set(value)
 
+    def __getstate__(self):
+        """ Include the values stored in __slots__ when pickling. """
+        state = dict(self.__dict__)
+        for name in _getClassSlots(type(self)):
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            object.__setattr__(self, name, value)
+
     def getClassName(self):
         return self.__class__.__name__
     
@@ -522,14 +567,45 @@ class Object(object):
         pp.pprint(dict(self.getObjDict(includeClasses)))        
 
 
+# All tuples of attributes names used by OrderedObject instances and the
+# transitions between them when adding a new attribute. Instances with the
+# same attributes (usually all from the same class) share the same tuple.
+_attributesSchemas = {(): ()}
+_schemasTransitions = {}
+
+
+def _internSchema(attributes):
+    """ Return the shared tuple equal to attributes. """
+    return _attributesSchemas.setdefault(attributes, attributes)
+
+
+def _extendSchema(attributes, name):
+    """ Return the shared tuple of attributes with name added. Schemas are
+    never released, so their id can be used as a key.
+    """
+    key = (id(attributes), name)
+    schema = _schemasTransitions.get(key, None)
+    if schema is None:
+        schema = _internSchema(attributes + (name,))
+        _schemasTransitions[key] = schema
+    return schema
+
+
 class OrderedObject(Object):
     """This is based on Object, but keep the list
     of the attributes to store in the same order
     of insertion, this can be useful where order matters"""
+    __slots__ = ('_attributes',) + OBJECT_SLOTS
+
     def __init__(self, value=None, **kwargs):
-        object.__setattr__(self, '_attributes', [])
+        object.__setattr__(self, '_attributes', ())
         Object.__init__(self, value, **kwargs)
 
+    def __setstate__(self, state):
+        Object.__setstate__(self, state)
+        object.__setattr__(self, '_attributes',
+                           _internSchema(tuple(self._attributes)))
+
     def __attrPointed(self, name, value):
         """ Check if a value is already pointed by other
         attribute. This will prevent to storing pointed
@@ -546,10 +622,12 @@ class OrderedObject(Object):
         return False
     
     def __setattr__(self, name, value):
-        if (name not in self._attributes and
-            issubclass(value.__class__, Object) and
+        # Check first the type, most of the values set are not Objects
+        if (issubclass(value.__class__, Object) and
+            name not in self._attributes and
             not self.__attrPointed(name, value) and value._objDoStore):
-            self._attributes.append(name)
+            object.__setattr__(self, '_attributes',
+                               _extendSchema(self._attributes, name))
         Object.__setattr__(self, name, value)
     
     def getAttributes(self):
@@ -561,7 +639,8 @@ class OrderedObject(Object):
     def deleteAttribute(self, attrName):
         """ Delete an attribute. """
         if attrName in self._attributes:
-            self._attributes.remove(attrName)
+            attributes = tuple(a for a in self._attributes if a != attrName)
+            object.__setattr__(self, '_attributes', _internSchema(attributes))
             delattr(self, attrName)
 
                 
@@ -621,6 +700,8 @@ class Scalar(Object):
     
 class Integer(Scalar):
     """Integer object"""
+    __slots__ = OBJECT_SLOTS
+
     def _convertValue(self, value):
         return int(value)
     
@@ -640,6 +721,8 @@ class Integer(Scalar):
         
 class String(Scalar):
     """String object. """
+    __slots__ = OBJECT_SLOTS
+
     DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
     FS = ".%f" # Fento seconds
 
@@ -677,6 +760,8 @@ class String(Scalar):
 
 class Float(Scalar):
     """Float object"""
+    __slots__ = OBJECT_SLOTS
+
     EQUAL_PRECISION = 0.001
     
     @classmethod
@@ -709,6 +794,7 @@ class Float(Scalar):
         
 class Boolean(Scalar):
     """Boolean object"""
+    __slots__ = OBJECT_SLOTS
     
     def _convertValue(self, value):
         t = type(value)
@@ -990,6 +1076,9 @@ class Set(OrderedObject):
     All items will have an unique id that identifies each element in the set.
     """
     ITEM_TYPE = None # This property should be defined to know the item type
+    # Attributes of the items that will be indexed in the database,
+    # because they are frequently used to filter the items
+    INDEXES = []
     
     # This will be used for stream Set where data is populated on the fly
     STREAM_OPEN = 1
@@ -1043,10 +1132,85 @@ class Set(OrderedObject):
         """ element in Set """
         return self._getMapper().selectById(itemId) != None
 
-    def iterItems(self, orderBy='id', direction='ASC', where='1'):
+    def iterItems(self, orderBy='id', direction='ASC', where='1',
+                  columns=None, limit=None, offset=None):
+        """ Iterate over the items of the set.
+        The where can be a string such as '_micId=1' or a Condition
+        built with pyworkflow.mapper.query.Column, for example:
+            (Column('_micId') == 1) & (Column('_x') > 100)
+        so the items are filtered in the database. orderBy can also be
+        a list of labels, Columns or orderings (e.g. Column('_x').desc())
+        and limit and offset allow to iterate only over a range of items.
+        If columns is a list of attribute labels, only those attributes
+        will be retrieved and filled in the items, which is much faster
+        when only a few of them are needed.
+        """
         return self._getMapper().selectAll(orderBy=orderBy,
                                            direction=direction,
-                                           where=where)#has flat mapper, iterate is true
+                                           where=where,
+                                           columns=columns,
+                                           limit=limit,
+                                           offset=offset)#has flat mapper, iterate is true
+
+    def iterItemsSince(self, lastId, columns=None):
+        """ Iterate over the items with an id greater than lastId,
+        in increasing id order. This is useful to read only the items
+        appended to a set in streaming since the last read, keeping
+        the last id seen as a watermark.
+        """
+        return self.iterItems(orderBy='id', direction='ASC',
+                              where='id > %d' % lastId, columns=columns)
+
+    def iterValues(self, columns, orderBy='id', direction='ASC', where='1',
+                   chunkSize=None, limit=None, offset=None):
+        """ Iterate over the values of some attributes of the items,
+        without building the item objects.
+        Params:
+            columns: list of attribute labels, e.g. ['_filename', '_index'],
+                basic columns such as 'id' or 'enabled' are also valid.
+            chunkSize: if None, a tuple is yielded for each item. If not,
+                numpy record arrays of up to chunkSize items are yielded.
+            orderBy, where, limit, offset: same as in iterItems.
+        """
+        return self._getMapper().selectValues(columns, orderBy=orderBy,
+                                              direction=direction,
+                                              where=where,
+                                              chunkSize=chunkSize,
+                                              limit=limit,
+                                              offset=offset)
+
+    def getColumnArray(self, label, dtype=None, orderBy='id', direction='ASC',
+                       where='1'):
+        """ Return a numpy array with the values of a given attribute
+        (e.g. '_ctfModel._defocusU') for all items, read straight from
+        the database without building the items.
+        """
+        return self._getMapper().getColumnArray(label, dtype=dtype,
+                                                orderBy=orderBy,
+                                                direction=direction,
+                                                where=where)
+
+    def toRecordArray(self, labels, orderBy='id', direction='ASC', where='1'):
+        """ Return a numpy record array with the values of several
+        attributes for all items. Labels are used as field names.
+        """
+        return self._getMapper().toRecordArray(labels, orderBy=orderBy,
+                                               direction=direction,
+                                               where=where)
+
+    def createIndex(self, label):
+        """ Create an index in the database for the given attribute
+        (e.g. '_micId'), to speed up the queries that filter by it.
+        The index is created in the next write.
+        """
+        self._getMapper().createIndex(label)
+
+    def updateColumnFromArray(self, label, ids, values):
+        """ Update the value of the attribute given by label for the items
+        with the given ids. This is much faster than updating the
+        items one by one. The changes are committed when calling write().
+        """
+        self._getMapper().updateColumnFromArray(label, ids, values)
 
     def getFirstItem(self):
         """ Return the first item in the Set. """
@@ -1112,7 +1276,8 @@ class Set(OrderedObject):
         if self._mapperPath.isEmpty():
             raise Exception("Set.load:  mapper path and prefix not set.")
         fn, prefix = self._mapperPath
-        self._mapper = self._MapperClass(fn, self._loadClassesDict(), prefix)            
+        self._mapper = self._MapperClass(fn, self._loadClassesDict(), prefix,
+                                         indexes=self.INDEXES)
         self._size.set(self._mapper.count())
         self._idCount = self._mapper.maxId()
            
@@ -1143,14 +1308,90 @@ class Set(OrderedObject):
         #
         # Anyway, this can be easily changed by updating
         # both from the underlying sqlite when reading a set.
+        self._prepareItem(item)
+        self._setItemId(item)
+        self._insertItem(item)
+        self._size.increment()
+
+    def appendMany(self, items, batchSize=10000):
+        """ Add several items to the set.
+        Ids are assigned in the same way as in append, but the items
+        are written by the mapper in batches of batchSize elements,
+        which is much faster than appending them one by one.
+        All items should have the same attributes.
+        """
+        self._getMapper().insertMany(self._iterItemsToAppend(items),
+                                     batchSize)
 
+    def appendColumns(self, template, columns, batchSize=10000):
+        """ Add several items with the same attributes than template,
+        taking their values from columns (a dict with the attribute keys,
+        e.g. '_ctfModel._defocusU', and the values for each item).
+        If 'id' is not in columns, ids are assigned after the current ones.
+        This avoids creating an object for each item, for example when
+        the values are read by columns from a metadata file.
+        """
+        self._prepareItem(template)
+        n = len(columns.itervalues().next()) if columns else 0
+
+        if 'id' in columns:
+            ids = [int(i) for i in columns['id']]
+            if ids:
+                self._idCount = max(self._idCount, max(ids))
+        else:
+            ids = range(self._idCount + 1, self._idCount + n + 1)
+            self._idCount += n
+
+        self._getMapper().insertColumns(template, ids, columns, batchSize)
+        self._size.set(self._size.get() + n)
+
+    def _iterItemsToAppend(self, items):
+        """ Prepare each item and set its id before being inserted
+        by appendMany. The size of the set is updated once at the end.
+        """
+        idCount = self._idCount
+        n = 0
+
+        try:
+            for item in self._prepareItems(items):
+                # Same as _setItemId, but without the attribute lookups
+                itemId = item._objId
+                if itemId is None:
+                    idCount += 1
+                    item._objId = idCount
+                else:
+                    idCount = max(idCount, itemId) + 1
+                self._idCount = idCount
+                n += 1
+                yield item
+        finally:
+            self._size.set(self._size.get() + n)
+
+    def _prepareItem(self, item):
+        """ This function is called before an item is appended
+        to the set. It can be redefined in subclasses to update
+        the item with some properties of the set.
+        """
+        pass
+
+    def _prepareItems(self, items):
+        """ Iterate over items calling _prepareItem for each one.
+        It is used by appendMany and can be redefined in subclasses
+        to compute once the properties of the set used by _prepareItem.
+        """
+        for item in items:
+            self._prepareItem(item)
+            yield item
+
+    def _setItemId(self, item):
+        """ If the item has already an id, use it.
+        If not, assign the next one from the max id counter.
+        """
         if not item.hasObjId():
             self._idCount += 1
             item.setObjId(self._idCount)
         else:
             self._idCount = max(self._idCount, item.getObjId()) + 1
-        self._insertItem(item)
-        self._size.increment()
 
     def _insertItem(self, item):
         self._getMapper().insert(item)
@@ -41,7 +41,9 @@ import pyworkflow.hosts as pwhosts
 import pyworkflow.protocol as pwprot
 import pyworkflow.object as pwobj
 import pyworkflow.utils as pwutils
+import pyworkflow.utils.graph
 from pyworkflow.mapper import SqliteMapper
+from pyworkflow.utils.reflection import LazyClassDict
 from pyworkflow.protocol.constants import MODE_RESTART
 
 OBJECT_PARENT_ID = 'object_parent_id'
@@ -54,6 +56,7 @@ PROJECT_UPLOAD = 'Uploads'
 PROJECT_SETTINGS = 'settings.sqlite'
 PROJECT_CONFIG = '.config'
 PROJECT_CONFIG_PROTOCOLS = 'protocols.conf'
+PROJECT_SCHEDULER_LOCK = 'scheduler.lock'
 
 PROJECT_CREATION_TIME = 'CreationTime'
 
@@ -88,7 +91,12 @@ class Project(object):
         self.settingsPath = self.__addPath(PROJECT_SETTINGS)
         self.configPath = self.__addPath(PROJECT_CONFIG)
         self.runs = None
+        # Version of the project db when the runs were loaded and
+        # counter incremented every time any run is loaded or updated
+        self._runsDbVersion = None
+        self._runsVersion = 0
         self._runsGraph = None
+        self._runsGraphVersion = None
         self._transformGraph = None
         self._sourceGraph = None
         self.address = ''
@@ -189,6 +197,12 @@ class Project(object):
     def getLogPath(self, *paths):
         return self.getPath(PROJECT_LOGS, *paths)
 
+    def getSchedulerLockPath(self):
+        """ Return the lock file held by the process that launches
+        the scheduled runs of this project (see pw_schedule_run.py).
+        """
+        return self.getLogPath(PROJECT_SCHEDULER_LOCK)
+
     def getSettings(self):
         return self.settings
 
@@ -207,8 +221,9 @@ class Project(object):
     def createMapper(self, sqliteFn):
         """ Create a new SqliteMapper object and pass as classes dict
         all globals and update with data and protocols from em.
+        Classes from em-packages are only loaded when found in the db.
         """
-        classesDict = pwobj.Dict(default=pwprot.LegacyProtocol)
+        classesDict = LazyClassDict(default=pwprot.LegacyProtocol)
         classesDict.update(pwobj.__dict__)
         classesDict.update(pwconfig.__dict__)
         classesDict.update(pwhosts.__dict__)
@@ -302,11 +317,13 @@ class Project(object):
         if not os.path.exists(absDbPath):
             raise MissingProjectDbException("Project database not found at '%s'" % absDbPath)
         self.mapper = self.createMapper(absDbPath)
+        self._runsDbVersion = None  # force reload of runs with the new mapper
 
     def closeMapper(self):
         if self.mapper is not None:
             self.mapper.close()
             self.mapper = None
+            self._runsDbVersion = None
 
     def _loadHosts(self, hosts):
         """ Loads hosts configuration from hosts file. """
@@ -442,20 +459,20 @@ class Project(object):
         protocol.setStatus(pwprot.STATUS_LAUNCHED)
         self._setupProtocol(protocol)
 
-        # Prepare a separate db for this run if not from schedule jobs
-        # Scheduled protocols will load the project db from the run.db file,
-        # so there is no need to copy the database
-
+        # Scheduled protocols already have their working dir, created
+        # when they were scheduled
         if not scheduled:
             protocol.makePathsAndClean()  # Create working dir if necessary
             # Delete the relations created by this protocol
             if isRestart:
                 self.mapper.deleteRelations(self)
-            self.mapper.commit()
+        self.mapper.commit()
 
-            # NOTE: now we are simply copying the entire project db, this can be
-            # changed later to only create a subset of the db need for the run
-            pwutils.path.copyFile(self.dbPath, protocol.getDbPath())
+        # Prepare a separate db for this run. For scheduled runs it is
+        # copied again to get the outputs produced while waiting.
+        # NOTE: now we are simply copying the entire project db, this can be
+        # changed later to only create a subset of the db need for the run
+        pwutils.path.copyFile(self.dbPath, protocol.getDbPath())
 
         # Launch the protocol, the jobId should be set after this call
         pwprot.launch(protocol, wait)
@@ -477,24 +494,28 @@ class Project(object):
         """
         isRestart = protocol.getRunMode() == MODE_RESTART
 
-        protocol.setStatus(pwprot.STATUS_SCHEDULED)
-        protocol.addPrerequisites(*prerequisites)
-
         self._setupProtocol(protocol)
         protocol.makePathsAndClean()  # Create working dir if necessary
         # Delete the relations created by this protocol if any
         if isRestart:
             self.mapper.deleteRelations(self)
+
+        # Scheduled runs get their jobId when the scheduler launches them.
+        # All changes are committed at once, so the scheduler never
+        # finds the protocol scheduled with only some of them
+        protocol.setStatus(pwprot.STATUS_SCHEDULED)
+        protocol.addPrerequisites(*prerequisites)
+        protocol.setJobId(pwprot.UNKNOWN_JOBID)
+        self.mapper.store(protocol)
         self.mapper.commit()
 
         # Prepare a separate db for this run
         # NOTE: now we are simply copying the entire project db, this can be
         # changed later to only create a subset of the db need for the run
         pwutils.path.copyFile(self.dbPath, protocol.getDbPath())
-        # Launch the protocol, the jobId should be set after this call
+        # The protocol is already stored as scheduled, so the project
+        # scheduler (started here if not running) will find it
         pwprot.schedule(protocol)
-        self.mapper.store(protocol)
-        self.mapper.commit()
 
     def _updateProtocol(self, protocol, tries=0, checkPid=False,
                         skipUpdatedProtocols=True):
@@ -515,6 +536,7 @@ class Project(object):
             comment = protocol.getObjComment()
 
             # Capture the db timestamp before loading.
+            loadTime = time.time()
             lastUpdateTime = pwutils.getFileLastModificationDate(
                                                         protocol.getDbPath())
 
@@ -542,6 +564,7 @@ class Project(object):
             # possible inconsistencies
             # protocol.lastUpdateTimeStamp.set(datetime.datetime.now())
             protocol.lastUpdateTimeStamp.set(lastUpdateTime)
+            pwprot.setProtocolLoadTime(protocol, lastUpdateTime, loadTime)
 
             self.mapper.store(protocol)
 
@@ -1046,40 +1069,73 @@ class Project(object):
             self._storeProtocol(protocol)
 
     def getRuns(self, iterate=False, refresh=True, checkPids=False):
-        """ Return the existing protocol runs in the project. 
+        """ Return the existing protocol runs in the project.
+        When refreshing, the runs are only loaded again if the project db
+        has been modified since the last time, otherwise the same Protocol
+        objects are kept and only the ones with a modified run.db updated.
         """
         if self.runs is None or refresh:
-            # Close db open connections to db files
-            if self.runs is not None:
-                for r in self.runs:
-                    r.closeMappers()
+            dbVersion = self.mapper.getDataVersion()
+
+            if self.runs is None or dbVersion != self._runsDbVersion:
+                # Close db open connections to db files
+                if self.runs is not None:
+                    for r in self.runs:
+                        r.closeMappers()
 
-            # Use new selectAll Batch
-            # self.runs = self.mapper.selectAll(iterate=False,
-            #               objectFilter=lambda o: isinstance(o, pwprot.Protocol))
-            self.runs = self.mapper.selectAllBatch(objectFilter=lambda o: isinstance(o, pwprot.Protocol))
+                # Use new selectAll Batch
+                # self.runs = self.mapper.selectAll(iterate=False,
+                #               objectFilter=lambda o: isinstance(o, pwprot.Protocol))
+                self.runs = self.mapper.selectAllBatch(objectFilter=lambda o: isinstance(o, pwprot.Protocol))
+
+                for r in self.runs:
 
-            for r in self.runs:
+                    self._setProtocolMapper(r)
 
-                self._setProtocolMapper(r)
+                    # Check for run warnings
+                    r.checkSummaryWarnings()
 
-                # Check for run warnings
-                r.checkSummaryWarnings()
+                    self._annotateLastRunTime(r.endTime)
 
-                # Update nodes that are running and were not invoked
-                # by other protocols
-                if r.isActive():
-                    if not r.isChild():
-                        self._updateProtocol(r, checkPid=checkPids)
+                self._runsVersion += 1
 
-                self._annotateLastRunTime(r.endTime)
+            # Update nodes that are running and were not invoked
+            # by other protocols, only if their run.db was modified
+            if self._updateRuns(self.runs, checkPids):
+                self._runsVersion += 1
 
             # cursor = self.mapper.db.executeCommand('SELECT * FROM Objects WHERE parent_Id IS NOT NULL ORDER BY parent_id, name')
 
             self.mapper.commit()
+            # Our own changes done while updating should not
+            # force a reload the next time
+            self._runsDbVersion = self.mapper.getDataVersion()
 
         return self.runs
 
+    def _updateRuns(self, runs, checkPids=False):
+        """ Update the active runs whose run.db is newer than the last time
+        they were updated. If checkPids is True, all active runs are updated
+        to check if their process is still alive, since a run that died
+        does not modify its run.db. Return the number of modified runs.
+        """
+        modified = 0
+
+        for r in runs:
+            if not r.isActive() or r.isChild():
+                continue
+            upToDate = pwprot.isProtocolUpToDate(r)
+            if upToDate and not checkPids:
+                continue
+            status = r.getStatus()
+            self._updateProtocol(r, checkPid=checkPids,
+                                 skipUpdatedProtocols=False)
+            self._annotateLastRunTime(r.endTime)
+            if not upToDate or r.getStatus() != status:
+                modified += 1
+
+        return modified
+
     def _annotateLastRunTime(self, protLastTS):
         """ Sets _lastRunTime for the project if it is after current _lastRunTime"""
         try:
@@ -1140,7 +1196,11 @@ class Project(object):
 
         if refresh or self._runsGraph is None:
             runs = [r for r in self.getRuns(refresh=refresh, checkPids=checkPids) if not r.isChild()]
-            self._runsGraph = self.getGraphFromRuns(runs)
+            # Only build the graph again if any run has changed
+            if (self._runsGraph is None or
+                self._runsGraphVersion != self._runsVersion):
+                self._runsGraph = self.getGraphFromRuns(runs)
+                self._runsGraphVersion = self._runsVersion
 
         return self._runsGraph
 
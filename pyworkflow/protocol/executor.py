@@ -27,13 +27,17 @@
 This module have the classes for execution of protocol steps.
 The basic one will run steps, one by one, after completion.
 There is one based on threads to execute steps in parallel
-using different threads and the last one with MPI processes.
+using different threads, one with a pool of processes and
+the last one with MPI processes.
 """
 
 import time
 import datetime
 import traceback
 import threading
+import cPickle as pickle
+import multiprocessing
+from collections import deque
 
 import pyworkflow.utils.process as process
 import constants as cts
@@ -60,26 +64,6 @@ class StepExecutor():
                        self.hostConfig,
                        env=env, cwd=cwd, gpuList=self.getGpuList())
         
-    def _getRunnable(self, steps, n=1):
-        """ Return the n steps that are 'new' and all its
-        dependencies have been finished, or None if none ready.
-        """
-        rs = [] # return a list of runnable steps
-
-        for s in steps:
-            if (s.getStatus() == cts.STATUS_NEW and
-                    all(steps[i-1].isFinished() for i in s._prerequisites)):
-                rs.append(s)
-                if len(rs) == n:
-                    break
-        return rs
-    
-    def _arePending(self, steps):
-        """ Return True if there are pending steps (either running or waiting)
-        that can be done and thus enable other steps to be executed.
-        """
-        return any(s.isRunning() or s.isWaiting() for s in steps)
-    
     def runSteps(self, steps, 
                  stepStartedCallback, 
                  stepFinishedCallback,
@@ -90,12 +74,12 @@ class StepExecutor():
         # In this way we can take into account the steps graph
         # dependency and also the case when using streamming
 
-        delta = datetime.timedelta(seconds=stepsCheckSecs)
-        lastCheck = datetime.datetime.now()
+        lastCheck = time.time()
+        queue = StepsQueue(steps)
 
         while True:
             # Get an step to run, if there is one
-            runnableSteps = self._getRunnable(steps)
+            runnableSteps = queue.getRunnable()
 
             if runnableSteps:
                 step = runnableSteps[0]
@@ -105,31 +89,138 @@ class StepExecutor():
                 stepStartedCallback(step)
                 step.run()
                 doContinue = stepFinishedCallback(step)
-            
+                queue.setDone(step)
+
                 if not doContinue:
                     break
 
-            elif self._arePending(steps):
-                # We have not found any runnable step, but still there
-                # there are some running or waiting for dependencies
-                # So, let's wait a bit to check if something changes
-                time.sleep(0.5)
+            elif queue.hasWaiting():
+                # We have not found any runnable step, but some steps are
+                # waiting and only the steps check can release them.
+                # So, let's sleep until the next check is due.
+                time.sleep(max(0, lastCheck + stepsCheckSecs - time.time()))
             else:
                 # No steps to run, neither running or waiting
                 # So, we are done, either failed or finished :)
                 break
 
-            now = datetime.datetime.now()
-            if now - lastCheck > delta:
+            now = time.time()
+            if now - lastCheck > stepsCheckSecs:
                 stepsCheckCallback()
                 lastCheck = now
-
+            # Callbacks could have added new steps or changed some status
+            queue.update()
 
         stepsCheckCallback() # one last check to finalize stuff
 
 
+class StepsQueue():
+    """ Keep track of the steps that are ready to run.
+    Instead of scanning all steps and their prerequisites every time,
+    each step keeps a counter with its unfinished prerequisites and
+    each step knows its dependents. So, when a step finishes, only its
+    dependents need to be checked.
+    Steps are referred by their 1-based index, as in prerequisites.
+    New steps or waiting steps that change their status (e.g streaming)
+    are taken into account after calling update.
+    """
+    def __init__(self, steps):
+        self._steps = steps
+        self._nIndexed = 0  # number of steps already indexed
+        self._pending = {}  # {step: number of unfinished prerequisites}
+        self._dependents = {}  # {step: set of steps depending on it}
+        self._waiting = set()  # steps with waiting status
+        self._ready = deque()  # steps without unfinished prerequisites
+        self.update()
+
+    def _indexStep(self, i):
+        """ Register the unfinished prerequisites of the i-th step. """
+        steps = self._steps
+        step = steps[i-1]
+        status = step.getStatus()
+
+        if status == cts.STATUS_WAITING:
+            self._waiting.add(i)
+        elif status != cts.STATUS_NEW:
+            return
+
+        n = 0
+        for p in step._prerequisites:
+            p = int(p)
+            if not steps[p-1].isFinished():
+                self._dependents.setdefault(p, set()).add(i)
+                n += 1
+        self._pending[i] = n
+
+        if n == 0 and status == cts.STATUS_NEW:
+            self._ready.append(i)
+
+    def update(self):
+        """ Index the steps added since last call and check if any
+        of the waiting steps is now ready.
+        """
+        n = len(self._steps)
+        for i in xrange(self._nIndexed + 1, n + 1):
+            self._indexStep(i)
+        self._nIndexed = n
+
+        for i in list(self._waiting):
+            if not self._steps[i-1].isWaiting():
+                self._waiting.discard(i)
+                # Prerequisites could also be added while waiting,
+                # so let's index the step again.
+                self._indexStep(i)
+
+    def setDone(self, step):
+        """ Notify that this step is not running anymore. If it has
+        finished successfully, its dependents are released.
+        """
+        if not step.isFinished():
+            return
+
+        steps = self._steps
+        for d in self._dependents.pop(step.getIndex(), ()):
+            self._pending[d] -= 1
+            if self._pending[d] == 0 and steps[d-1].getStatus() == cts.STATUS_NEW:
+                self._ready.append(d)
+
+    def getRunnable(self, n=1):
+        """ Return the n steps that are 'new' and all its
+        dependencies have been finished, or an empty list if none ready.
+        """
+        steps = self._steps
+        rs = [] # return a list of runnable steps
+        ids = set()
+
+        while self._ready and len(rs) < n:
+            i = self._ready.popleft()
+            step = steps[i-1]
+
+            if i in ids or step.getStatus() != cts.STATUS_NEW:
+                continue
+
+            # Prerequisites could have been added after the step was ready
+            if all(steps[int(p)-1].isFinished() for p in step._prerequisites):
+                rs.append(step)
+                ids.add(i)
+            else:
+                self._indexStep(i)
+
+        return rs
+
+    def hasReady(self):
+        return len(self._ready) > 0
+
+    def hasWaiting(self):
+        """ Return True if there are steps waiting, that could be
+        ready later on (e.g. in streaming). """
+        return len(self._waiting) > 0
+
+
 class StepThread(threading.Thread):
-    """ Thread to run Steps in parallel. """
+    """ Thread to run Steps in parallel.
+    The lock is a condition that will be notified when the step is done.
+    """
     def __init__(self, thId, step, lock):
         threading.Thread.__init__(self)
         self.thId = thId
@@ -139,7 +230,7 @@ class StepThread(threading.Thread):
     def run(self):
         error = None
         try:
-            self.step._run()  # not self.step.run() , to avoid race conditions
+            self._runStep()
         except Exception as e:
             error = str(e)
             traceback.print_exc()
@@ -150,6 +241,10 @@ class StepThread(threading.Thread):
                 else:
                     self.step.setFailed(error)
                 self.step.endTime.set(datetime.datetime.now())
+                self.lock.notify()
+
+    def _runStep(self):
+        self.step._run()  # not self.step.run() , to avoid race conditions
 
 
 class ThreadStepExecutor(StepExecutor):
@@ -183,6 +278,10 @@ class ThreadStepExecutor(StepExecutor):
         or empty list if not using GPUs. """
         return self.gpuDict.get(threading.currentThread().thId, [])
         
+    def _createThread(self, node, step, lock):
+        """ Create the thread that will run the step in the given node. """
+        return StepThread(node, step, lock)
+
     def runSteps(self, steps, 
                  stepStartedCallback, 
                  stepFinishedCallback,
@@ -193,13 +292,16 @@ class ThreadStepExecutor(StepExecutor):
         stepsCheckSecs:
             rate of how many seconds between stepsCheckCallback calls
         """
-        delta = datetime.timedelta(seconds=stepsCheckSecs)
-        lastCheck = datetime.datetime.now()
+        lastCheck = time.time()
 
-        sharedLock = threading.Lock()
+        # Threads will notify this condition when their step is done,
+        # so we don't need to poll for finished steps.
+        sharedLock = threading.Condition()
+        queue = StepsQueue(steps)
 
         runningSteps = {}  # currently running step in each node ({node: step})
         freeNodes = range(self.numberOfProcs)  # available nodes to send jobs
+        threads = {}  # last thread launched in each node
 
         while True:
             # See which of the runningSteps are not really running anymore.
@@ -213,49 +315,53 @@ class ThreadStepExecutor(StepExecutor):
                 freeNodes.append(node)  # the node is available now
                 # Notify steps termination and check if we should continue
                 doContinue = stepFinishedCallback(step)
+                queue.setDone(step)
                 if not doContinue:
                     break
 
             if not doContinue:
                 break
 
-            anyLaunched = False
+            now = time.time()
+            if now - lastCheck > stepsCheckSecs:
+                stepsCheckCallback()
+                lastCheck = now
+            # Callbacks could have added new steps or changed some status
+            queue.update()
+
             # If there are available nodes, send next runnable step.
             with sharedLock:
                 if freeNodes:
-                    runnableSteps = self._getRunnable(steps, len(freeNodes))
+                    runnableSteps = queue.getRunnable(len(freeNodes))
 
                     for step in runnableSteps:
                         # We found a step to work in, so let's start a new
                         # thread to do the job and book it.
-                        anyLaunched = True
                         step.setRunning()
                         stepStartedCallback(step)
                         node = freeNodes.pop()  # take an available node
                         runningSteps[node] = step
-                        t = StepThread(node, step, sharedLock)
+                        t = self._createThread(node, step, sharedLock)
                         # won't keep process up if main thread ends
                         t.daemon = True
                         t.start()
-                anyPending = self._arePending(steps)
+                        threads[node] = t
 
-            if not anyLaunched:
-                if anyPending:  # nothing running
-                    time.sleep(0.5)
-                else:
+                if not runningSteps and not queue.hasWaiting():
                     break  # yeah, we are done, either failed or finished :)
 
-            now = datetime.datetime.now()
-            if now - lastCheck > delta:
-                stepsCheckCallback()
-                lastCheck = now
+                # Sleep until some step is done or the next check is due,
+                # unless there is already something to do.
+                if (not (freeNodes and queue.hasReady()) and
+                        all(s.isRunning() for s in runningSteps.itervalues())):
+                    sharedLock.wait(max(0, lastCheck + stepsCheckSecs -
+                                        time.time()))
 
         stepsCheckCallback()
 
         # Wait for all threads now.
-        for t in threading.enumerate():
-            if t is not threading.current_thread():
-                t.join()
+        for t in threads.itervalues():
+            t.join()
 
 
 class MPIStepExecutor(ThreadStepExecutor):
@@ -295,3 +401,164 @@ class MPIStepExecutor(ThreadStepExecutor):
         # that there are no more jobs to do and they can finish.
         for node in range(1, self.numberOfProcs+1):
             self.comm.send('None', dest=node, tag=(TAG_RUN_JOB+node))
+
+
+# GPUs assigned to the step being executed by a worker process
+_processGpuList = []
+
+# Protocols whose steps are run by the workers of a ProcessStepExecutor,
+# by their id(). The workers are forked from the protocol process, so
+# they get a copy of the protocols registered when the pool was created.
+_processProtocols = {}
+
+
+def getProcessGpuList():
+    """ Return the GPU list assigned to the step being executed
+    in the current worker process of a ProcessStepExecutor.
+    """
+    return _processGpuList
+
+
+def _runStepFunc(func, args, gpuList, state=None):
+    """ Run a step function inside a worker process.
+    func can be a function or a (protocolId, methodName) tuple
+    for the protocol methods, that can not be pickled. In the later
+    case, state is a dict with the attributes set in the copy of the
+    protocol before running the step (see Protocol._getProcessStepState).
+    """
+    global _processGpuList
+    _processGpuList = gpuList
+    try:
+        if isinstance(func, tuple):
+            protId, funcName = func
+            prot = _processProtocols[protId]
+            for name, value in (state or {}).iteritems():
+                setattr(prot, name, value)
+            func = getattr(prot, funcName)
+        return func(*args)
+    except Exception:
+        # Print the traceback here, it will be lost in the main process
+        traceback.print_exc()
+        raise
+
+
+class ProcessStepThread(StepThread):
+    """ Thread that sends the step function to the processes pool
+    and waits for its result.
+    """
+    def __init__(self, thId, step, lock, pool, job, gpuList):
+        StepThread.__init__(self, thId, step, lock)
+        self.pool = pool
+        self.job = job
+        self.gpuList = gpuList
+
+    def _runStep(self):
+        func, args, state = self.job
+        resultFiles = self.pool.apply(_runStepFunc,
+                                      (func, args, self.gpuList, state))
+        self.step._checkResultFiles(resultFiles)
+
+
+class ProcessStepExecutor(ThreadStepExecutor):
+    """ Run steps in parallel using a pool of processes.
+    The FunctionSteps are executed in the pool, avoiding the GIL, if
+    their arguments can be pickled and either their function is a
+    module function or a protocol method listed in the protocol
+    _processSteps. The other steps are executed in threads as in
+    ThreadStepExecutor.
+    The pool is created only once, before starting to run the steps, so
+    the workers are not forked while other threads of the protocol hold
+    locks. Protocol methods are called by name in the workers, on the
+    copy of the protocol that they got then. The state that could change
+    later (e.g. new items in streaming) is sent with each step, as
+    returned by the protocol _getProcessStepState.
+    Functions running in the pool can get their GPUs through
+    getProcessGpuList (or getGpuList of the executor).
+    """
+    def __init__(self, hostConfig, nProcs, **kwargs):
+        ThreadStepExecutor.__init__(self, hostConfig, nProcs, **kwargs)
+        self.pool = None
+        self._protocols = set()  # ids of the protocols registered
+
+    def getGpuList(self):
+        """ Return the GPU list assigned to current thread, or to
+        the step if called from a worker process. """
+        if isinstance(threading.currentThread(), StepThread):
+            return ThreadStepExecutor.getGpuList(self)
+        return getProcessGpuList()
+
+    def _getJob(self, step):
+        """ Return the (function, args, state) to run the step in the
+        pool or None if it should be run in a thread.
+        """
+        func = getattr(step, '_func', None)
+        if self.pool is None or func is None:
+            return None
+        if not hasattr(step, '_checkResultFiles'):
+            return None
+
+        prot = getattr(func, 'im_self', None)
+        if prot is not None:
+            funcName = step.funcName.get()
+            # Only the protocols registered when the pool was created
+            # are known by the workers
+            if (funcName not in prot._processSteps or
+                    id(prot) not in self._protocols):
+                return None
+            job = ((id(prot), func.__name__), step._args,
+                   prot._getProcessStepState(funcName, step._args))
+        else:
+            job = (func, step._args, None)
+
+        try:
+            pickle.dumps(job, pickle.HIGHEST_PROTOCOL)
+            return job
+        except Exception:
+            return None
+
+    def _createPool(self, steps):
+        """ Register the protocols of the steps and create the pool
+        of processes, if any of them could run steps in the pool.
+        """
+        usePool = False
+        for step in steps:
+            func = getattr(step, '_func', None)
+            prot = getattr(func, 'im_self', None)
+            if prot is not None:
+                if prot._processSteps:
+                    self._protocols.add(id(prot))
+                    _processProtocols[id(prot)] = prot
+                    usePool = True
+            elif func is not None:
+                usePool = True  # module functions could run in the pool
+
+        if usePool:
+            self.pool = multiprocessing.Pool(self.numberOfProcs)
+
+    def _createThread(self, node, step, lock):
+        job = self._getJob(step)
+        if job is None:
+            return StepThread(node, step, lock)
+        return ProcessStepThread(node, step, lock, self.pool, job,
+                                 self.gpuDict.get(node, []))
+
+    def runSteps(self, steps,
+                 stepStartedCallback,
+                 stepFinishedCallback,
+                 stepsCheckCallback,
+                 stepsCheckSecs=3):
+        self._createPool(steps)
+        try:
+            ThreadStepExecutor.runSteps(self, steps,
+                                        stepStartedCallback,
+                                        stepFinishedCallback,
+                                        stepsCheckCallback,
+                                        stepsCheckSecs=stepsCheckSecs)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+            for protId in self._protocols:
+                _processProtocols.pop(protId, None)
+            self._protocols = set()
@@ -44,7 +44,7 @@ import re
 from subprocess import Popen, PIPE
 import pyworkflow as pw
 from pyworkflow.utils import (redStr, greenStr, makeFilePath, join, process,
-                              getHostFullName)
+                              getHostFullName, acquireLock)
 
 UNKNOWN_JOBID = -1
 LOCALHOST = 'localhost'
@@ -80,19 +80,25 @@ def stop(protocol):
 def schedule(protocol, wait=False):
     """ Use this function to schedule protocols that are not ready to
     run yet. Right now it only make sense to schedule jobs locally.
+    All scheduled protocols of a project are launched by a single
+    scheduler process, that is only started here if it is not running.
+    The protocol should be already stored as scheduled in the project,
+    it is not modified here.
+    Return the jobId of the started scheduler, or UNKNOWN_JOBID if it
+    was already running.
     """
-    protStrId = protocol.strId()
+    project = protocol.getProject()
+    lock = acquireLock(project.getSchedulerLockPath())
+
+    if lock is None:  # The scheduler is running, it will find the protocol
+        return UNKNOWN_JOBID
+
+    lock.close()
     python = pw.SCIPION_PYTHON
     scipion = pw.getScipionScript()
     cmd = '%s %s runprotocol pw_schedule_run.py' % (python, scipion)
-    cmd += ' "%s" "%s" %s' % (protocol.getProject().path,
-                              protocol.getDbPath(),
-                              protStrId)
-    jobId = _run(cmd, wait)
-    protocol.setJobId(jobId)
-
-    return jobId
-
+    cmd += ' "%s"' % project.path
+    return _run(cmd, wait)
 
 
 # ******************************************************************
@@ -256,7 +262,11 @@ def _run(command, wait, stdin=None, stdout=None, stderr=None):
 
 def _stopLocal(protocol):
     
-    if protocol.useQueue() and not protocol.isScheduled():
+    if protocol.isScheduled():
+        # There is no process for this run yet, the project scheduler
+        # will not launch it once it is marked as aborted
+        return
+    elif protocol.useQueue():
         jobId = protocol.getJobId()        
         host = protocol.getHostConfig()
         cancelCmd = host.getCancelCommand() % {'JOB_ID': jobId}
@@ -258,7 +258,11 @@ class Form(object):
         localDict = {}
         globalDict = dict(globals())
         from pyworkflow.em import getObjects
-        globalDict.update(getObjects())
+        # Only add the classes used in the condition (avoid loading all)
+        objectsDict = getObjects()
+        for name in compile(condStr, '<condition>', 'eval').co_names:
+            if name in objectsDict:
+                globalDict[name] = objectsDict[name]
 
         for t in param._conditionParams:
             if self.hasParam(t) or self._protocol.hasAttribute(t):
@@ -327,7 +331,7 @@ class Form(object):
                       )
   
     def addParallelSection(self, threads=1, mpi=8, condition="",
-                           hours=72, jobsize=0):
+                           hours=72, jobsize=0, processes=False):
 
         self.addSection(label='Parallelization')
         self.addParam('hostName', StringParam, default="localhost",
@@ -336,20 +340,28 @@ class Form(object):
         if threads > 0:
             self.addParam('numberOfThreads', IntParam, default=threads,
                           label='Threads',
-                          help='This option provides shared-memory parallelization on multi-core machines.'
+                          help='This option provides shared-memory parallelization on multi-core machines. '
                                 'It does not require any additional software, other than <Xmipp>' )
+            if processes:
+                self.addParam('useProcesses', BooleanParam, default=False,
+                              label='Use processes', condition='numberOfThreads>1',
+                              expertLevel=LEVEL_ADVANCED,
+                              help='Run the steps in a pool of processes instead of '
+                                   'threads. This is useful for steps doing heavy '
+                                   'work in Python (e.g. with numpy), that do not '
+                                   'scale with threads.')
         if mpi > 0:
             self.addParam('numberOfMpi', IntParam, default=mpi,
                           label='MPI processes',
-                          help='This option provides the number of independent processes spawned'
-                                'in parallel by <mpirun> command in a cluster, usually throught'
-                                'a queue system. This will require that you have compile <Xmipp>'
+                          help='This option provides the number of independent processes spawned '
+                                'in parallel by <mpirun> command in a cluster, usually throught '
+                                'a queue system. This will require that you have compile <Xmipp> '
                                 'with <mpi> support.')
         if jobsize > 0:
             self.addParam('mpiJobSize', IntParam, default=jobsize,
                           label='MPI job size', condition="numberOfMpi>1",
-                          help='Minimum size of jobs in mpi processes.'
-                               'Set to 1 for large images (e.g. 500x500)'
+                          help='Minimum size of jobs in mpi processes. '
+                               'Set to 1 for large images (e.g. 500x500) '
                                'and to 10 for small images (e.g. 100x100)')
 
 
@@ -44,7 +44,8 @@ import pyworkflow as pw
 from pyworkflow.object import *
 import pyworkflow.utils as pwutils
 from pyworkflow.utils.log import ScipionLogger
-from executor import StepExecutor, ThreadStepExecutor, MPIStepExecutor
+from executor import (StepExecutor, ThreadStepExecutor, MPIStepExecutor,
+                      ProcessStepExecutor)
 from constants import *
 from params import Form
 import scipion
@@ -66,6 +67,8 @@ class Step(OrderedObject):
         self.interactive = Boolean(False)
         self._resultFiles = String()
         self._index = None
+        # Set when the prerequisites change after the step was stored
+        self._prerequisitesChanged = False
 
     def getIndex(self):
         return self._index
@@ -79,6 +82,7 @@ class Step(OrderedObject):
     def addPrerequisites(self, *newPrerequisites):
         for p in newPrerequisites:
             self._prerequisites.append(p)
+        self._prerequisitesChanged = True
 
     def setPrerequisites(self, *newPrerequisites):
         self._prerequisites.clear()
@@ -234,7 +238,11 @@ class FunctionStep(Step):
 
     def _run(self):
         """ Run the function and check the result files if any. """
-        resultFiles = self._runFunc()
+        self._checkResultFiles(self._runFunc())
+
+    def _checkResultFiles(self, resultFiles):
+        """ Check that the files returned by the function exist
+        and store them. """
         if isinstance(resultFiles, basestring):
             resultFiles = [resultFiles]
         if resultFiles and len(resultFiles):
@@ -310,10 +318,20 @@ class Protocol(Step):
 
     # Version where protocol appeared first time
     _lastUpdateVersion = pw.VERSION_1
+    # Maximum number of seconds that steps status changes are kept
+    # without being committed to the steps database
+    _stepsCommitSecs = 5
+    # Names of the step functions that can be run in a pool of processes
+    # when 'Use processes' is selected (see Form.addParallelSection).
+    # They should only depend on their arguments, on the protocol state
+    # when the steps started to run and on the state returned by
+    # _getProcessStepState, and should not modify the outputs.
+    _processSteps = []
 
     def __init__(self, **kwargs):
         Step.__init__(self, **kwargs)
         self._steps = []  # List of steps that will be executed
+        self._stepsSet = None  # Steps database while running
         # All generated filePaths should be inside workingDir
         self.workingDir = String(kwargs.get('workingDir', '.'))
         self.mapper = kwargs.get('mapper', None)
@@ -824,6 +842,15 @@ class Protocol(Step):
 
         return self.__insertStep(step, **kwargs)
 
+    def _getProcessStepState(self, funcName, funcArgs):
+        """ Return a dict with the protocol attributes needed by a step
+        in _processSteps that could change after the pool of processes
+        was created (e.g. the items received in streaming). They are
+        set in the copy of the protocol of the worker before running
+        the step, so the values should be picklable.
+        """
+        return {}
+
     def _insertRunJobStep(self, progName, progArguments, resultFiles=[],
                           **kwargs):
         """ Insert an Step that will simple call runJob function
@@ -947,15 +974,52 @@ class Protocol(Step):
 
         for step in self._steps:
             step.cleanObjId()
+            step._prerequisitesChanged = False
             self.setInteractive(self.isInteractive() or step.isInteractive())
             self._stepsSet.append(step)
 
         self._stepsSet.write()
+        self._stepsStored = len(self._steps)
+        self._stepsPending = 0
+        self._stepsLastCommit = time.time()
+
+    def _storeNewSteps(self):
+        """ Store only the steps inserted after the last call to
+        _storeSteps (or this function) and update the previous ones
+        whose prerequisites have changed. The rest of the steps are
+        already in the database and are not written again.
+        """
+        for step in self._steps[:self._stepsStored]:
+            if step._prerequisitesChanged:
+                step._prerequisitesChanged = False
+                self._stepsSet.update(step)
 
-    def __updateStep(self, step):
-        """ Store a given step and write changes. """
-        self._stepsSet.update(step)
+        for step in self._steps[self._stepsStored:]:
+            step.cleanObjId()
+            step._prerequisitesChanged = False
+            self.setInteractive(self.isInteractive() or step.isInteractive())
+            self._stepsSet.append(step)
+
+        self._stepsStored = len(self._steps)
+        self._commitSteps()
+
+    def _commitSteps(self):
+        """ Write all pending steps changes to the database. """
         self._stepsSet.write()
+        self._stepsPending = 0
+        self._stepsLastCommit = time.time()
+
+    def __updateStep(self, step, commit=False):
+        """ Store a given step. Changes are committed in batches, at most
+        every _stepsCommitSecs seconds, or right away if commit is True.
+        Steps not committed when the process dies will be considered
+        not finished and executed again when resuming.
+        """
+        self._stepsSet.update(step)
+        self._stepsPending += 1
+        if (commit or
+                time.time() - self._stepsLastCommit > self._stepsCommitSecs):
+            self._commitSteps()
 
     def _stepStarted(self, step):
         """This function will be called whenever an step
@@ -981,7 +1045,7 @@ class Protocol(Step):
             self.error(errorMsg)
         self.lastStatus = step.getStatus()
 
-        self.__updateStep(step)
+        self.__updateStep(step, commit=not doContinue)
         self._stepsDone.increment()
         self._store(self._stepsDone)
 
@@ -1017,6 +1081,8 @@ class Protocol(Step):
                                          self._stepStarted,
                                          self._stepFinished,
                                          self._stepsCheck)
+            if self._stepsPending:
+                self._commitSteps()
         self.setStatus(self.lastStatus)
         self._store(self.status)
 
@@ -1405,7 +1471,7 @@ class Protocol(Step):
         """ Return the package module to which this protocol belongs
         """
         import pyworkflow.em as em
-        em.getProtocols()  # make sure the _package is set for each Protocol class
+        em.findClassPackage(cls)  # make sure the _package is set for this class
         return getattr(cls, '_package', scipion)
 
     @classmethod
@@ -1514,8 +1580,13 @@ class Protocol(Step):
     def updateSteps(self):
         """ After the steps list is modified, this methods will update steps
         information. It will save the steps list and also the number of steps.
+        Only new or modified steps are written if the steps were already
+        stored in this execution.
         """
-        self._storeSteps()
+        if self._stepsSet is None:
+            self._storeSteps()
+        else:
+            self._storeNewSteps()
         self._numberOfSteps.set(len(self._steps))
         self._store(self._numberOfSteps)
 
@@ -1919,9 +1990,14 @@ def runProtocolMain(projectPath, protDbPath, protId):
             sys.exit(retcode)
 
         elif protocol.numberOfThreads > 1:
-            executor = ThreadStepExecutor(hostConfig,
-                                          protocol.numberOfThreads.get()-1,
-                                          gpuList=protocol.getGpuList())
+            if protocol.getAttributeValue('useProcesses', False):
+                executor = ProcessStepExecutor(hostConfig,
+                                               protocol.numberOfThreads.get()-1,
+                                               gpuList=protocol.getGpuList())
+            else:
+                executor = ThreadStepExecutor(hostConfig,
+                                              protocol.numberOfThreads.get()-1,
+                                              gpuList=protocol.getGpuList())
     if executor is None:
         executor = StepExecutor(hostConfig,
                                 gpuList=protocol.getGpuList())
@@ -1986,6 +2062,26 @@ def getUpdatedProtocol(protocol):
     return prot2
 
 
+# A run.db modification time equal to the one of the last load is only
+# trusted if the load was done some seconds after that time was first
+# seen. Writes in the same mtime tick (1 second in some file systems)
+# would not change it. Only local times are compared, since the clock
+# of a file server could be different from the local one.
+DB_MTIME_MARGIN = 2
+
+
+def setProtocolLoadTime(protocol, dbTS, loadTime):
+    """ Keep the run.db modification time dbTS of the last load of
+    the protocol, done at local time loadTime (in seconds).
+    """
+    lastLoad = getattr(protocol, '_dbLoadTimes', None)
+    if lastLoad is not None and lastLoad[0] == dbTS:
+        seenTime = lastLoad[1]
+    else:
+        seenTime = loadTime
+    protocol._dbLoadTimes = (dbTS, seenTime, loadTime)
+
+
 def isProtocolUpToDate(protocol):
     """ Check timestamps between protocol lastModificationDate and the
     corresponding runs.db timestamp"""
@@ -2004,5 +2100,11 @@ def isProtocolUpToDate(protocol):
               "Protocol %s, protocol time stamp: %s, %s timeStamp: %s"
               % (protocol, protTS, protocol, dbTS))
     else:
-        return protTS > dbTS
+        if protTS != dbTS:
+            return protTS > dbTS
+        # The protocol time stamp is set to the run.db one when updated,
+        # an equal one means no changes if the mtime tick was over
+        lastLoad = getattr(protocol, '_dbLoadTimes', None)
+        return (lastLoad is not None and lastLoad[0] == dbTS and
+                lastLoad[2] - lastLoad[1] > DB_MTIME_MARGIN)
 
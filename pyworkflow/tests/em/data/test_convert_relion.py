@@ -29,14 +29,18 @@
 from __future__ import print_function
 import os
 import subprocess
+from itertools import izip
 import numpy
-from pyworkflow.object import Float
+from pyworkflow.object import Float, Integer
 from pyworkflow.tests import BaseTest, setupTestOutput, DataSet
 from pyworkflow.em.data import (SetOfParticles, CTFModel, Acquisition,
-                                Coordinate, Particle, SetOfVolumes, Transform)
+                                Coordinate, Particle, SetOfVolumes, Transform,
+                                Micrograph, SetOfMicrographs, SetOfCoordinates)
 from pyworkflow.em import ImageHandler
 import pyworkflow.em.metadata as md
-from pyworkflow.em.packages.relion.convert import convertBinaryFiles
+import pyworkflow.em.metadata.star as star
+from pyworkflow.em.packages.relion.convert import (convertBinaryFiles,
+                                                   writeSetOfCoordinates)
 from pyworkflow.em.constants import ALIGN_PROJ, ALIGN_2D, ALIGN_3D
 import pyworkflow.em.packages.relion as relion
 import pyworkflow.em.packages.xmipp3 as xmp
@@ -148,7 +152,166 @@ class TestConversions(BaseTest):
                       'rlnNrOfSignificantSamples', 'rlnMaxValueProbDistribution']
         self.assertEqual(goldLabels, [md.label2Str(l) for l in mdAll.getActiveLabels()])
         self.assertEqual(4700, mdAll.size())
-        
+
+        table = star.readTable(fnStar)
+        self.assertEqual(goldLabels, table.getColumnNames())
+        self.assertEqual(4700, len(table))
+
+    def test_readSetOfParticlesColumns(self):
+        """ Reading the particles by columns should produce the same
+        set than converting each row to a Particle.
+        """
+        fnStar = self.getFile('relion_it020_data')
+        # The postprocess hook forces reading the particles row by row
+        partSet1 = SetOfParticles(filename=self.getOutputPath("rows.sqlite"))
+        relion.readSetOfParticles(fnStar, partSet1, alignType=ALIGN_PROJ,
+                                  postprocessImageRow=lambda img, row: None)
+        partSet2 = SetOfParticles(filename=self.getOutputPath("cols.sqlite"))
+        self.assertTrue(relion.readSetOfParticlesColumns(fnStar, partSet2,
+                                                         alignType=ALIGN_PROJ))
+        self.assertEqual(partSet1.getSize(), partSet2.getSize())
+
+        for p1, p2 in izip(partSet1, partSet2):
+            self.assertEqual(p1.getObjDict(), p2.getObjDict())
+            self.assertEqual(p1.getObjId(), p2.getObjId())
+
+
+class TestStarFile(BaseTest):
+    """ Check the STAR reader and writer that do not use Xmipp. """
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_readWrite(self):
+        fnStar = self.getOutputPath('input.star')
+        with open(fnStar, 'w') as f:
+            f.write("""
+data_model_general
+
+_rlnReferenceDimensionality 3
+_rlnCurrentResolution 4.5
+
+data_images
+
+loop_
+_rlnImageName #1
+_rlnDefocusU #2
+_rlnClassNumber #3
+000001@Particles/a.mrcs 12000.5 1
+000002@Particles/a.mrcs 0.0000001 2
+000003@Particles/"b c".mrcs 11000.25 1
+""")
+        general, images = list(star.iterTables(fnStar))
+        self.assertFalse(general.isLoop())
+        self.assertEqual(3, general.getColumn('rlnReferenceDimensionality')[0])
+        self.assertEqual(4.5, general.getColumn('rlnCurrentResolution')[0])
+        self.assertEqual(3, len(images))
+        self.assertEqual(['000001@Particles/a.mrcs', '000002@Particles/a.mrcs',
+                          '000003@Particles/b c.mrcs'],
+                         images.getColumn('rlnImageName').tolist())
+        self.assertEqual([12000.5, 1e-7, 11000.25],
+                         images.getColumn('rlnDefocusU').tolist())
+        self.assertEqual([1, 2, 1],
+                         images.getColumn('rlnClassNumber').tolist())
+        self.assertEqual(str(images),
+                         str(star.readTable('images@%s' % fnStar)))
+
+        images = images.filter(images.getColumn('rlnClassNumber') == 1)
+        fnOut = self.getOutputPath('output.star')
+        star.writeTables(fnOut, [general, images])
+        general2, images2 = list(star.iterTables(fnOut))
+
+        for t1, t2 in [(general, general2), (images, images2)]:
+            self.assertEqual(t1.getName(), t2.getName())
+            self.assertEqual(t1.isLoop(), t2.isLoop())
+            self.assertEqual(t1.getColumnNames(), t2.getColumnNames())
+            for label in t1.getColumnNames():
+                self.assertEqual(t1.getColumn(label).tolist(),
+                                 t2.getColumn(label).tolist())
+
+    def test_readLabelTypes(self):
+        fnStar = self.getOutputPath('types.star')
+        with open(fnStar, 'w') as f:
+            f.write("""
+data_
+
+loop_
+_rlnMicrographName #1
+_rlnGroupNumber #2
+_rlnDefocusU #3
+0012 1 12000
+0013 2 11000
+""")
+        labelTypes = {'rlnMicrographName': str, 'rlnDefocusU': float}
+        table = star.readTable(fnStar, getLabelType=labelTypes.get)
+        self.assertEqual(['0012', '0013'],
+                         table.getColumn('rlnMicrographName').tolist())
+        self.assertEqual([1, 2], table.getColumn('rlnGroupNumber').tolist())
+        self.assertEqual(numpy.float64, table.getColumn('rlnDefocusU').dtype)
+        # Without the label types, numeric strings are read as numbers
+        table = star.readTable(fnStar)
+        self.assertEqual([12, 13],
+                         table.getColumn('rlnMicrographName').tolist())
+
+
+class TestCoordinatesToStar(BaseTest):
+    """ Check the export of coordinates grouped by micrograph. """
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_writeSetOfCoordinates(self):
+        micSet = SetOfMicrographs(filename=self.getOutputPath('mics.sqlite'))
+        micSet.setSamplingRate(1.0)
+        for i in range(1, 5):
+            micSet.append(Micrograph(location='mic%02d.mrc' % i))
+        micSet.write()
+
+        coordSet = SetOfCoordinates(filename=self.getOutputPath('coords.sqlite'))
+        coordSet.setMicrographs(micSet)
+        coordSet.setBoxSize(64)
+        # Coordinates are not sorted by micrograph and mic 4 has none
+        micCoords = {1: [], 2: [], 3: []}
+        for i in range(100):
+            micId = [2, 1, 3, 1][i % 4]
+            coord = Coordinate(x=10 * i, y=i + 1)
+            coord.setMicId(micId)
+            coord._rlnClassNumber = Integer(i % 3)
+            coord._rlnAutopickFigureOfMerit = Float(i * 0.5)
+            coord._rlnAnglePsi = Float(-i * 1.5)
+            coordSet.append(coord)
+            micCoords[micId].append(coord.clone())
+        coordSet.write()
+
+        groups = list(coordSet.iterMicrographColumns(['id', '_x'],
+                                                     chunkSize=7))
+        self.assertEqual([1, 2, 3], [micId for micId, _ in groups])
+        for micId, columns in groups:
+            self.assertEqual([c.getObjId() for c in micCoords[micId]],
+                             columns['id'].tolist())
+            self.assertEqual([c.getX() for c in micCoords[micId]],
+                             columns['_x'].tolist())
+
+        def getStarFile(mic):
+            return mic.getFileName().replace('.mrc', '.star')
+
+        for threads in [1, 3]:
+            posDir = self.getOutputPath('pos%d' % threads)
+            os.makedirs(posDir)
+            writeSetOfCoordinates(posDir, coordSet, getStarFile, scale=2,
+                                  numberOfThreads=threads)
+            self.assertEqual(['mic01.star', 'mic02.star', 'mic03.star'],
+                             sorted(os.listdir(posDir)))
+            for micId, coords in micCoords.iteritems():
+                with open(os.path.join(posDir, 'mic%02d.star' % micId)) as f:
+                    lines = f.read().splitlines()
+                self.assertEqual(['%d %d %d %0.6f %0.6f'
+                                  % (c.getX() * 2, c.getY() * 2,
+                                     c._rlnClassNumber,
+                                     c._rlnAutopickFigureOfMerit,
+                                     c._rlnAnglePsi) for c in coords],
+                                 lines[-len(coords):])
+
 
 class TestConvertBinaryFiles(BaseTest):
     
@@ -5,10 +5,13 @@ Created on May 20, 2013
 '''
 
 from glob import iglob
+import numpy as np
+
 from pyworkflow.tests import *
 from pyworkflow.em.packages.xmipp3.convert import *
 import pyworkflow.em.metadata as md
 from pyworkflow.em.convert import ImageHandler, DT_FLOAT
+from pyworkflow.em.image_file import ImageFile
 
 
 
@@ -197,6 +200,160 @@ class TestImageHandler(unittest.TestCase):
             pwutils.cleanPath(outFn)
 
 
+class TestImageFile(BaseTest):
+    """ Check the memory-mapped reading of MRC and SPIDER files,
+    using small synthetic files.
+    """
+    _labels = [SMALL, WEEKLY]
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _createSpiderStack(self, fn, data):
+        """ Write a SPIDER stack (big-endian) with the given 3D array. """
+        n, y, x = data.shape
+        labrec = int(np.ceil(256. / x))
+        labbyt = labrec * x * 4
+
+        def header(values):
+            h = np.zeros(labbyt / 4, dtype='>f4')
+            h[[0, 1, 4, 11, 12, 21, 22]] = [1, y, 1, x, labrec, labbyt, labbyt]
+            for k, v in values.iteritems():
+                h[k - 1] = v
+            return h.tostring()
+
+        with open(fn, 'wb') as f:
+            f.write(header({24: 2, 26: n}))
+            for i in range(n):
+                f.write(header({24: 0, 28: 1, 27: i + 1}))
+                f.write(data[i].astype('>f4').tostring())
+
+    def test_readMrcStack(self):
+        ih = ImageHandler()
+        data = np.arange(5 * 6 * 4, dtype=np.int16).reshape((5, 6, 4))
+        stackFn = self.getOutputPath('stack.mrcs')
+        outFile = ImageFile.createMrc(stackFn, (4, 6, 1, 5), np.int16, 2.5)
+        outFile.getData()[:] = data
+        outFile.close()
+
+        self.assertEqual(ih.getDimensions(stackFn), (4, 6, 1, 5))
+        self.assertEqual(ih.getDimensions((3, stackFn)), (4, 6, 1, 1))
+        self.assertEqual(ih.getDataType(stackFn), ImageHandler.DT_SHORT)
+        self.assertTrue(np.array_equal(ih.getData((3, stackFn)), data[2]))
+        # The same file read as a volume
+        self.assertEqual(ih.getDimensions(stackFn + ':mrc'), (4, 6, 5, 1))
+        self.assertEqual(ImageFile(stackFn).getSampling(), 2.5)
+
+        chunks = list(ImageFile(stackFn).iterChunks(chunkSize=2))
+        self.assertEqual([len(c) for c in chunks], [2, 2, 1])
+        self.assertTrue(np.array_equal(np.concatenate(chunks), data))
+
+    def test_readSpiderStack(self):
+        ih = ImageHandler()
+        data = np.random.rand(3, 8, 10).astype(np.float32)
+        stackFn = self.getOutputPath('stack.stk')
+        self._createSpiderStack(stackFn, data)
+
+        self.assertEqual(ih.getDimensions(stackFn), (10, 8, 1, 3))
+        self.assertEqual(ih.getDataType(stackFn), ImageHandler.DT_FLOAT)
+        for i in range(3):
+            self.assertTrue(np.array_equal(ih.getData((i + 1, stackFn)),
+                                           data[i]))
+
+    def test_convertStack(self):
+        ih = ImageHandler()
+        data = np.random.rand(7, 8, 10).astype(np.float32)
+        stackFn = self.getOutputPath('input.stk')
+        self._createSpiderStack(stackFn, data)
+        outFn = self.getOutputPath('output.mrcs')
+
+        ih.convertStack(stackFn, outFn, 2, 6)
+
+        self.assertEqual(ih.getDimensions(outFn), (10, 8, 1, 5))
+        outData = ih.getData(outFn)
+        self.assertTrue(np.array_equal(outData, data[1:6]))
+        # Check the statistics written in the header
+        with open(outFn, 'rb') as f:
+            f.seek(76)
+            dmin, dmax, dmean = np.fromstring(f.read(12), dtype='<f4')
+        self.assertAlmostEqual(dmin, data[1:6].min())
+        self.assertAlmostEqual(dmax, data[1:6].max())
+        self.assertAlmostEqual(dmean, data[1:6].mean(), places=5)
+
+    def test_computeStats(self):
+        ih = ImageHandler()
+        data1 = np.random.normal(size=(6, 8, 10)).astype(np.float32)
+        data2 = np.random.normal(size=(4, 8, 10)).astype(np.float32)
+        # Compare with statistics computed in double precision
+        data1d, data2d = data1.astype(np.float64), data2.astype(np.float64)
+        mrcFn = self.getOutputPath('stats.mrcs')
+        mrcFile = ImageFile.createMrc(mrcFn, (10, 8, 1, 6))
+        mrcFile.getData()[:] = data1
+        mrcFile.close()
+        spiFn = self.getOutputPath('stats.stk')
+        self._createSpiderStack(spiFn, data2)
+
+        stats = ih.computeStats(mrcFn, bins=10)
+        self.assertEqual(stats.getSize(), 6)
+        self.assertTrue(np.allclose(stats.getAverage(), data1d.mean(axis=0)))
+        self.assertTrue(np.allclose(stats.getVariance(), data1d.var(axis=0)))
+        mean, std, minValue, maxValue = stats.getStats()
+        self.assertAlmostEqual(mean, data1d.mean())
+        self.assertAlmostEqual(std, data1d.std())
+        self.assertEqual((minValue, maxValue), (data1.min(), data1.max()))
+        self.assertEqual(stats.getHistogram()[0].sum(), data1.size)
+
+        # Use some images of both files from a set of particles
+        partSet = SetOfParticles(filename=self.getOutputPath('stats.sqlite'))
+        for fn, indexes in [(mrcFn, [5, 2, 3]), (spiFn, [1, 4])]:
+            for i in indexes:
+                partSet.append(Particle(location=(i, fn)))
+        expected = np.concatenate([data1d[[4, 1, 2]], data2d[[0, 3]]])
+
+        for procs in [1, 2]:
+            stats = ih.computeStats(partSet, numberOfProcs=procs)
+            self.assertEqual(stats.getSize(), 5)
+            self.assertTrue(np.allclose(stats.getAverage(),
+                                        expected.mean(axis=0)))
+            self.assertAlmostEqual(stats.getStats()[1], expected.std())
+
+    def test_unsupportedFile(self):
+        """ Files that can not be memory-mapped should fall back to Xmipp. """
+        ih = ImageHandler()
+        badFn = self.getOutputPath('truncated.mrc')
+        outFile = ImageFile.createMrc(badFn, (4, 4, 1, 2), np.float32)
+        outFile.close()
+        with open(badFn, 'r+b') as f:
+            f.truncate(1024 + 10)
+
+        self.assertRaises(Exception, ImageFile, badFn)
+        self.assertIsNone(ih._openImageFile(badFn))
+
+    def test_correctGainDark(self):
+        from pyworkflow.em.image_file import transformGain, correctGainDark
+        data = np.random.randint(0, 10, size=(5, 6, 4)).astype(np.uint16)
+        movieFn = self.getOutputPath('movie.mrcs')
+        movieFile = ImageFile.createMrc(movieFn, (4, 6, 1, 5), np.uint16)
+        movieFile.getData()[:] = data
+        movieFile.close()
+        # The gain is stored rotated 90 degrees and flipped left right
+        gain = np.random.rand(6, 4).astype(np.float32)
+        storedGain = np.rot90(gain[:, ::-1], -1)
+        dark = np.ones((6, 4), dtype=np.float32)
+
+        self.assertEqual(storedGain.shape, (4, 6))
+        self.assertTrue(np.array_equal(transformGain(storedGain, 1, 2), gain))
+
+        outFn = self.getOutputPath('movie_corrected.mrcs')
+        correctGainDark(movieFn, outFn, gain, dark, chunkSize=2)
+        self.assertEqual(ImageHandler().getDimensions(outFn), (4, 6, 1, 5))
+        self.assertTrue(np.allclose(ImageFile(outFn).getData(),
+                                    (data - dark) * gain))
+        self.assertRaises(Exception, correctGainDark, movieFn, outFn,
+                          storedGain)
+
+
 class TestSetOfMicrographs(BaseTest):
 
     _labels = [SMALL, WEEKLY]
@@ -511,6 +668,39 @@ class TestSetOfClasses2D(BaseTest):
             self.assertEqual(cls.getSize(), sizes[i])
         clsSet.clear() # Close db connection and clean data
 
+    def test_iterItemsSince(self):
+        """ Read only some columns of the classes appended to the set
+        since a given id, as done with streaming inputs.
+        """
+        imgSet = SetOfParticles(filename=self.getOutputPath('parts.sqlite'))
+        imgSet.setSamplingRate(1.5)
+        img = Particle()
+        for i in range(1, 7):
+            img.setObjId(None)
+            img.setLocation(i, 'particles.stk')
+            imgSet.append(img)
+        imgSet.write()
+
+        clsSet = SetOfClasses2D(filename=self.getOutputPath('classes.sqlite'))
+        clsSet.setImages(imgSet)
+        for i in range(1, 4):
+            cls = Class2D(objId=i)
+            clsSet.append(cls)
+            for img in imgSet.iterItems(limit=i):
+                cls.append(img)
+            clsSet.update(cls)
+        clsSet.write()
+
+        self.assertEqual([2, 3], [cls.getObjId()
+                                  for cls in clsSet.iterItemsSince(1)])
+        sizes = [cls.getSize() for cls in clsSet.iterItems(columns=['_size'])]
+        self.assertEqual([1, 2, 3], sizes)
+        cls = clsSet.iterItemsSince(2, columns=[]).next()
+        self.assertEqual(3, cls.getObjId())
+        self.assertEqual([1, 2, 3], [img.getObjId() for img in cls])
+        clsSet.close()
+        imgSet.close()
+
 
 class TestTransform(BaseTest):
 
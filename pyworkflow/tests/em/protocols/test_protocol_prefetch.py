@@ -0,0 +1,172 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+
+import os
+import time
+import threading
+
+from pyworkflow.tests import BaseTest, setupTestOutput
+from pyworkflow.mapper import SqliteMapper
+from pyworkflow.protocol.executor import StepExecutor
+from pyworkflow.em.data import Movie, SetOfMovies
+from pyworkflow.em.protocol import ProtProcessMovies
+
+
+class MyProtMovies(ProtProcessMovies):
+    """ Protocol that records which movies are prepared (in the steps or
+    in the prefetch threads) and processed.
+    """
+    def __init__(self, **kwargs):
+        ProtProcessMovies.__init__(self, **kwargs)
+        # Steps are inserted for these movies, the input set is not used
+        self.movies = []
+        self.inputMovies.set(SetOfMovies())
+        self.prepared = []  # (movieId, prefetched)
+        self.processed = []
+        self.prefetchDone = []
+        self.failPrefetch = set()  # movies whose prefetch will fail
+        self.failProcess = set()  # movies whose processing will fail
+        self.prefetchSleep = 0
+        self.prefetchEvent = threading.Event()  # clear to block prefetch
+        self.prefetchEvent.set()
+
+    def _insertAllSteps(self):
+        self.convertCIStep = []
+        for movie in self.movies:
+            self._insertMovieStep(movie)
+
+    def _stepsCheck(self):
+        pass
+
+    def _prepareMovie(self, movie, movieFolder, timings, runJob=None):
+        prefetched = runJob is not None  # prefetch threads pass their runJob
+        self.prepared.append((movie.getObjId(), prefetched))
+        if prefetched:
+            self.prefetchEvent.wait()
+            time.sleep(self.prefetchSleep)
+            if movie.getObjId() in self.failPrefetch:
+                raise Exception("Prefetch failed")
+        name = ProtProcessMovies._prepareMovie(self, movie, movieFolder,
+                                               timings, runJob)
+        if prefetched:
+            self.prefetchDone.append(movie.getObjId())
+        return name
+
+    def _processMovie(self, movie):
+        if movie.getObjId() in self.failProcess:
+            raise Exception("Processing failed")
+        self.processed.append((movie.getObjId(), movie.getFileName()))
+
+
+class TestMoviesPrefetch(BaseTest):
+    """ Check the preparation of movies in advance of ProtProcessMovies. """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _createProtocol(self, name, n=4, size=1000, prefetch=2,
+                        scratchSize=1):
+        """ Create the protocol with n movies of the given size in bytes,
+        prefetching the given number of movies in scratchSize bytes.
+        """
+        prot = MyProtMovies(workingDir=self.getOutputPath(name))
+        prot.makePathsAndClean()
+        prot.prefetchMovies.set(prefetch)
+        prot.prefetchScratchSize.set(scratchSize / 1024. ** 3)
+        for i in range(1, n+1):
+            fn = prot._getExtraPath('movie%02d.mrcs' % i)
+            with open(fn, 'w') as f:
+                f.write('x' * size)
+            movie = Movie(location=fn)
+            movie.setObjId(i)
+            prot.movies.append(movie)
+        return prot
+
+    def _runProtocol(self, prot):
+        name = os.path.basename(prot.getWorkingDir())
+        prot.mapper = SqliteMapper(self.getOutputPath(name + '.sqlite'),
+                                   globals())
+        prot._stepsExecutor = StepExecutor(hostConfig=None)
+        prot.run()
+
+    def _checkProcessed(self, prot, n):
+        self.assertEqual(range(1, n+1), [m for m, _ in prot.processed])
+        for movieId, fn in prot.processed:
+            movie = prot.movies[movieId-1]
+            self.assertEqual(prot._getOutputMovieFolder(movie),
+                             os.path.dirname(fn))
+        # The pool should be closed when the run ends
+        self.assertFalse(hasattr(prot, '_prefetchPool'))
+
+    def test_prefetchHit(self):
+        prot = self._createProtocol('hit', scratchSize=10000)
+        self._runProtocol(prot)
+        self.assertTrue(prot.isFinished())
+        self._checkProcessed(prot, 4)
+        # Only the first movie is prepared by its own step
+        self.assertEqual([(1, False), (2, True), (3, True), (4, True)],
+                         sorted(prot.prepared))
+
+    def test_budget(self):
+        prot = self._createProtocol('budget', prefetch=3, scratchSize=2500)
+        prot._insertAllSteps()
+        prot.prefetchEvent.clear()
+        prot._prefetchNextMovies(prot.movies[0])
+        # Only two movies fit in the scratch space
+        self.assertEqual([2, 3], sorted(prot._prefetched.keys()))
+        prot.prefetchEvent.set()
+        prot._closePrefetchPool()
+        self.assertEqual([2, 3], sorted(prot.prefetchDone))
+
+        # The space of the linked movies is not counted once they
+        # are prepared, so the next one can be prefetched
+        prot._popPrefetchedMovie(prot.movies[1])
+        prot._prefetchNextMovies(prot.movies[1])
+        self.assertEqual([3, 4], sorted(prot._prefetched.keys()))
+        prot._closePrefetchPool()
+
+    def test_failedPrefetch(self):
+        prot = self._createProtocol('failed', scratchSize=10000)
+        prot.failPrefetch.add(2)
+        self._runProtocol(prot)
+        self.assertTrue(prot.isFinished())
+        self._checkProcessed(prot, 4)
+        # The movie is prepared again by its step
+        self.assertEqual([(1, False), (2, False), (2, True), (3, True),
+                          (4, True)], sorted(prot.prepared))
+
+    def test_endRun(self):
+        prot = self._createProtocol('endRun', scratchSize=10000)
+        prot.failProcess.add(1)
+        prot.prefetchSleep = 1
+        self._runProtocol(prot)
+        self.assertTrue(prot.isFailed())
+        # The prefetch threads should finish before the run ends
+        self.assertEqual([2, 3], sorted(prot.prefetchDone))
+        self.assertFalse(hasattr(prot, '_prefetchPool'))
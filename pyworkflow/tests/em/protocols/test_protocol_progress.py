@@ -0,0 +1,197 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import os
+import threading
+import multiprocessing
+
+from pyworkflow.tests import BaseTest, setupTestOutput
+from pyworkflow.em.data import Micrograph
+from pyworkflow.em.protocol import EMProtocol, ProgressStore
+
+
+class MyStreamingProtocol(EMProtocol):
+    """ Protocol that keeps the progress of its micrographs. """
+    def _getAllDone(self):
+        return self._getExtraPath('DONE', 'all.TXT')
+
+    def _getAllFailed(self):
+        return self._getExtraPath('DONE', 'failed.TXT')
+
+
+def _appendStatus(args):
+    """ Set the status of some ids from other process. """
+    filename, first, n = args
+    store = ProgressStore(filename)
+    for i in range(first, first + n):
+        store.setStatus([i], ProgressStore.PROCESSED)
+
+
+class TestProgressStore(BaseTest):
+    """ Check the progress of items kept by streaming protocols. """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _getFile(self, name):
+        fn = self.getOutputPath(name)
+        if os.path.exists(fn):
+            os.remove(fn)
+        return fn
+
+    def _createProtocol(self, name):
+        prot = MyStreamingProtocol(workingDir=self.getOutputPath(name))
+        prot.makePathsAndClean()
+        return prot
+
+    def _createMics(self, n):
+        mics = []
+        for i in range(1, n+1):
+            mic = Micrograph(location='mic%03d.mrc' % i)
+            mic.setObjId(i)
+            mics.append(mic)
+        return mics
+
+    def test_loadOffset(self):
+        fn = self._getFile('offset.txt')
+        store = ProgressStore(fn)
+        store.setStatus([1, 2], ProgressStore.PROCESSED)
+        # Other process reading and writing the same file
+        store2 = ProgressStore(fn)
+        self.assertEqual(set([1, 2]), store2.getIds(ProgressStore.PROCESSED))
+        self.assertEqual(os.path.getsize(fn), store2._offset)
+        store2.setStatus([1], ProgressStore.DONE)
+        store2.setStatus([3], ProgressStore.FAILED)
+
+        self.assertFalse(store.hasStatus(1, ProgressStore.DONE))
+        store.load()
+        self.assertTrue(store.hasStatus(1, ProgressStore.DONE))
+        self.assertEqual(set([3]), store.getIds(ProgressStore.FAILED))
+        self.assertEqual(os.path.getsize(fn), store._offset)
+        # Only the new lines should be read
+        with open(fn, 'a') as f:
+            f.write('done 2\n')
+        offset = store._offset
+        store.load()
+        self.assertEqual(offset + len('done 2\n'), store._offset)
+        self.assertEqual(set([1, 2]), store.getIds(ProgressStore.DONE))
+        self.assertEqual(2, store.count(ProgressStore.PROCESSED))
+
+    def test_partialLine(self):
+        fn = self._getFile('partial.txt')
+        store = ProgressStore(fn)
+        store.setStatus([1], ProgressStore.PROCESSED)
+        # A line that is still being written should not be loaded
+        with open(fn, 'a') as f:
+            f.write('processed 1')
+        store.load()
+        self.assertEqual(len('processed 1\n'), store._offset)
+        self.assertEqual(set([1]), store.getIds(ProgressStore.PROCESSED))
+        with open(fn, 'a') as f:
+            f.write('2\n')
+        store.load()
+        self.assertEqual(set([1, 12]), store.getIds(ProgressStore.PROCESSED))
+        self.assertEqual(os.path.getsize(fn), store._offset)
+
+    def test_readLists(self):
+        prot = self._createProtocol('readLists')
+        mics = self._createMics(4)
+        prot._setItemsProcessed(mics[:3])
+        self.assertTrue(prot._isItemProcessed(mics[0]))
+        self.assertFalse(prot._isItemProcessed(mics[3]))
+        prot._writeDoneList(mics[:1])
+        self.assertEqual(set([1]), prot._readDoneList())
+
+        # Done and failed lists should include the changes
+        # made from other processes
+        store = ProgressStore(prot._getExtraPath('DONE', 'progress.txt'))
+        store.setStatus([2], ProgressStore.DONE)
+        store.setStatus([3], ProgressStore.FAILED)
+        self.assertEqual(set([3]), prot._readFailedList())
+        self.assertEqual(set([1, 2]), prot._readDoneList())
+        # Done items are also processed
+        self.assertTrue(prot._isItemProcessed(mics[1]))
+
+    def test_legacyImport(self):
+        prot = self._createProtocol('legacy')
+        mics = self._createMics(6)
+        # Files written by previous versions
+        os.makedirs(prot._getExtraPath('DONE'))
+        with open(prot._getAllDone(), 'w') as f:
+            f.write('1\n2\n')
+        with open(prot._getAllFailed(), 'w') as f:
+            f.write('3\n')
+        markerFn = lambda mic: prot._getExtraPath('mic_%d.done'
+                                                  % mic.getObjId())
+        for mic in mics[3:5]:
+            open(markerFn(mic), 'w').close()
+
+        self.assertEqual(set([1, 2]), prot._readDoneList())
+        self.assertEqual(set([3]), prot._readFailedList())
+        prot._importLegacyDoneMarkers(mics, markerFn)
+        # Failed items are not processed, unless they have a marker
+        processed = [True, True, False, True, True, False]
+        self.assertEqual(processed, [prot._isItemProcessed(m) for m in mics])
+
+        # Continuing again should not import the old files twice, and
+        # markers of processed items are not checked anymore
+        for mic in mics[3:5]:
+            os.remove(markerFn(mic))
+        prot2 = MyStreamingProtocol(workingDir=prot.getWorkingDir())
+        prot2._importLegacyDoneMarkers(mics, markerFn)
+        self.assertEqual(processed, [prot2._isItemProcessed(m) for m in mics])
+        with open(prot._getExtraPath('DONE', 'progress.txt')) as f:
+            self.assertEqual(5, len(f.readlines()))
+
+    def test_concurrentAppends(self):
+        fn = self._getFile('concurrent.txt')
+        store = ProgressStore(fn)
+        n = 200
+        # Steps running in threads share the same store
+        threads = [threading.Thread(target=lambda i=i: [
+            store.setStatus([j], ProgressStore.DONE)
+            for j in range(i * n, (i + 1) * n)]) for i in range(4)]
+        for t in threads:
+            t.start()
+        # and other processes append to the same file
+        pool = multiprocessing.Pool(2)
+        pool.map(_appendStatus, [(fn, i * n, n) for i in range(4)])
+        pool.close()
+        pool.join()
+        for t in threads:
+            t.join()
+
+        store.load()
+        allIds = set(range(4 * n))
+        self.assertEqual(allIds, store.getIds(ProgressStore.DONE))
+        self.assertEqual(allIds, store.getIds(ProgressStore.PROCESSED))
+        store2 = ProgressStore(fn)
+        self.assertEqual(allIds, store2.getIds(ProgressStore.DONE))
+        self.assertEqual(allIds, store2.getIds(ProgressStore.PROCESSED))
+        with open(fn) as f:
+            self.assertEqual(8 * n, len(f.readlines()))
@@ -22,10 +22,16 @@
 # ***************************************************************************/
 
 import os
+import struct
 import tempfile
+from glob import glob
 from itertools import izip
 
-from pyworkflow.tests import BaseTest, setupTestProject, DataSet
+import pyworkflow.utils as pwutils
+from pyworkflow.tests import (BaseTest, setupTestProject, setupTestOutput,
+                              DataSet)
+from pyworkflow.mapper import SqliteMapper
+from pyworkflow.protocol.executor import StepExecutor
 from pyworkflow.em.protocol import ProtImportMicrographs
 from pyworkflow.em.data import SetOfMicrographs
 
@@ -121,6 +127,34 @@ class TestImportMicrographs(TestImportBase):
         self.launchProtocol(protEmxImport)
         _checkOutput(protEmxImport, [], size=1)
     
+    def test_streaming(self):
+        """ Import micrographs in streaming copying them with several
+        threads. They should be added in the order they were found.
+        """
+        micsPath = self.dsXmipp.getFile('micrographs')
+        protMicImport = self.newProtocol(ProtImportMicrographs,
+                                         filesPath=micsPath,
+                                         filesPattern='*.mrc',
+                                         samplingRate=2.1,
+                                         voltage=100,
+                                         dataStreaming=True,
+                                         timeout=5,
+                                         copyFiles=True,
+                                         copyThreads=3)
+        protMicImport.setObjLabel('streaming (3 copy threads)')
+        self.launchProtocol(protMicImport)
+
+        mics = getattr(protMicImport, 'outputMicrographs', None)
+        self.assertIsNotNone(mics)
+        micFiles = sorted(os.path.basename(fn) for fn in
+                          glob(os.path.join(micsPath, '*.mrc')))
+        self.assertEqual(micFiles, [m.getMicName() for m in mics])
+        self.assertEqual(range(1, len(micFiles) + 1),
+                         [m.getObjId() for m in mics])
+        for mic in mics:
+            self.assertTrue(os.path.exists(mic.getFileName()))
+            self.assertFalse(os.path.islink(mic.getFileName()))
+
     def test_fromEmx(self):
         """ Import an EMX file with micrographs and defocus
         """
@@ -200,3 +234,70 @@ class TestImportMicrographs(TestImportBase):
         self.assertAlmostEqual(300., acq.getVoltage())
         self.assertAlmostEqual(50000., acq.getMagnification())
         
+
+
+class TestImportScanner(BaseTest):
+    """ Check the file scanner used by the streaming import, this does
+    not need any dataset.
+    """
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_inotify(self):
+        """ The scanner created when validating the protocol should
+        use inotify in the streaming step.
+        """
+        from pyworkflow.utils import file_scanner
+        if file_scanner._libc is None:
+            print "Inotify is not available, skipping test."
+            return
+
+        # Write 1x1 float MRC images
+        header = [0] * 256
+        header[0:4] = [1, 1, 1, 2]  # dimensions and mode
+        header[7:10] = [1, 1, 1]  # sampling
+        header[16:19] = [1, 2, 3]  # axis order
+        header = struct.pack('<256i', *header)
+        header = header[:208] + 'MAP \x44\x44\x00\x00' + header[216:]
+
+        micsPath = self.getOutputPath('mics')
+        pwutils.makePath(micsPath)
+        for i in range(1, 4):
+            fn = os.path.join(micsPath, 'mic%02d.mrc' % i)
+            with open(fn, 'wb') as f:
+                f.write(header + struct.pack('<f', 0))
+            os.utime(fn, (0, 0))  # not being modified
+
+        prot = ProtImportMicrographs(workingDir=self.getOutputPath('import'),
+                                     filesPath=micsPath,
+                                     filesPattern='*.mrc',
+                                     samplingRate=2.1,
+                                     voltage=100,
+                                     dataStreaming=True,
+                                     timeout=1)
+        prot.makePathsAndClean()
+        prot.mapper = SqliteMapper(self.getOutputPath('import.sqlite'),
+                                   globals())
+
+        scanners = []
+        getFileScanner = prot._getFileScanner
+
+        def _getFileScanner(pattern, useInotify=False):
+            scanner = getFileScanner(pattern, useInotify)
+            scanners.append((scanner, useInotify, scanner.hasInotify()))
+            return scanner
+        prot._getFileScanner = _getFileScanner
+
+        # The protocol is validated before running the streaming step
+        prot._stepsExecutor = StepExecutor(hostConfig=None)
+        prot.run()
+        self.assertTrue(prot.isFinished())
+
+        # The scanner of the validation is reused, keeping its state
+        validateScanner = scanners[0][0]
+        streamScanners = [(scanner, hasInotify)
+                          for scanner, useInotify, hasInotify in scanners
+                          if useInotify]
+        self.assertEqual([(validateScanner, True)], streamScanners)
+        self.assertEqual(3, prot.outputMicrographs.getSize())
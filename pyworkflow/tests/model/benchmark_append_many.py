@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import time
+import tempfile
+
+from pyworkflow.em.data import (SetOfParticles, Particle, CTFModel,
+                                Acquisition, Coordinate)
+from pyworkflow.utils import cleanPath
+
+
+def usage(error):
+    print """
+    ERROR: %s
+
+    Usage: scipion python pyworkflow/tests/model/benchmark_append_many.py [n=100000]
+        This script will compare the insertion rate of n particles with
+        CTF, acquisition and coordinate in a SetOfParticles, using
+        Set.append and Set.appendMany.
+    """ % error
+    sys.exit(1)
+
+
+n = len(sys.argv)
+
+if n > 2:
+    usage("Incorrect number of input parameters")
+
+nParticles = 100000 if n < 2 else int(sys.argv[1])
+
+
+def iterParticles():
+    # Reuse the same particle, as done in most protocols
+    part = Particle()
+    part.setCTF(CTFModel(defocusU=10000, defocusV=15000, defocusAngle=15))
+    part.setCoordinate(Coordinate())
+    part.setAcquisition(Acquisition(voltage=300, sphericalAberration=2.0,
+                                    amplitudeContrast=0.1,
+                                    magnification=60000))
+    for i in xrange(1, nParticles + 1):
+        part.setObjId(None)
+        part.setLocation(i, 'particles.stk')
+        part.getCoordinate().setPosition(i, 2 * i)
+        part.setMicId(i % 100)
+        yield part
+
+
+# Time spent only in generating the items, to be discounted
+t = time.time()
+for _ in iterParticles():
+    pass
+tGen = time.time() - t
+
+tmpDir = tempfile.mkdtemp()
+times = []
+
+for useMany in [False, True]:
+    partSet = SetOfParticles(filename=os.path.join(tmpDir, 'particles%s.sqlite'
+                                                   % useMany))
+    # Most output sets have a sampling rate and acquisition that
+    # are set to the images when they are appended
+    partSet.setSamplingRate(1.5)
+    partSet.setAcquisition(Acquisition(voltage=300, sphericalAberration=2.0,
+                                       amplitudeContrast=0.1,
+                                       magnification=60000))
+    t = time.time()
+    if useMany:
+        partSet.appendMany(iterParticles())
+    else:
+        for part in iterParticles():
+            partSet.append(part)
+    partSet.write()
+    times.append(time.time() - t - tGen)
+    partSet.close()
+
+cleanPath(tmpDir)
+
+print "Particles: %d (generation: %0.2f secs)" % (nParticles, tGen)
+print "     append: %0.2f secs, %0.0f rows/sec" % (times[0],
+                                                   nParticles / times[0])
+print " appendMany: %0.2f secs, %0.0f rows/sec (%0.2fx)" % (
+    times[1], nParticles / times[1], times[0] / times[1])
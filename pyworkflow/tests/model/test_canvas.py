@@ -8,6 +8,9 @@ import pyworkflow.gui.canvas
 import Tkinter
 import math
 from pyworkflow.tests import *
+from pyworkflow.utils.graph import Graph
+import pyworkflow.gui.project.viewprotocols as viewprotocols
+from pyworkflow.gui.project.viewprotocols import ProtocolsView
 
 
 class TestCanvas(BaseTest):
@@ -73,3 +76,213 @@ class TestCanvas(BaseTest):
             print ex
 
 
+
+class _Canvas(pyworkflow.gui.canvas.Canvas):
+    """ Canvas without any Tk widget, only used to check
+    which items are visible.
+    """
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+    def bbox(self, itemId):
+        return self.boxes.get(itemId)
+
+    def getVisibleRegion(self):
+        return 0, 0, 100, 100
+
+    def clear(self):
+        self.boxes.clear()
+
+    def drawGraph(self, graph, layout=None, drawNode=None):
+        for node in graph.getNodes():
+            node.item = drawNode(self, node)
+            node.item.node = node
+
+
+class _RunBox(object):
+    """ RunBox that only records its bounds in the canvas. """
+    def __init__(self, nodeInfo, canvas, text, x, y, bgColor, textColor):
+        self.id = len(canvas.boxes)
+        self.nodeInfo = nodeInfo
+        canvas.boxes[self.id] = (x, y, x + 10, y + 10)
+
+
+class _Item(object):
+    def __init__(self, itemId, node, signature):
+        self.id = itemId
+        self.node = node
+        self.nodeInfo = None
+        self.signature = signature
+
+
+class _NodeInfo(object):
+    def __init__(self, expanded=True, x=10, y=10):
+        self.expanded = expanded
+        self.x, self.y = x, y
+
+    def isExpanded(self):
+        return self.expanded
+
+    def getPosition(self):
+        return self.x, self.y
+
+
+class _Settings(object):
+    def __init__(self):
+        self.nodes = {}
+
+    def getNodeById(self, nodeId):
+        return self.nodes.get(nodeId)
+
+    def getNodes(self):
+        return self.nodes.values()
+
+
+class _Run(object):
+    def __init__(self, objId, status):
+        self.objId = objId
+        self.status = status
+
+    def getObjId(self):
+        return self.objId
+
+
+class _ProtocolsView(ProtocolsView):
+    """ ProtocolsView without any Tk widget, the boxes are only
+    recorded when painted again.
+    """
+    def __init__(self, canvas):
+        self.settings = _Settings()
+        self.runsView = 0
+        self.runsGraphCanvas = canvas
+        self._drawnGraphKey = None
+        self._dirtyRunItems = {}
+        self._selection = []
+        self.repainted = []
+
+    def _getRunItemSignature(self, node, nodeInfo):
+        return node.run.status if node.run else None
+
+    def _repaintRunItem(self, item):
+        item.signature = self._getRunItemSignature(item.node, None)
+        self.repainted.append(item.node.getName())
+
+    def _getNodeText(self, node):
+        return node.getName()
+
+    def _getBoxColor(self, nodeInfo, statusColor, node):
+        return statusColor
+
+
+class TestRunsGraphUpdate(BaseTest):
+    """ Check the incremental update of the runs graph,
+    this does not need a display.
+    """
+    def _createGraph(self, view, statuses, childs=None):
+        graph = Graph(rootName='PROJECT')
+        for i, status in enumerate(statuses):
+            node = graph.createNode('run%d' % (i + 1))
+            node.run = _Run(i + 1, status)
+            view.settings.nodes.setdefault(i + 1, _NodeInfo())
+            graph.getRoot().addChild(node)
+        graph.getRoot().run = None
+        view.settings.nodes.setdefault(0, _NodeInfo())
+        for parentName, childName in childs or []:
+            graph.getNode(parentName).addChild(graph.getNode(childName))
+        return graph
+
+    def _drawGraph(self, view, graph, canvas):
+        """ Simulate drawRunsGraph, creating an item per node. """
+        view.runsGraph = graph
+        for i, node in enumerate(graph.getNodes()):
+            node.item = _Item(i, node, view._getRunItemSignature(node, None))
+            canvas.boxes[i] = (10, 10, 20, 20)
+        view._drawnGraphKey = view._getRunsGraphKey(graph)
+
+    def test_isItemVisible(self):
+        canvas = _Canvas({1: (10, 10, 20, 20), 2: (200, 10, 220, 20)})
+        self.assertTrue(canvas.isItemVisible(_Item(1, None, None)))
+        self.assertFalse(canvas.isItemVisible(_Item(2, None, None)))
+        # Items without bounds (e.g. deleted) are not visible
+        self.assertFalse(canvas.isItemVisible(_Item(3, None, None)))
+
+    def test_graphKey(self):
+        view = _ProtocolsView(_Canvas({}))
+        graph = self._createGraph(view, ['finished', 'running'])
+        key = view._getRunsGraphKey(graph)
+        self.assertEqual(key, view._getRunsGraphKey(
+            self._createGraph(view, ['finished', 'failed'])))
+        # Changes in the nodes, children or expanded flags change the key
+        self.assertNotEqual(key, view._getRunsGraphKey(
+            self._createGraph(view, ['finished', 'running', 'launched'])))
+        self.assertNotEqual(key, view._getRunsGraphKey(
+            self._createGraph(view, ['finished', 'running'],
+                              childs=[('run1', 'run2')])))
+        view.settings.nodes[1].expanded = False
+        self.assertNotEqual(key, view._getRunsGraphKey(graph))
+        view.runsView = 1
+        view.settings.nodes[1].expanded = True
+        self.assertNotEqual(key, view._getRunsGraphKey(graph))
+        # Nodes without settings need a full redraw to create them
+        del view.settings.nodes[2]
+        self.assertIsNone(view._getRunsGraphKey(graph))
+
+    def test_updateRunItems(self):
+        canvas = _Canvas({})
+        view = _ProtocolsView(canvas)
+        self.assertFalse(view._updateRunItems(None))
+
+        oldGraph = self._createGraph(view, ['finished', 'running', 'running'])
+        self._drawGraph(view, oldGraph, canvas)
+        # The third box is outside the visible region
+        canvas.boxes[3] = (200, 10, 220, 20)
+
+        view.runsGraph = self._createGraph(view, ['finished', 'finished',
+                                                  'failed'])
+        self.assertTrue(view._updateRunItems(oldGraph))
+        # Items are moved to the new nodes, only the visible changed
+        # ones are painted
+        for node in view.runsGraph.getNodes():
+            self.assertIs(node, node.item.node)
+        self.assertEqual(['run2'], view.repainted)
+        self.assertEqual(['run3'], view._dirtyRunItems.keys())
+
+        # The pending item is painted when scrolled into view
+        canvas.boxes[3] = (10, 30, 20, 40)
+        view._paintVisibleRunItems()
+        self.assertEqual(['run2', 'run3'], view.repainted)
+        self.assertFalse(view._dirtyRunItems)
+
+        # A different structure needs a full redraw
+        oldGraph = view.runsGraph
+        view.runsGraph = self._createGraph(view, ['finished', 'finished',
+                                                  'failed', 'launched'])
+        self.assertFalse(view._updateRunItems(oldGraph))
+
+    def test_drawRunsGraph(self):
+        canvas = _Canvas({})
+        view = _ProtocolsView(canvas)
+        view.runsGraph = self._createGraph(view, ['finished', 'running',
+                                                  'running'])
+        # The third box is outside the visible region
+        view.settings.nodes[3].x = 200
+
+        getStatusColorFromNode = viewprotocols.getStatusColorFromNode
+        RunBox = viewprotocols.RunBox
+        try:
+            viewprotocols.getStatusColorFromNode = lambda node: 'blue'
+            viewprotocols.RunBox = _RunBox
+            view.drawRunsGraph()
+        finally:
+            viewprotocols.getStatusColorFromNode = getStatusColorFromNode
+            viewprotocols.RunBox = RunBox
+
+        # A full redraw only paints the visible boxes
+        self.assertEqual(['PROJECT', 'run1', 'run2'], sorted(view.repainted))
+        self.assertEqual(['run3'], view._dirtyRunItems.keys())
+        self.assertIsNotNone(view._drawnGraphKey)
+
+        canvas.boxes[3] = (10, 30, 20, 40)
+        view._paintVisibleRunItems()
+        self.assertIn('run3', view.repainted)
+        self.assertFalse(view._dirtyRunItems)
@@ -28,10 +28,12 @@
 import os
 import os.path
 import unittest
+import sqlite3
 from pyworkflow.mapper import *
 from pyworkflow.object import *
 from pyworkflow.config import *
-from pyworkflow.em.data import Acquisition, SetOfImages, Image
+from pyworkflow.em.data import (Acquisition, SetOfImages, Image, Particle,
+                                 CTFModel, Coordinate)
 from pyworkflow.tests import *
 import pyworkflow.dataset as ds
 import pyworkflow.utils as pwutils
@@ -272,6 +274,133 @@ class TestSqliteMapper(BaseTest):
         self.assertTrue(Integer(3) in iList3)
 
         
+    def test_differentialUpdate(self):
+        """ Check that only modified objects are written when updating. """
+        fn = self.getOutputPath("differential.sqlite")
+        mapper = SqliteMapper(fn, globals())
+
+        iList = List()
+        for i in range(10):
+            iList.append(Integer(i))
+        c = Complex.createComplex()
+        iList.append(c)
+        mapper.store(iList)
+        # The list, 10 integers, the complex and its 2 attributes
+        self.assertEqual(14, mapper.getRowsWritten())
+
+        mapper.store(iList)
+        self.assertEqual(0, mapper.getRowsWritten())
+
+        iList[3].set(30)
+        c.imag.set(5.)
+        mapper.store(iList)
+        self.assertEqual(2, mapper.getRowsWritten())
+
+        # Removed items should be deleted with their children
+        iList.remove(c)
+        mapper.store(iList)
+        self.assertEqual(3, mapper.getRowsWritten())
+        mapper.commit()
+
+        # Objects loaded from the db are written the first time
+        mapper2 = SqliteMapper(fn, globals())
+        iList2 = mapper2.selectByClass('List')[0]
+        self.assertEqual(10, iList2.getSize())
+        self.assertEqual(30, iList2[3].get())
+        self.assertEqual(0, len(mapper2.selectByClass('Complex')))
+        mapper2.store(iList2)
+        self.assertEqual(11, mapper2.getRowsWritten())
+        mapper2.store(iList2)
+        self.assertEqual(0, mapper2.getRowsWritten())
+
+    def test_dataVersion(self):
+        """ Check that commits from other connections are detected. """
+        fn = self.getOutputPath("version.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        i = Integer(1)
+        mapper.store(i)
+        mapper.commit()
+        version = mapper.getDataVersion()
+        counter = mapper.db._getFileChangeCounter()
+        self.assertEqual(version, mapper.getDataVersion())
+
+        conn = sqlite3.connect(fn)
+        conn.execute("UPDATE Objects SET value='2' WHERE id=%d"
+                     % i.getObjId())
+        conn.commit()
+        conn.close()
+        self.assertNotEqual(version, mapper.getDataVersion())
+        # Used with the SQLite versions without PRAGMA data_version
+        self.assertNotEqual(counter, mapper.db._getFileChangeCounter())
+        mapper.close()
+
+    def test_dataVersionFileCounter(self):
+        """ Check the detection of other connections commits with the
+        file change counter, used if PRAGMA data_version is not available.
+        """
+        fn = self.getOutputPath("version_counter.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        # Use the file change counter as with SQLite < 3.8.8
+        db = mapper.db
+        db._hasDataVersion = False
+        db._fileCounter = db._getFileChangeCounter()
+        db._otherChanges = 0
+        db.commit = db._commitFileCounter
+
+        iList = List()
+        for i in range(10):
+            iList.append(Integer(i))
+        mapper.store(iList)
+        mapper.commit()
+        version = mapper.getDataVersion()[0]
+
+        # Our own commits are not changes of other connections, so the
+        # rows stored by the mapper are still used
+        iList[0].set(100)
+        mapper.store(iList)
+        self.assertEqual(1, mapper.getRowsWritten())
+        mapper.commit()
+        self.assertEqual(version, mapper.getDataVersion()[0])
+        mapper.store(iList)
+        self.assertEqual(0, mapper.getRowsWritten())
+
+        conn = sqlite3.connect(fn)
+        conn.execute("UPDATE Objects SET value='2' WHERE id=%d"
+                     % iList[1].getObjId())
+        conn.commit()
+        conn.close()
+        self.assertNotEqual(version, mapper.getDataVersion()[0])
+        mapper.close()
+
+    def test_differentialUpdateOtherWriter(self):
+        """ Check that rows modified by another writer are written again. """
+        fn = self.getOutputPath("differential_writers.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        iList = List()
+        iList.append(Integer(1))
+        iList.append(String('scheduled'))
+        mapper.store(iList)
+        mapper.commit()
+
+        mapper2 = SqliteMapper(fn, globals())
+        iList2 = mapper2.selectByClass('List')[0]
+        iList2[1].set('failed')
+        iList2.append(Integer(3))
+        mapper2.store(iList2)
+        mapper2.commit()
+
+        # The status and the new item are not known by the first mapper
+        iList[1].set('scheduled')
+        mapper.store(iList)
+        self.assertEqual(4, mapper.getRowsWritten())
+        mapper.commit()
+        iList3 = SqliteMapper(fn, globals()).selectByClass('List')[0]
+        self.assertEqual(2, iList3.getSize())
+        self.assertEqual('scheduled', iList3[1].get())
+        mapper.close()
+        mapper2.close()
+
+
 class TestSqliteFlatMapper(BaseTest):
     """ Some tests for DataSet implementation. """
     _labels = [SMALL]
@@ -377,6 +506,290 @@ class TestSqliteFlatMapper(BaseTest):
         items = [obj.clone() for obj in objSet]
         self.assertEqual(len(items), 0)
 
+    def test_appendMany(self):
+        """ Check that Set.appendMany stores the same items as Set.append.
+        The insertion rates are compared in benchmark_append_many.py
+        """
+        n = 1000
+
+        def iterParticles():
+            # Reuse the same particle, as done in most protocols
+            part = Particle()
+            part.setCTF(CTFModel(defocusU=10000, defocusV=15000,
+                                 defocusAngle=15))
+            part.setCoordinate(Coordinate())
+            part.setAcquisition(Acquisition(voltage=300,
+                                            sphericalAberration=2.0,
+                                            amplitudeContrast=0.1,
+                                            magnification=60000))
+            for i in range(1, n+1):
+                part.setObjId(None)
+                part.setLocation(i, 'particles.stk')
+                part.getCoordinate().setPosition(i, 2*i)
+                part.setMicId(i % 100)
+                yield part
+
+        for useMany in [False, True]:
+            dbName = self.getOutputPath('particles%s.sqlite' % useMany)
+            print ">>> test_appendMany: dbName = '%s'" % dbName
+            partSet = Set(filename=dbName, classesDict=globals())
+            if useMany:
+                # Use small batches to check that all of them are written
+                partSet.appendMany(iterParticles(), batchSize=300)
+            else:
+                for part in iterParticles():
+                    partSet.append(part)
+            self.assertEqual(n, partSet.getSize())
+            partSet.write()
+            partSet.close()
+
+        # Both sets should contain exactly the same items
+        partSet1 = Set(filename=self.getOutputPath('particlesFalse.sqlite'),
+                       classesDict=globals())
+        partSet2 = Set(filename=self.getOutputPath('particlesTrue.sqlite'),
+                       classesDict=globals())
+        self.assertEqual(n, partSet2.getSize())
+        self.assertEqual(range(1, n+1), [p.getObjId() for p in partSet2])
+        self.assertTrue(partSet1.equalItemAttributes(partSet2))
+
+    def test_appendManyImages(self):
+        """ Check that appendMany sets the sampling rate and acquisition
+        of the SetOfImages to the items, and creates the indexes.
+        """
+        dbName = self.getOutputPath('appendManyImages.sqlite')
+        print ">>> test_appendManyImages: dbName = '%s'" % dbName
+        imgSet = SetOfImages(filename=dbName)
+        imgSet.setSamplingRate(2.0)
+        imgSet.setAcquisition(Acquisition(voltage=300, magnification=60000))
+        n = 10
+        imgs = [Image(location=(i, 'images.stk')) for i in range(1, n+1)]
+        # Images with their own acquisition should keep it
+        imgs[0].setAcquisition(Acquisition(voltage=200, magnification=50000))
+        imgSet.appendMany(imgs, batchSize=3)
+        self.assertEqual(n, imgSet.getSize())
+        imgSet.write()
+        self.assertEqual(['_filename'], imgSet._getMapper().db.getIndexes())
+        imgSet.close()
+
+        imgSet = SetOfImages(filename=dbName)
+        self.assertEqual(n, imgSet.getSize())
+        for i, img in enumerate(imgSet, 1):
+            self.assertEqual(i, img.getObjId())
+            self.assertEqual(2.0, img.getSamplingRate())
+            self.assertEqual(200 if i == 1 else 300,
+                             img.getAcquisition().getVoltage())
+        imgSet.close()
+
+    def test_iterColumns(self):
+        """ Check the column-projected iteration of sets. """
+        dbName = self.getOutputPath('columns.sqlite')
+        print ">>> test_iterColumns: dbName = '%s'" % dbName
+        imgSet = Set(filename=dbName, classesDict=globals())
+        n = 10
+        img = Image()
+        for i in range(1, n+1):
+            img.setObjId(None)
+            img.setLocation(i, 'images%d.stk' % (i % 2))
+            img.setSamplingRate(i * 0.5)
+            imgSet.append(img)
+        imgSet.write()
+
+        for i, img in enumerate(imgSet.iterItems(columns=['_index']), 1):
+            self.assertEqual(i, img.getObjId())
+            self.assertEqual(i, img.getIndex())
+            # Not requested attributes should not be filled
+            self.assertIsNone(img.getFileName())
+
+        # No columns means only the basic ones (id, enabled...)
+        for i, img in enumerate(imgSet.iterItems(columns=[]), 1):
+            self.assertEqual(i, img.getObjId())
+            self.assertIsNone(img.getFileName())
+            self.assertIsNone(img.getSamplingRate())
+
+        values = list(imgSet.iterValues(['id', '_filename', '_index'],
+                                        where="_filename='images1.stk'"))
+        self.assertEqual(n / 2, len(values))
+        self.assertEqual((3, 'images1.stk', 3), values[1])
+
+        arrays = list(imgSet.iterValues(['_index', '_samplingRate'],
+                                        orderBy='_index', direction='DESC',
+                                        chunkSize=4))
+        self.assertEqual([4, 4, 2], [len(a) for a in arrays])
+        self.assertEqual(n, arrays[0]['_index'][0])
+        self.assertAlmostEqual(n * 0.5, arrays[0]['_samplingRate'][0])
+        imgSet.close()
+
+    def test_iterItemsSince(self):
+        """ Check reading only the items appended since a given id. """
+        dbName = self.getOutputPath('since.sqlite')
+        print ">>> test_iterItemsSince: dbName = '%s'" % dbName
+        imgSet = Set(filename=dbName, classesDict=globals())
+        img = Image()
+        for i in range(1, 6):
+            img.setObjId(None)
+            img.setLocation(i, 'images.stk')
+            imgSet.append(img)
+        imgSet.write()
+
+        ids = [img.getObjId() for img in imgSet.iterItemsSince(0)]
+        self.assertEqual(range(1, 6), ids)
+
+        for i in range(6, 11):
+            img.setObjId(None)
+            img.setLocation(i, 'images.stk')
+            imgSet.append(img)
+        imgSet.write()
+
+        ids = [img.getIndex() for img in imgSet.iterItemsSince(ids[-1])]
+        self.assertEqual(range(6, 11), ids)
+        self.assertEqual([], list(imgSet.iterItemsSince(10)))
+        imgSet.close()
+
+    def test_columnArrays(self):
+        """ Check reading and updating whole columns as numpy arrays. """
+        dbName = self.getOutputPath('arrays.sqlite')
+        print ">>> test_columnArrays: dbName = '%s'" % dbName
+        imgSet = Set(filename=dbName, classesDict=globals())
+        n = 10
+        img = Image()
+        for i in range(1, n+1):
+            img.setObjId(None)
+            img.setLocation(i, 'images.stk')
+            img.setSamplingRate(i * 0.5)
+            imgSet.append(img)
+        imgSet.write()
+
+        ids = imgSet.getColumnArray('id')
+        sampling = imgSet.getColumnArray('_samplingRate', dtype=float)
+        self.assertEqual(range(1, n+1), ids.tolist())
+        self.assertAlmostEqual(n * 0.5, sampling.max())
+
+        recArray = imgSet.toRecordArray(['id', '_index', '_filename'])
+        self.assertEqual(n, len(recArray))
+        self.assertEqual(ids.tolist(), recArray['_index'].tolist())
+        self.assertEqual('images.stk', recArray['_filename'][0])
+
+        imgSet.updateColumnFromArray('_samplingRate', ids, sampling * 2)
+        imgSet.write()
+        imgSet.close()
+
+        imgSet = Set(filename=dbName, classesDict=globals())
+        for img in imgSet:
+            self.assertAlmostEqual(img.getObjId(), img.getSamplingRate())
+        imgSet.close()
+
+    def test_appendColumns(self):
+        """ Check appending items from columns of values. """
+        dbName = self.getOutputPath('appendColumns.sqlite')
+        print ">>> test_appendColumns: dbName = '%s'" % dbName
+        imgSet = Set(filename=dbName, classesDict=globals())
+        img = Image(location=(1, 'images.stk'))
+        img.setSamplingRate(2.0)
+        imgSet.append(img)
+        n = 5
+        imgSet.appendColumns(img, {'_index': range(2, n + 2),
+                                   'enabled': [True, False] * 2 + [True]})
+        imgSet.write()
+        imgSet.close()
+
+        imgSet = Set(filename=dbName, classesDict=globals())
+        self.assertEqual(n + 1, imgSet.getSize())
+        for i, img in enumerate(imgSet, 1):
+            self.assertEqual(i, img.getObjId())
+            self.assertEqual(i, img.getIndex())
+            self.assertEqual('images.stk', img.getFileName())
+            self.assertEqual(2.0, img.getSamplingRate())
+            self.assertEqual(i % 2 == 0 or i == 1, img.isEnabled())
+        imgSet.close()
+
+    def test_indexes(self):
+        """ Check declared indexes, ad hoc ones and the creation
+        of declared indexes in existing sets opened for writing.
+        """
+        dbName = self.getOutputPath('indexes.sqlite')
+        print ">>> test_indexes: dbName = '%s'" % dbName
+        imgSet = Set(filename=dbName, classesDict=globals())
+        for i in range(1, 11):
+            img = Image(location=(i, 'images%d.stk' % (i % 3)))
+            img.setSamplingRate(float(i))
+            imgSet.append(img)
+        imgSet.createIndex('_index')
+        imgSet.write()
+        self.assertEqual(['_index'], imgSet._getMapper().db.getIndexes())
+        imgSet.close()
+
+        # Set of images declare the _filename index, it should not be
+        # created by readers, only when the set is opened for writing
+        from pyworkflow.mapper.query import Column
+        imgSet = SetOfImages(filename=dbName)
+        db = imgSet._getMapper().db
+        self.assertEqual(['_index'], db.getIndexes())
+        self.assertEqual(4, len(list(imgSet.iterItems(
+            where='_filename="images1.stk"'))))
+        self.assertEqual(4, len(list(imgSet.iterItems(
+            where=Column('_filename') == 'images1.stk'))))
+        self.assertEqual(['_index'], db.getIndexes())
+        imgSet.enableAppend()
+        imgSet.write()
+        self.assertEqual(['_filename', '_index'], sorted(db.getIndexes()))
+        imgSet.close()
+
+        # New sets should create the declared indexes with the tables
+        imgSet = SetOfImages(filename=self.getOutputPath('indexes2.sqlite'))
+        imgSet.append(Image(location=(1, 'images.stk')))
+        imgSet.write()
+        self.assertEqual(['_filename'], imgSet._getMapper().db.getIndexes())
+        imgSet.close()
+
+    def test_queryConditions(self):
+        """ Check filtering and ordering with Column conditions. """
+        from pyworkflow.mapper.query import Column
+        dbName = self.getOutputPath('query.sqlite')
+        print ">>> test_queryConditions: dbName = '%s'" % dbName
+        imgSet = Set(filename=dbName, classesDict=globals())
+        # Keep (id, index, filename, sampling, enabled) of each image
+        imgs = []
+        for i in range(1, 21):
+            img = Image(location=(i, 'images%d.stk' % (i % 3)))
+            img.setSamplingRate(float(i % 5))
+            img.setEnabled(i % 4 != 0)
+            imgSet.append(img)
+            imgs.append((i, i, 'images%d.stk' % (i % 3), i % 5, i % 4 != 0))
+        imgSet.write()
+
+        def check(expected, **kwargs):
+            ids = [img.getObjId() for img in imgSet.iterItems(**kwargs)]
+            self.assertEqual([i[0] for i in expected], ids)
+
+        index = Column('_index')
+        fn = Column('_filename')
+        sampling = Column('_samplingRate')
+        enabled = Column('enabled')
+
+        check([i for i in imgs if i[1] > 15], where=index > 15)
+        check([i for i in imgs if i[1] in [2, 30, 7]],
+              where=index.isIn([2, 30, 7]))
+        check([i for i in imgs if 3 <= i[1] <= 6], where=index.between(3, 6))
+        check([i for i in imgs if i[2] == 'images1.stk' or
+               (i[3] == 2 and i[4])],
+              where=(fn == 'images1.stk') | ((sampling == 2.0) & (enabled == 1)))
+        check([i for i in imgs if i[2] != 'images1.stk' and not i[4]],
+              where=~(fn == 'images1.stk') & (enabled == False))
+        check([], where=index.isIn([]))
+        check(imgs, where=index.notIn([]))
+
+        # Multi-column ordering, with limit and offset
+        expected = sorted(imgs, key=lambda i: (-i[3], i[1]))
+        check(expected, orderBy=[sampling.desc(), '_index'])
+        check(expected[5:9], orderBy=[sampling.desc(), index.asc()],
+              limit=4, offset=5)
+        check(expected[16:], orderBy=[sampling.desc(), index], offset=16)
+        self.assertEqual([(4, 'images1.stk')],
+                         list(imgSet.iterValues(['_index', '_filename'],
+                                                where=fn == 'images1.stk',
+                                                limit=1, offset=1)))
+        imgSet.close()
+
 
 class TestXmlMapper(BaseTest):
     
@@ -322,6 +322,38 @@ class TestObject(BaseTest):
 
         # Return true for any 'contains' query
         self.assertTrue(100 in d)
+
+    def test_compactStorage(self):
+        """ Check that basic properties are stored in __slots__ and
+        that attributes order and pickling keep working.
+        """
+        import cPickle as pickle
+        i = Integer(5, objLabel='five')
+        self.assertEqual({}, Integer(5).__dict__)
+        self.assertEqual('five', i.getObjLabel())
+        self.assertEqual('', Integer(5).getObjLabel())
+
+        p1 = Particle(location=(1, 'particles.mrcs'))
+        p1.setCTF(CTFModel(defocusU=1000))
+        p1.setObjId(10)
+        p2 = p1.clone()
+        # Instances of the same class share the attributes names
+        self.assertIs(Particle()._attributes, Particle()._attributes)
+        self.assertIs(p1._attributes, p2._attributes)
+        self.assertEqual([k for k, _ in p1.getAttributes()],
+                         [k for k, _ in p2.getAttributes()])
+        self.assertEqual('_ctfModel', list(p2._attributes)[-1])
+
+        for protocol in [0, 2]:
+            p3 = pickle.loads(pickle.dumps(p2, protocol))
+            self.assertEqual(10, p3.getObjId())
+            self.assertEqual(1000, p3.getCTF().getDefocusU())
+            self.assertEqual(p1.getObjDict(), p3.getObjDict())
+            self.assertIs(p1._attributes, p3._attributes)
+
+        p2.deleteAttribute('_ctfModel')
+        self.assertFalse(hasattr(p2, '_ctfModel'))
+        self.assertEqual(list(p1._attributes)[:-1], list(p2._attributes))
         
 
 class TestUtils(BaseTest):
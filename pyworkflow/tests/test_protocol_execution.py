@@ -24,13 +24,22 @@
 # *
 # **************************************************************************
 
+import os
+import time
+
 from pyworkflow.object import *
 from pyworkflow.em import *
 from tests import *
+import pyworkflow.utils as pwutils
 from pyworkflow.mapper import SqliteMapper
 from pyworkflow.utils import dateStr
-from pyworkflow.protocol.constants import MODE_RESUME, STATUS_FINISHED
-from pyworkflow.protocol.executor import StepExecutor
+from pyworkflow.protocol.constants import (MODE_RESUME, STATUS_FINISHED,
+                                           STATUS_FAILED, STATUS_RUNNING,
+                                           STATUS_LAUNCHED, STATUS_SCHEDULED)
+from pyworkflow.protocol.executor import (StepExecutor, ThreadStepExecutor,
+                                          ProcessStepExecutor,
+                                          getProcessGpuList)
+from pyworkflow.protocol import Step, FunctionStep
 
     
 #Protocol for tests, runs in resume mode, and sleeps for??
@@ -65,6 +74,51 @@ class MyParallelProtocol(MyProtocol):
         for i in range(n):
             self._insertFunctionStep('sleepStep')
     
+
+
+class MyProcessProtocol(MyProtocol):
+    """ Protocol whose pidStep can be run by a ProcessStepExecutor. """
+    _processSteps = ['pidStep']
+
+    def _getProcessStepState(self, funcName, funcArgs):
+        return {'tag': self.tag}
+
+    def pidStep(self, fn):
+        f = open(fn, 'w')
+        f.write("%d %s %s" % (os.getpid(), self.tag,
+                              self._stepsExecutor.getGpuList()))
+        f.close()
+        return [fn]
+
+
+class MyResumeProtocol(MyProtocol):
+    """ Protocol with 4 steps where the step failAt fails. """
+    def __init__(self, **args):
+        MyProtocol.__init__(self, **args)
+        self.failAt = Integer(args.get('failAt', 0))
+
+    def doneStep(self, i):
+        f = open(self._getPath('done.txt'), 'a')
+        f.write("%d\n" % i)
+        f.close()
+        if i == self.failAt:
+            raise Exception("Step %d failed" % i)
+
+    def getDoneSteps(self):
+        return open(self._getPath('done.txt')).read().split()
+
+    def _insertAllSteps(self):
+        for i in range(1, 5):
+            self._insertFunctionStep('doneStep', i)
+
+
+def gpuStep(fn):
+    """ Module function that can be executed by a ProcessStepExecutor. """
+    f = open(fn, 'w')
+    f.write("%d %s" % (os.getpid(), getProcessGpuList()))
+    f.close()
+    return [fn]
+
             
 # TODO: this test seems not to be finished.
 class TestProtocolExecution(BaseTest):
@@ -87,3 +141,300 @@ class TestProtocolExecution(BaseTest):
         prot2 = mapper2.selectById(prot.getObjId())
         
         self.assertEqual(prot.endTime.get(), prot2.endTime.get())
+
+    def test_upToDate(self):
+        """ A run.db modified in the same mtime tick of the last load
+        should not be considered up to date.
+        """
+        from pyworkflow.protocol import (isProtocolUpToDate,
+                                         setProtocolLoadTime, DB_MTIME_MARGIN)
+        prot = MyProtocol(workingDir=self.getOutputPath('uptodate'))
+        prot.makePathsAndClean()
+        dbPath = prot.getDbPath()
+        open(dbPath, 'w').close()
+        self.assertFalse(isProtocolUpToDate(prot))
+
+        def load(loadTime):
+            dbTS = pwutils.getFileLastModificationDate(dbPath)
+            prot.lastUpdateTimeStamp.set(dbTS)
+            setProtocolLoadTime(prot, dbTS, loadTime)
+
+        # Loaded just after the mtime was seen, it could be written again
+        now = time.time()
+        load(now)
+        self.assertFalse(isProtocolUpToDate(prot))
+        # Loaded again once the mtime tick is over
+        load(now + DB_MTIME_MARGIN + 1)
+        self.assertTrue(isProtocolUpToDate(prot))
+
+        mtime = os.path.getmtime(dbPath) + 10
+        os.utime(dbPath, (mtime, mtime))
+        self.assertFalse(isProtocolUpToDate(prot))
+
+
+class TestStepsStorage(BaseTest):
+    """ Check that steps are stored incrementally. The cost of updating
+    the steps is measured in scripts/benchmark_steps_storage.py
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _createProtocol(self, name):
+        prot = MyProtocol(n=0, workingDir=self.getOutputPath(name))
+        prot.makePathsAndClean()
+        return prot
+
+    def _poll(self, prot, newSteps):
+        """ Simulate a streaming check: insert some steps and make
+        the join step (the first one) depends on them.
+        """
+        deps = [prot._insertFunctionStep('sleepStep', 0, 'new')
+                for _ in range(newSteps)]
+        prot._steps[0].addPrerequisites(*deps)
+        prot.updateSteps()
+
+    def test_updateSteps(self):
+        prot = self._createProtocol('incremental')
+        prot._insertFunctionStep('sleepStep', 0, 'join')
+        prot.updateSteps()
+
+        for i in range(10):
+            self._poll(prot, 10)
+
+        prevSteps = prot.loadSteps()
+        self.assertEqual(len(prot._steps), len(prevSteps))
+        self.assertEqual(prot.numberOfSteps, len(prevSteps))
+        for step, prevStep in zip(prot._steps, prevSteps):
+            self.assertEqual(step.getObjId(), prevStep.getObjId())
+            self.assertEqual(step, prevStep)
+        self.assertEqual(100, len(prevSteps[0].getPrerequisites()))
+
+    def test_onlyNewStepsWritten(self):
+        prot = self._createProtocol('written')
+        for i in range(5):
+            prot._insertFunctionStep('sleepStep', 0, 'step %d' % i)
+        prot.updateSteps()
+
+        appended = []
+        updated = []
+        stepsSet = prot._stepsSet
+        appendFunc, updateFunc = stepsSet.append, stepsSet.update
+        stepsSet.append = lambda s: appended.append(s) or appendFunc(s)
+        stepsSet.update = lambda s: updated.append(s) or updateFunc(s)
+
+        # Only the new steps and the join step should be written
+        self._poll(prot, 3)
+        self.assertEqual(prot._steps[5:], appended)
+        self.assertEqual([prot._steps[0]], updated)
+
+        # Nothing changed, nothing should be written
+        del appended[:], updated[:]
+        prot.updateSteps()
+        self.assertEqual([], appended)
+        self.assertEqual([], updated)
+
+        # Steps that do not change are not written again
+        prot._insertFunctionStep('sleepStep', 0, 'last')
+        prot.updateSteps()
+        self.assertEqual([prot._steps[-1]], appended)
+        self.assertEqual([], updated)
+        self.assertEqual(9, len(prot.loadSteps()))
+
+    def test_resume(self):
+        fn = self.getOutputPath('resume.sqlite')
+        workingDir = self.getOutputPath('resume')
+        prot = MyResumeProtocol(mapper=SqliteMapper(fn, globals()),
+                                workingDir=workingDir, failAt=3)
+        prot._stepsExecutor = StepExecutor(hostConfig=None)
+        prot.run()
+        self.assertTrue(prot.isFailed())
+        self.assertEqual(['1', '2', '3'], prot.getDoneSteps())
+
+        # Finished steps are committed when a step fails, so a new
+        # execution should start at the failed one
+        prot2 = MyResumeProtocol(mapper=SqliteMapper(fn, globals()),
+                                 workingDir=workingDir, failAt=0)
+        prot2._stepsExecutor = StepExecutor(hostConfig=None)
+        prot2.run()
+        self.assertTrue(prot2.isFinished())
+        self.assertEqual(['1', '2', '3', '3', '4'], prot2.getDoneSteps())
+        for step in prot2.loadSteps():
+            self.assertEqual(step.getStatus(), STATUS_FINISHED)
+
+
+class TestStepsExecutors(BaseTest):
+    """ Check that the executors respect the steps dependencies.
+    The scheduling overhead is measured in
+    scripts/benchmark_steps_scheduler.py
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _createSteps(self, n):
+        """ Create n steps forming a binary tree of dependencies. """
+        steps = []
+        for i in range(1, n+1):
+            step = Step()
+            step.setIndex(i)
+            if i > 1:
+                step.addPrerequisites(i/2)
+            steps.append(step)
+        return steps
+
+    def _runSteps(self, executor, n):
+        steps = self._createSteps(n)
+        started = []
+        finished = []
+        executor.runSteps(steps, started.append,
+                          lambda step: finished.append(step) or True,
+                          lambda: None)
+
+        self.assertEqual(n, len(started))
+        self.assertEqual(n, len(finished))
+        order = dict((step.getIndex(), i) for i, step in enumerate(finished))
+        for step in steps:
+            self.assertEqual(step.getStatus(), STATUS_FINISHED)
+            for p in step.getPrerequisites():
+                self.assertTrue(order[int(p)] < order[step.getIndex()])
+
+    def test_runSteps(self):
+        self._runSteps(StepExecutor(hostConfig=None), 100)
+        self._runSteps(ThreadStepExecutor(None, 4), 100)
+
+    def test_ProcessStepExecutor(self):
+        prot = MyProcessProtocol(workingDir=self.getOutputPath(''))
+        executor = ProcessStepExecutor(None, 2, gpuList=[0, 1])
+        prot.setStepsExecutor(executor)
+        # Steps not listed in _processSteps should run in threads
+        for i in range(2):
+            prot._insertFunctionStep('sleepStep', 0, '', prerequisites=[])
+        pidFn = lambda i: self.getOutputPath('pid_%02d.txt' % i)
+        prot.tag = 'first'
+        for i in range(4):
+            prot._insertFunctionStep('pidStep', pidFn(i), prerequisites=[])
+        # Pickable module functions should run in the pool too
+        gpuFn = self.getOutputPath('gpu.txt')
+        step = FunctionStep(gpuStep, 'gpuStep', gpuFn)
+        prot._steps.append(step)
+        step.setIndex(len(prot._steps))
+        firstSteps = list(prot._steps)
+
+        pools = set()
+
+        def stepsCheck():
+            pools.add(executor.pool)
+            # Simulate streaming: new steps that need the current state
+            if (prot.tag == 'first' and
+                    all(s.isFinished() for s in firstSteps)):
+                prot.tag = 'second'
+                for i in range(4, 6):
+                    prot._insertFunctionStep('pidStep', pidFn(i),
+                                             prerequisites=[])
+
+        executor.runSteps(prot._steps, lambda step: None, lambda step: True,
+                          stepsCheck, stepsCheckSecs=0)
+
+        self.assertEqual(9, len(prot._steps))
+        for step in prot._steps:
+            self.assertEqual(step.getStatus(), STATUS_FINISHED)
+        pids = set()
+        for i in range(6):
+            pid, tag, gpu = open(pidFn(i)).read().split(' ', 2)
+            self.assertNotEqual(int(pid), os.getpid())
+            self.assertEqual('first' if i < 4 else 'second', tag)
+            self.assertTrue(gpu in ['[0]', '[1]'])
+            pids.add(int(pid))
+        # The same pool (of 2 processes) is used for the new steps
+        self.assertEqual(1, len(pools))
+        self.assertTrue(len(pids) <= 2)
+        pid, gpu = open(gpuFn).read().split(' ', 1)
+        self.assertNotEqual(int(pid), os.getpid())
+
+
+class SchedulerProject(object):
+    """ Project with the methods used by the ProjectScheduler. """
+    def __init__(self, runs):
+        self.runs = runs
+        self.launched = []
+
+    def getRunsGraph(self):
+        from pyworkflow.utils.graph import Graph
+        graph = Graph()
+        for r in self.runs:
+            node = graph.createNode(str(r.getObjId()))
+            node.run = r
+            graph.getRoot().addChild(node)
+        return graph
+
+    def launchProtocol(self, protocol, scheduled=False):
+        protocol.setStatus(STATUS_LAUNCHED)
+        self.launched.append(protocol.getObjId())
+
+
+class TestProjectScheduler(BaseTest):
+    """ Check which scheduled runs are launched by the ProjectScheduler. """
+
+    def _createScheduler(self, maxRuns):
+        from argparse import Namespace
+        from StringIO import StringIO
+        from pyworkflow.apps.pw_schedule_run import ProjectScheduler
+        scheduler = ProjectScheduler()
+        scheduler._args = Namespace(maxRuns=maxRuns)
+        scheduler._logFile = StringIO()
+        return scheduler
+
+    def _createRun(self, protId, status, *prerequisites):
+        prot = Protocol()
+        prot.setObjId(protId)
+        prot.setStatus(status)
+        prot.addPrerequisites(*prerequisites)
+        return prot
+
+    def test_ready(self):
+        project = SchedulerProject([
+            self._createRun(1, STATUS_FINISHED),
+            self._createRun(2, STATUS_SCHEDULED),
+            self._createRun(3, STATUS_SCHEDULED, 1)])
+        scheduler = self._createScheduler(maxRuns=0)
+        self.assertEqual(0, scheduler._schedule(project))
+        self.assertEqual([2, 3], project.launched)
+
+    def test_prerequisitesPending(self):
+        runs = [self._createRun(1, STATUS_RUNNING),
+                self._createRun(2, STATUS_SCHEDULED, 1),
+                self._createRun(3, STATUS_SCHEDULED, 2)]
+        project = SchedulerProject(runs)
+        scheduler = self._createScheduler(maxRuns=0)
+        self.assertEqual(2, scheduler._schedule(project))
+        self.assertEqual([], project.launched)
+
+        # Failed prerequisites also let the dependent runs go
+        runs[0].setStatus(STATUS_FAILED)
+        self.assertEqual(1, scheduler._schedule(project))
+        self.assertEqual([2], project.launched)
+
+        runs[1].setStatus(STATUS_FINISHED)
+        self.assertEqual(0, scheduler._schedule(project))
+        self.assertEqual([2, 3], project.launched)
+
+    def test_maxRuns(self):
+        runs = [self._createRun(1, STATUS_RUNNING),
+                self._createRun(2, STATUS_SCHEDULED),
+                self._createRun(3, STATUS_SCHEDULED),
+                self._createRun(4, STATUS_SCHEDULED)]
+        project = SchedulerProject(runs)
+        scheduler = self._createScheduler(maxRuns=2)
+        self.assertEqual(2, scheduler._schedule(project))
+        self.assertEqual([2], project.launched)
+
+        # No room until one of the active runs finishes
+        self.assertEqual(2, scheduler._schedule(project))
+        self.assertEqual([2], project.launched)
+
+        runs[0].setStatus(STATUS_FINISHED)
+        self.assertEqual(1, scheduler._schedule(project))
+        self.assertEqual([2, 3], project.launched)
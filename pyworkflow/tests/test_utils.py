@@ -97,5 +97,234 @@ class TestGetListFromRangeString(BaseTest):
             self.assertEqual(o, pwutils.getListFromRangeString(s2))
 
 
+class TestLazyClassDict(BaseTest):
+
+    def test_lazyLoading(self):
+        from pyworkflow.utils.reflection import LazyClassDict
+        loaded = []
+
+        def loader(key):
+            loaded.append(key)
+            if key == 'error':  # e.g. the package could not be imported
+                return {}
+            return {'A%s' % key: int, 'B%s' % key: float}
+
+        d = LazyClassDict()
+        for key in ['1', '2']:
+            d.addLazy('A%s' % key, loader, key)
+            d.addLazy('B%s' % key, loader, key)
+        d['C'] = str
+
+        self.assertEqual(5, len(d))
+        self.assertEqual([], loaded)
+        self.assertFalse('A3' in d)
+        self.assertTrue('C' in d)
+        self.assertEqual([], loaded)
+        # Loading one class should resolve all from the same key
+        self.assertTrue('A1' in d)
+        self.assertEqual(['1'], loaded)
+        self.assertEqual(float, d['B1'])
+        self.assertEqual(int, d['A1'])
+        self.assertEqual(['1'], loaded)
+
+        # Classes that the loader does not provide are not in the dict
+        d.addLazy('E', loader, 'error')
+        self.assertFalse('E' in d)
+        self.assertIsNone(d.get('E'))
+        self.assertRaises(KeyError, d.__getitem__, 'E')
+
+        # Merging with other lazy dicts should not load anything
+        d2 = LazyClassDict(default=object)
+        d2.update(d)
+        self.assertEqual(['1', 'error'], loaded)
+        self.assertEqual(object, d2['D'])
+        self.assertIsNone(d2.get('D'))
+        self.assertEqual(int, d2['A2'])
+        self.assertEqual(['1', 'error', '2'], loaded)
+        self.assertEqual(set(['A1', 'B1', 'A2', 'B2', 'C']), set(d.keys()))
+
+
+class TestEmRegistry(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_packagesCache(self):
+        import pyworkflow.em as em
+        signatures = {'pkgA': '1', 'pkgB': '1'}
+        found = []
+
+        def findClasses(pkgName):
+            found.append(pkgName)
+            if pkgName == 'pkgB':
+                return None  # import failed
+            return {'protocols': {'ProtA': ['pkgA', [], []]}}
+
+        def getRegistry():
+            em._emRegistry = None
+            return em.getRegistry()
+
+        backup = (em.REGISTRY_FILE, em._getPackageNames,
+                  em._getPackageSignature, em._findPackageClasses,
+                  em._emRegistry)
+        em.REGISTRY_FILE = self.getOutputPath('em_registry.json')
+        em._getPackageNames = lambda: sorted(signatures)
+        em._getPackageSignature = lambda pkgName: signatures[pkgName]
+        em._findPackageClasses = findClasses
+
+        try:
+            registry = getRegistry()
+            self.assertEqual(['pkgA', 'pkgB'], found)
+            self.assertEqual({'ProtA': ['pkgA', [], []]},
+                             registry['protocols'])
+            # Nothing changed, no package should be imported again,
+            # even if one of them failed
+            registry = getRegistry()
+            self.assertEqual(['pkgA', 'pkgB'], found)
+            self.assertEqual(['ProtA'], registry['protocols'].keys())
+            # Only the modified package is tried again
+            signatures['pkgB'] = '2'
+            getRegistry()
+            self.assertEqual(['pkgA', 'pkgB', 'pkgB'], found)
+        finally:
+            (em.REGISTRY_FILE, em._getPackageNames, em._getPackageSignature,
+             em._findPackageClasses, em._emRegistry) = backup
+
+
+class TestFileCache(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_cache(self):
+        from pyworkflow.utils.cache import FileCache
+        created = []
+
+        def createFile(sourceFile, outputFile, size=10):
+            created.append((sourceFile, size))
+            with open(outputFile, 'w') as f:
+                f.write('x' * size)
+
+        sourceFile = self.getOutputPath('source.txt')
+        with open(sourceFile, 'w') as f:
+            f.write('source')
+
+        cache = FileCache(self.getOutputPath('cache'), maxSize=25,
+                          extension='.txt')
+        fn1 = cache.get(sourceFile, createFile)
+        self.assertTrue(os.path.exists(fn1))
+        self.assertEqual(fn1, cache.get(sourceFile, createFile))
+        self.assertEqual(1, len(created))
+
+        # Other arguments should generate a different file
+        fn2 = cache.get(sourceFile, createFile, size=12)
+        self.assertNotEqual(fn1, fn2)
+        self.assertEqual(2, len(created))
+
+        # If the source file changes, the file is generated again
+        os.utime(sourceFile, (time.time() + 10, time.time() + 10))
+        fn3 = cache.get(sourceFile, createFile)
+        self.assertNotEqual(fn1, fn3)
+        self.assertEqual(3, len(created))
+        # The least recently used file was removed (size > 25)
+        self.assertFalse(os.path.exists(fn1))
+        self.assertEqual([fn2, fn3], cache.getFiles())
+
+        # Errors do not leave any file in the cache
+        def createError(sourceFile, outputFile, **kwargs):
+            open(outputFile, 'w').close()
+            raise Exception('error')
+
+        files = os.listdir(self.getOutputPath('cache'))
+        self.assertRaises(Exception, cache.get, sourceFile, createError,
+                          size=20)
+        self.assertEqual(files, os.listdir(self.getOutputPath('cache')))
+
+
+class TestFileScanner(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_scan(self):
+        from glob import glob
+        from pyworkflow.utils.file_scanner import FileScanner
+
+        def createFiles(*paths):
+            for p in paths:
+                fn = self.getOutputPath(p)
+                pwutils.makeFilePath(fn)
+                open(fn, 'w').close()
+
+        createFiles('a/Movies/1.tif', 'b/Movies/2.tif', 'b/Movies/2.mrc',
+                    '.hidden/Movies/3.tif', 'a/4.tif')
+        pattern = self.getOutputPath('*', 'Movies', '*.tif')
+        scanner = FileScanner(pattern)
+        self.assertEqual(sorted(glob(pattern)), scanner.scan())
+        self.assertEqual([], scanner.scan())
+
+        # Only the changed directories should be listed again
+        scanner.MTIME_MARGIN = -1
+        listed = []
+        listDir = scanner._listDir
+        scanner._listDir = lambda path, *args: (listed.append(path) or
+                                                listDir(path, *args))
+        createFiles('b/Movies/5.tif', 'c/Movies/6.tif')
+        if scanner.hasInotify():
+            self.assertTrue(scanner.wait(5))
+        self.assertEqual([self.getOutputPath('b/Movies/5.tif'),
+                          self.getOutputPath('c/Movies/6.tif')],
+                         scanner.scan())
+        self.assertEqual(sorted(glob(pattern)), scanner.getFiles())
+        self.assertEqual(sorted([self.getOutputPath(),
+                                 self.getOutputPath('b/Movies'),
+                                 self.getOutputPath('c'),
+                                 self.getOutputPath('c/Movies')]),
+                         sorted(listed))
+        scanner.close()
+
+    def test_serverClock(self):
+        """ Files created in the same mtime tick of a directory should be
+        found, even if the clock of the file server is behind.
+        """
+        from pyworkflow.utils.file_scanner import FileScanner
+        moviesDir = self.getOutputPath('clock')
+        pwutils.makePath(moviesDir)
+        serverTime = time.time() - 3600
+
+        def createFile(name):
+            open(join(moviesDir, name), 'w').close()
+            os.utime(moviesDir, (serverTime, serverTime))
+
+        createFile('1.tif')
+        scanner = FileScanner(join(moviesDir, '*.tif'), useInotify=False)
+        self.assertEqual([join(moviesDir, '1.tif')], scanner.scan())
+        createFile('2.tif')
+        self.assertEqual([join(moviesDir, '2.tif')], scanner.scan())
+        scanner.close()
+
+
+class TestFileChecksum(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_checksum(self):
+        import hashlib
+        fn = self.getOutputPath('data.bin')
+        data = os.urandom(100000)
+        with open(fn, 'wb') as f:
+            f.write(data)
+
+        self.assertEqual(hashlib.md5(data).hexdigest(),
+                         pwutils.getFileChecksum(fn, blockSize=4096))
+        self.assertEqual(hashlib.sha1(data).hexdigest(),
+                         pwutils.getFileChecksum(fn, 'sha1'))
+
+
 if __name__ == '__main__':
     unittest.main()        
@@ -0,0 +1,133 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module contains a cache of files generated from other files,
+for example, sqlite files converted from STAR files.
+"""
+
+import os
+import hashlib
+import threading
+from os.path import join, exists, getmtime, getsize, abspath
+
+from path import makePath, cleanPath
+
+
+class FileCache(object):
+    """ Store files generated from a source file in a folder. Each cached
+    file is named after a key computed from the source file path, its
+    modification time and size, and the arguments used to generate it.
+    So, a cached file is reused until the source file changes.
+    When the total size of the folder is bigger than maxSize, the least
+    recently used files are removed.
+    """
+    # Locks are shared between instances, so the same file is not
+    # generated twice when using several caches on the same folder
+    # from different threads.
+    _locks = {}
+    _locksLock = threading.Lock()
+    _cleanLock = threading.Lock()
+
+    def __init__(self, path, maxSize=4 * 1024 ** 3, extension=''):
+        """
+        Params:
+            path: folder where the cached files will be stored.
+            maxSize: maximum size (in bytes) of all cached files.
+            extension: extension of the cached files (e.g. .sqlite)
+        """
+        self._path = path
+        self._maxSize = maxSize
+        self._extension = extension
+
+    def getKey(self, sourceFile, **kwargs):
+        """ Return the key of the file generated from sourceFile
+        with the given arguments.
+        """
+        st = os.stat(sourceFile)
+        keyStr = '%s %r %d %r' % (abspath(sourceFile), st.st_mtime,
+                                  st.st_size, sorted(kwargs.items()))
+        return hashlib.sha1(keyStr).hexdigest()
+
+    def getPath(self, key):
+        return join(self._path, key + self._extension)
+
+    def _getLock(self, key):
+        with self._locksLock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, sourceFile, createFunc, **kwargs):
+        """ Return the path of the file generated from sourceFile.
+        If it is not in the cache, it will be created by calling:
+            createFunc(sourceFile, outputFile, **kwargs)
+        """
+        key = self.getKey(sourceFile, **kwargs)
+        cachedFile = self.getPath(key)
+
+        with self._getLock(key):
+            if exists(cachedFile):
+                os.utime(cachedFile, None)  # mark as recently used
+                return cachedFile
+
+            with self._cleanLock:
+                makePath(self._path)
+            # Generate in a temporary file, so an incomplete file
+            # is never found in the cache
+            tmpFile = join(self._path, 'tmp%d_%s%s' % (os.getpid(), key,
+                                                       self._extension))
+            cleanPath(tmpFile)
+            try:
+                createFunc(sourceFile, tmpFile, **kwargs)
+                os.rename(tmpFile, cachedFile)
+            except:
+                cleanPath(tmpFile)
+                raise
+
+        self.clean(keep=cachedFile)
+
+        return cachedFile
+
+    def getFiles(self):
+        """ Return the cached files, the least recently used first. """
+        if not exists(self._path):
+            return []
+        files = [join(self._path, fn) for fn in os.listdir(self._path)
+                 if fn.endswith(self._extension) and not fn.startswith('tmp')]
+        return sorted(files, key=getmtime)
+
+    def clean(self, keep=None):
+        """ Remove the least recently used files until the total size
+        is not bigger than maxSize. The file keep is never removed.
+        """
+        with self._cleanLock:
+            files = self.getFiles()
+            size = sum(getsize(fn) for fn in files)
+
+            for fn in files:
+                if size <= self._maxSize:
+                    break
+                if fn != keep:
+                    size -= getsize(fn)
+                    cleanPath(fn)
@@ -0,0 +1,248 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module contains the FileScanner class, used to discover the files
+matching a glob pattern incrementally (e.g. when importing data in
+streaming from the microscope).
+"""
+
+import os
+import time
+import errno
+import select
+import fnmatch
+import ctypes
+import ctypes.util
+from glob import has_magic
+from os.path import join, isdir
+
+try:
+    from scandir import scandir  # Faster listing, if available
+except ImportError:
+    scandir = None
+
+
+# Constants from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def _loadInotify():
+    """ Return the libc library if inotify functions are available,
+    None otherwise (e.g. not running on Linux).
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+_libc = _loadInotify()
+
+
+class FileScanner(object):
+    """ Find the files matching a glob pattern and keep the state of
+    the scanned directories between scans. A directory is only listed
+    again when its modification time changes, so each new scan costs
+    a stat per directory instead of a full glob.
+
+    If inotify is available, it is used to wake up the waiting loop as
+    soon as a file is created in any of the directories. Inotify does
+    not report changes made from other hosts in network file systems,
+    so the directories are always scanned after the wait timeout.
+    """
+    # A directory listing is not trusted until it was done some seconds
+    # after its current mtime was first seen. Files created later in the
+    # same mtime tick (the resolution could be 1 second) would not
+    # change it. Only local times are compared, since the clock of a
+    # file server could be different from the local one.
+    MTIME_MARGIN = 2
+
+    def __init__(self, pattern, useInotify=True):
+        self._pattern = pattern
+        parts = pattern.split(os.sep)
+        n = 0
+        while n < len(parts) - 1 and not has_magic(parts[n]):
+            n += 1
+        self._root = os.sep.join(parts[:n])
+        if not self._root and pattern.startswith(os.sep):
+            self._root = os.sep
+        self._levels = parts[n:]
+        # Store (mtime, seenTime, listTime, names) for each scanned
+        # directory, where seenTime is when the mtime was first seen
+        self._dirs = {}
+        self._files = set()
+        self._fd = None
+        self._watched = set()
+
+        if useInotify:
+            self.enableInotify()
+
+    def getPattern(self):
+        return self._pattern
+
+    def hasInotify(self):
+        return self._fd is not None
+
+    def enableInotify(self):
+        """ Start using inotify (if available) to wake up the wait,
+        keeping the state of the directories already scanned.
+        Return True if inotify is used.
+        """
+        if self._fd is None and _libc is not None:
+            fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                self._watched.clear()
+                for path in self._dirs:
+                    self._watch(path or os.curdir)
+        return self.hasInotify()
+
+    def scan(self):
+        """ Update the directories state and return the sorted list
+        of files that were found since the last scan.
+        """
+        files = set()
+        self._scanDir(self._root, 0, files)
+        newFiles = sorted(files - self._files)
+        self._files = files
+        return newFiles
+
+    def getFiles(self):
+        """ Scan and return the sorted list of all matching files. """
+        self.scan()
+        return sorted(self._files)
+
+    def wait(self, timeout):
+        """ Wait until timeout (in seconds) or until some file
+        is created in the scanned directories (if using inotify).
+        Return True if some inotify event was received.
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            return False
+
+        try:
+            ready = select.select([self._fd], [], [], timeout)[0]
+        except select.error as ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+            return False
+
+        if ready:
+            # Just consume the events, the directories will be scanned
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except OSError:
+                pass
+            return True
+
+        return False
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+    def _listDir(self, path, pattern, isLast):
+        """ Return the names matching the pattern in a directory. For
+        intermediate levels, only directories are returned.
+        """
+        if scandir is not None:
+            entries = [(e.name, e.is_dir()) for e in scandir(path)]
+        else:
+            entries = [(name, None) for name in os.listdir(path)]
+
+        names = []
+        for name, nameIsDir in entries:
+            # Same rule as glob for hidden files
+            if name.startswith('.') and not pattern.startswith('.'):
+                continue
+            if not fnmatch.fnmatch(name, pattern):
+                continue
+            if not isLast:
+                if nameIsDir is None:
+                    nameIsDir = isdir(join(path, name))
+                if not nameIsDir:
+                    continue
+            names.append(name)
+
+        return names
+
+    def _watch(self, path):
+        if self._fd is not None and path not in self._watched:
+            mask = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE
+            # Watches could fail (e.g. the limit of watches is reached),
+            # this directory will be only checked by polling
+            _libc.inotify_add_watch(self._fd, path, mask)
+            self._watched.add(path)
+
+    def _scanDir(self, path, level, files):
+        osPath = path or os.curdir
+        try:
+            mtime = os.stat(osPath).st_mtime
+        except OSError:
+            self._dirs.pop(path, None)
+            return
+
+        pattern = self._levels[level]
+        isLast = level == len(self._levels) - 1
+        cached = self._dirs.get(path)
+
+        if cached is not None and cached[0] == mtime:
+            seenTime = cached[1]
+        else:
+            seenTime = time.time()
+
+        if (cached is not None and cached[0] == mtime and
+                cached[2] - seenTime > self.MTIME_MARGIN):
+            names = cached[3]
+        else:
+            listTime = time.time()
+            try:
+                names = self._listDir(osPath, pattern, isLast)
+            except OSError:
+                self._dirs.pop(path, None)
+                return
+            self._dirs[path] = (mtime, seenTime, listTime, names)
+            self._watch(osPath)
+
+        for name in names:
+            childPath = join(path, name)
+            if isLast:
+                files.add(childPath)
+            else:
+                self._scanDir(childPath, level + 1, files)
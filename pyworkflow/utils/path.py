@@ -427,6 +427,18 @@ def getFileSize(fn):
     return os.stat(fn).st_size
 
 
+def getFileChecksum(fn, algorithm='md5', blockSize=4*1024*1024):
+    """ Compute the checksum of a file reading it by blocks,
+    so big files (e.g. movies) are not loaded in memory.
+    """
+    import hashlib
+    h = hashlib.new(algorithm)
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), ''):
+            h.update(block)
+    return h.hexdigest()
+
+
 def getFileLastModificationDate(fn):
     """ Returns the last modification date of a file or None if it doesn't exist"""
     if os.path.exists(fn):
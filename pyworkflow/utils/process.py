@@ -132,3 +132,19 @@ def isProcessAlive(pid):
     except psutil.NoSuchProcess, e:
         return False
 
+
+
+def acquireLock(lockFile):
+    """ Try to get an exclusive lock on the given file without waiting.
+    Return the opened file that holds the lock or None if the lock is
+    already held by another process. The lock is released when the
+    returned file is closed or the process ends.
+    """
+    import fcntl
+    f = open(lockFile, 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        f.close()
+        return None
+    return f
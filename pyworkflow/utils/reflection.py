@@ -31,6 +31,7 @@ This module contains reflection utilities
 import os, sys
 from os.path import exists, join
 from inspect import isclass
+from collections import MutableMapping
 
 
 
@@ -97,3 +98,98 @@ def getSubclasses(BaseClass, inputDict):
         if isclass(v) and issubclass(v, BaseClass):
             outputDict[k] = v
     return outputDict
+
+
+class LazyClassDict(MutableMapping):
+    """ Dictionary of classes where some entries are only known by
+    a (loader, key) pair. The loader is called with the key the first
+    time one of these classes is requested and it should return a dict
+    with the classes defined there (e.g the classes of a given package).
+    If a default value is provided, it will be returned for missing keys
+    and the 'in' operator will always return True (as pyworkflow.object.Dict).
+    Otherwise, 'in' loads the class, so it is False for classes that
+    the loader does not provide (e.g. if the package can not be imported).
+    """
+    def __init__(self, default=None):
+        self._dict = {} # already loaded classes
+        self._lazy = {} # className -> (loader, key) for not loaded ones
+        self._default = default
+
+    def addLazy(self, name, loader, key):
+        """ Register a class that will be loaded on demand. """
+        self._dict.pop(name, None)
+        self._lazy[name] = (loader, key)
+
+    def _load(self, name):
+        loader, key = self._lazy.pop(name)
+        classes = loader(key)
+        # Resolve all other classes provided by the same loader and key
+        for n, lazyValue in self._lazy.items():
+            if lazyValue[0] is loader and lazyValue[1] == key:
+                del self._lazy[n]
+                if n in classes:
+                    self._dict[n] = classes[n]
+        if name in classes:
+            self._dict[name] = classes[name]
+
+    def loadAll(self):
+        """ Load all the classes that are still pending. """
+        while self._lazy:
+            self._load(next(iter(self._lazy)))
+
+    def _getClass(self, name):
+        if name in self._lazy:
+            self._load(name)
+        return self._dict[name]
+
+    def __getitem__(self, name):
+        try:
+            return self._getClass(name)
+        except KeyError:
+            if self._default is None:
+                raise
+            return self._default
+
+    def get(self, name, default=None):
+        try:
+            return self._getClass(name)
+        except KeyError:
+            return default
+
+    def __setitem__(self, name, value):
+        self._lazy.pop(name, None)
+        self._dict[name] = value
+
+    def __delitem__(self, name):
+        if name in self._lazy:
+            del self._lazy[name]
+        else:
+            del self._dict[name]
+
+    def __contains__(self, name):
+        if self._default is not None or name in self._dict:
+            return True
+        if name in self._lazy:
+            self._load(name)
+            return name in self._dict
+        return False
+
+    def __iter__(self):
+        self.loadAll()
+        return iter(self._dict)
+
+    def __len__(self):
+        return len(self._dict) + len(self._lazy)
+
+    def update(self, *args, **kwargs):
+        """ Same as dict.update but entries of another LazyClassDict
+        are merged without loading them.
+        """
+        if len(args) == 1 and isinstance(args[0], LazyClassDict):
+            other = args[0]
+            for name, cls in other._dict.iteritems():
+                self[name] = cls
+            for name, (loader, key) in other._lazy.iteritems():
+                self.addLazy(name, loader, key)
+            args = ()
+        MutableMapping.update(self, *args, **kwargs)
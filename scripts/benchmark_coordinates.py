@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# **************************************************************************
+
+
+import sys
+import os
+import time
+
+from pyworkflow.object import Integer, Float
+from pyworkflow.em.data import (Micrograph, SetOfMicrographs, Coordinate,
+                                SetOfCoordinates)
+from pyworkflow.em.packages.relion.convert import (writeSetOfCoordinates,
+                                                   openStar)
+
+
+def usage(error):
+    print """
+    ERROR: %s
+
+    Usage: scipion python scripts/benchmark_coordinates.py outputDir
+        [n=1000000] number of coordinates
+        [m=1000] number of micrographs
+        This script will create a SetOfCoordinates and measure the time
+        to export it to Relion star files, one coordinate at a time and
+        with the columns grouped by micrograph.
+    """ % error
+    sys.exit(1)
+
+
+n = len(sys.argv)
+
+if n < 2 or n > 4:
+    usage("Incorrect number of input parameters")
+
+outputDir = sys.argv[1]
+nCoords = 1000000 if n < 3 else int(sys.argv[2])
+nMics = 1000 if n < 4 else int(sys.argv[3])
+
+
+def timeIt(msg, func):
+    t = time.time()
+    func()
+    print "%-45s %8.3f secs" % (msg, time.time() - t)
+
+
+def createSets():
+    micSet = SetOfMicrographs(filename=os.path.join(outputDir, 'mics.sqlite'))
+    micSet.setSamplingRate(1.0)
+    for i in range(1, nMics + 1):
+        micSet.append(Micrograph(location='mic%06d.mrc' % i))
+    micSet.write()
+
+    coordSet = SetOfCoordinates(filename=os.path.join(outputDir,
+                                                      'coords.sqlite'))
+    coordSet.setMicrographs(micSet)
+    coordSet.setBoxSize(100)
+    coord = Coordinate()
+    coord._rlnClassNumber = Integer()
+    coord._rlnAutopickFigureOfMerit = Float()
+    coord._rlnAnglePsi = Float()
+    for i in range(nCoords):
+        coord.setObjId(None)
+        coord.setPosition(i % 4000, i % 3000)
+        coord.setMicId(i % nMics + 1)
+        coord._rlnClassNumber.set(i % 5)
+        coord._rlnAutopickFigureOfMerit.set(i * 0.001)
+        coord._rlnAnglePsi.set(i % 360)
+        coordSet.append(coord)
+    coordSet.write()
+    return coordSet
+
+
+def getStarFile(mic):
+    return mic.getFileName().replace('.mrc', '.star')
+
+
+def writeRowByRow(posDir, coordSet, scale=1):
+    """ Export the coordinates one at a time (as it was done before
+    writeSetOfCoordinates grouped the columns by micrograph).
+    """
+    posDict = {}
+    for mic in coordSet.iterMicrographs():
+        posDict[mic.getObjId()] = os.path.join(posDir, getStarFile(mic))
+
+    f = None
+    lastMicId = None
+
+    for coord in coordSet.iterItems(orderBy='_micId'):
+        micId = coord.getMicId()
+
+        if micId != lastMicId:
+            if f:
+                f.close()
+            f = openStar(posDict[micId], True)
+            lastMicId = micId
+
+        f.write("%d %d %d %0.6f %0.6f\n"
+                % (coord.getX() * scale, coord.getY() * scale,
+                   coord._rlnClassNumber,
+                   coord._rlnAutopickFigureOfMerit,
+                   coord._rlnAnglePsi))
+    if f:
+        f.close()
+
+
+def posDir(name):
+    path = os.path.join(outputDir, name)
+    os.makedirs(path)
+    return path
+
+
+if not os.path.exists(outputDir):
+    os.makedirs(outputDir)
+
+print "Creating %d coordinates in %d micrographs" % (nCoords, nMics)
+coordSet = createSets()
+
+timeIt("   row by row:",
+       lambda: writeRowByRow(posDir('rows'), coordSet, scale=2))
+timeIt("   by micrograph (1 thread):",
+       lambda: writeSetOfCoordinates(posDir('columns'), coordSet,
+                                     getStarFile, scale=2))
+timeIt("   by micrograph (4 threads):",
+       lambda: writeSetOfCoordinates(posDir('columns4'), coordSet,
+                                     getStarFile, scale=2, numberOfThreads=4))
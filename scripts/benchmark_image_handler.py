@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import sys
+import os
+import time
+
+import numpy as np
+
+from pyworkflow.em.convert import ImageHandler
+from pyworkflow.em.image_file import ImageFile
+
+
+def usage(error):
+    print """
+    ERROR: %s
+
+    Usage: scipion python scripts/benchmark_image_handler.py outputDir
+        [n=40000] number of particles in the stack
+        [size=64] particles dimension
+        This script will create a stack of particles and measure the time
+        of some ImageHandler operations when the file is memory-mapped
+        (MRC and SPIDER files) and when it is read with Xmipp.
+    """ % error
+    sys.exit(1)
+
+
+n = len(sys.argv)
+
+if n < 2 or n > 4:
+    usage("Incorrect number of input parameters")
+
+outputDir = sys.argv[1]
+nImgs = 40000 if n < 3 else int(sys.argv[2])
+size = 64 if n < 4 else int(sys.argv[3])
+
+if not os.path.exists(outputDir):
+    os.makedirs(outputDir)
+
+stackFn = os.path.join(outputDir, 'particles.mrcs')
+print "Creating stack %s with %d particles of %d x %d" % (stackFn, nImgs,
+                                                         size, size)
+stackFile = ImageFile.createMrc(stackFn, (size, size, 1, nImgs))
+for chunk in stackFile.iterChunks(1000):
+    chunk[:] = np.random.normal(size=chunk.shape)
+stackFile.close()
+
+
+def timeIt(msg, func):
+    t = time.time()
+    func()
+    print "%-45s %8.3f secs" % (msg, time.time() - t)
+
+
+def runAll(ih, label):
+    print label
+    timeIt("   getDimensions:", lambda: ih.getDimensions(stackFn))
+    timeIt("   read image %d:" % (nImgs / 2),
+           lambda: ih.read((nImgs / 2, stackFn)).getData())
+    timeIt("   getData of image %d:" % (nImgs / 2),
+           lambda: ih.getData((nImgs / 2, stackFn)).sum())
+    timeIt("   computeAverage:", lambda: ih.computeAverage(stackFn))
+    timeIt("   computeStats (100 bins):",
+           lambda: ih.computeStats(stackFn, bins=100))
+    outFn = os.path.join(outputDir, 'converted.mrcs')
+    timeIt("   convertStack (%d images):" % (nImgs / 2),
+           lambda: ih.convertStack(stackFn, outFn, 1, nImgs / 2))
+    os.remove(outFn)
+
+
+runAll(ImageHandler(), "Memory-mapped:")
+
+# Force the Xmipp code path, used for formats not handled by image_file
+ih = ImageHandler()
+ih._openImageFile = lambda location: None
+runAll(ih, "Xmipp:")
+
+os.remove(stackFn)
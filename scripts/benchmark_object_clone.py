@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import sys
+import time
+import resource
+import gc
+
+from pyworkflow.em.data import (Particle, CTFModel, Acquisition, Transform,
+                                Coordinate)
+
+
+def usage(error):
+    print """
+    ERROR: %s
+
+    Usage: scipion python scripts/benchmark_object_clone.py [n=1000000]
+        This script will measure the time and memory used to clone
+        n times a particle with CTF, acquisition, transform and coordinate.
+    """ % error
+    sys.exit(1)
+
+
+n = len(sys.argv)
+
+if n > 2:
+    usage("Incorrect number of input parameters")
+
+nClones = 1000000 if n < 2 else int(sys.argv[1])
+
+particle = Particle(location=(1, '/data/particles.mrcs'))
+particle.setSamplingRate(1.2)
+particle.setCTF(CTFModel(defocusU=12000, defocusV=11000, defocusAngle=45))
+particle.setAcquisition(Acquisition(magnification=60000, voltage=300,
+                                    sphericalAberration=2.,
+                                    amplitudeContrast=0.1))
+particle.setTransform(Transform())
+particle.setCoordinate(Coordinate(x=100, y=200))
+particle.setObjId(1)
+
+
+def getMemory():
+    """ Return the maximum resident memory used (in bytes). """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+gc.collect()
+mem = getMemory()
+t = time.time()
+clones = [particle.clone() for _ in xrange(nClones)]
+t = time.time() - t
+mem = getMemory() - mem
+
+print "Particle clones: %d" % nClones
+print "   time: %0.3f secs (%0.2f us/clone)" % (t, t * 1e6 / nClones)
+print " memory: %0.1f MB (%d bytes/clone)" % (mem / 1024.**2, mem / nClones)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import sys, os
+import time
+
+from pyworkflow.manager import Manager
+import pyworkflow.utils as pwutils
+import pyworkflow.protocol as pwprot
+
+
+def usage(error):
+    print """
+    ERROR: %s
+
+    Usage: scipion python scripts/benchmark_project_runs.py
+        name="project name"
+        [runs=300] number of runs to create in the project
+        [active=20] how many of them will be running
+        This script will create a project with many runs and measure
+        the time to load and refresh them (as done by the GUI).
+    """ % error
+    sys.exit(1)
+
+
+n = len(sys.argv)
+
+if n < 2 or n > 4:
+    usage("Incorrect number of input parameters")
+
+projName = sys.argv[1]
+nRuns = 300 if n < 3 else int(sys.argv[2])
+nActive = 20 if n < 4 else int(sys.argv[3])
+
+path = os.path.join(os.environ['SCIPION_HOME'], 'pyworkflow', 'gui', 'no-tkinter')
+sys.path.insert(1, path)
+
+from pyworkflow.em.protocol import ProtStress
+
+manager = Manager()
+
+if manager.hasProject(projName):
+    usage("There is already a project with this name: %s"
+          % pwutils.red(projName))
+
+print "Creating project '%s' with %d runs (%d running)" % (projName, nRuns,
+                                                           nActive)
+project = manager.createProject(projName)
+os.chdir(project.getPath())  # runs paths are relative to the project
+runs = []
+
+for i in range(nRuns):
+    prot = project.newProtocol(ProtStress, objLabel='stress %d' % i)
+    if i < nActive:
+        prot.setStatus(pwprot.STATUS_RUNNING)
+    else:
+        prot.setStatus(pwprot.STATUS_FINISHED)
+    # Setup directly (not saveProtocol) to skip the dependencies check
+    project._setupProtocol(prot)
+    prot.makePathsAndClean()
+    runs.append(prot)
+
+# As done when launching, the run.db is a copy of the project db
+for prot in runs:
+    pwutils.copyFile(project.dbPath, prot.getDbPath())
+
+
+def timeIt(msg, func):
+    t = time.time()
+    func()
+    print "%-45s %8.3f secs" % (msg, time.time() - t)
+
+
+def touchRunDbs(runs):
+    for prot in runs:
+        os.utime(prot.getDbPath(), None)
+
+
+projPath = manager.getProjectPath(projName)
+project = manager.loadProject(projName)
+
+timeIt("Load runs (first time):",
+       lambda: project.getRunsGraph(refresh=True))
+# Active runs are loaded again until their run.db mtime tick is over
+time.sleep(pwprot.DB_MTIME_MARGIN + 1)
+timeIt("Refresh runs, after the mtime tick:",
+       lambda: project.getRunsGraph(refresh=True))
+timeIt("Refresh runs, nothing changed:",
+       lambda: project.getRunsGraph(refresh=True))
+activeRuns = [r for r in project.getRuns(refresh=False) if r.isActive()]
+touchRunDbs(activeRuns[:max(1, nActive / 4)])
+timeIt("Refresh runs, %d run.db modified:" % max(1, nActive / 4),
+       lambda: project.getRunsGraph(refresh=True))
+# Modify the project db from another connection (as other processes do)
+project2 = manager.loadProject(projName)
+lastRun = project2.getRuns()[-1]
+lastRun.setObjLabel('modified')
+project2._storeProtocol(lastRun)
+timeIt("Refresh runs, project db modified:",
+       lambda: project.getRunsGraph(refresh=True))
+
+print "Project created at: ", projPath
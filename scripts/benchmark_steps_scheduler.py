@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import sys
+import time
+
+from pyworkflow.protocol import Step
+from pyworkflow.protocol.executor import StepExecutor, ThreadStepExecutor
+
+
+def usage(error):
+    print """
+    ERROR: %s
+
+    Usage: scipion python scripts/benchmark_steps_scheduler.py [n=100000]
+        [threads=4]
+        This script will run n empty steps, forming a binary tree of
+        dependencies, with the serial and the threaded executors and
+        print the scheduling overhead per step.
+    """ % error
+    sys.exit(1)
+
+
+n = len(sys.argv)
+
+if n > 3:
+    usage("Incorrect number of input parameters")
+
+nSteps = 100000 if n < 2 else int(sys.argv[1])
+nThreads = 4 if n < 3 else int(sys.argv[2])
+
+
+def createSteps(n):
+    """ Create n steps forming a binary tree of dependencies. """
+    steps = []
+    for i in range(1, n+1):
+        step = Step()
+        step.setIndex(i)
+        if i > 1:
+            step.addPrerequisites(i/2)
+        steps.append(step)
+    return steps
+
+
+for executor in [StepExecutor(hostConfig=None),
+                 ThreadStepExecutor(None, nThreads)]:
+    steps = createSteps(nSteps)
+    finished = []
+    t = time.time()
+    executor.runSteps(steps, lambda step: None,
+                      lambda step: finished.append(step) or True,
+                      lambda: None)
+    elapsed = time.time() - t
+    print "%-20s %d steps in %0.2f secs (%0.1f us/step)" % (
+        executor.__class__.__name__, len(finished), elapsed,
+        elapsed * 1e6 / nSteps)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import sys
+import time
+import tempfile
+import shutil
+
+from pyworkflow.protocol import Protocol
+
+
+def usage(error):
+    print """
+    ERROR: %s
+
+    Usage: scipion python scripts/benchmark_steps_storage.py [new=10]
+        [sizes=100,1000,5000]
+        This script will simulate streaming checks that insert 'new' steps
+        on protocols with an increasing number of existing steps, and print
+        the cost per check when rewriting all the steps and when only
+        storing the new or modified ones.
+    """ % error
+    sys.exit(1)
+
+
+n = len(sys.argv)
+
+if n > 3:
+    usage("Incorrect number of input parameters")
+
+newSteps = 10 if n < 2 else int(sys.argv[1])
+sizes = [100, 1000, 5000] if n < 3 else map(int, sys.argv[2].split(','))
+
+
+class BenchmarkProtocol(Protocol):
+    def emptyStep(self, s):
+        pass
+
+
+def poll(prot, storeFunc):
+    """ Insert some steps, make the join step (the first one) depends
+    on them and store the steps.
+    """
+    deps = [prot._insertFunctionStep('emptyStep', 'new')
+            for _ in range(newSteps)]
+    prot._steps[0].addPrerequisites(*deps)
+    t = time.time()
+    storeFunc()
+    return time.time() - t
+
+
+tmpDir = tempfile.mkdtemp()
+
+try:
+    for label in ['full rewrite', 'incremental']:
+        prot = BenchmarkProtocol(workingDir=tempfile.mkdtemp(dir=tmpDir))
+        prot.makePathsAndClean()
+        prot._insertFunctionStep('emptyStep', 'join')
+        prot.updateSteps()
+        storeFunc = (prot._storeSteps if label == 'full rewrite'
+                     else prot.updateSteps)
+        for size in sizes:
+            while len(prot._steps) < size:
+                poll(prot, storeFunc)
+            elapsed = poll(prot, storeFunc)
+            print "%-15s %6d existing steps, %0.2f ms/check" % (
+                label, size, elapsed * 1000)
+finally:
+    shutil.rmtree(tmpDir)